@@ -0,0 +1,153 @@
+'''
+    Batch scoring of the candidates of a decision.
+
+    The available moves and switches of a battle are turned into arrays once
+    (base power, type ordinals, types of the bench) and every candidate is scored
+    in a single vectorized pass over DUAL_MATRIX, instead of looping over the
+    candidates and recomputing base_power/100 * multiplier for each one.
+'''
+import numpy as np
+from type_effectiveness import DUAL_MATRIX, NO_TYPE, type_index
+
+
+MAX_MOVES : int = 4 # Moves known by a pokemon in gen 9
+
+# Base power and type ordinal of every move seen in this process, keyed by move id.
+# Both are static data of the move, and reading them through Move is costly
+_MOVE_FEATURES : dict = {}
+
+
+def move_features(move) -> tuple:
+    '''
+        Returns (base_power, type ordinal) of the move
+    '''
+    features = _MOVE_FEATURES.get(move.id)
+    if features is None:
+        features = (move.base_power, type_index(move.type))
+        _MOVE_FEATURES[move.id] = features
+    return features
+
+
+def last_argmax(scores : np.ndarray) -> int:
+    '''
+        Index of the last maximum, the same candidate a `score >= best_score` loop keeps
+    '''
+    return len(scores) - 1 - int(np.argmax(scores[::-1]))
+
+
+def running_best(compared : np.ndarray, stored : np.ndarray) -> int:
+    '''
+        Index kept by a loop that compares `compared[i] >= best_score` but stores
+        `best_score = stored[i]`. Only needed while both vectors differ
+    '''
+    best_index = -1
+    best_score = -np.inf
+    for i, score in enumerate(compared.tolist()):
+        if score >= best_score:
+            best_score = stored[i]
+            best_index = i
+    return best_index
+
+
+def defender_indices(mon, terastallized : bool = False) -> tuple:
+    '''
+        Type ordinals used to look up the multipliers against mon.
+        A terastallized target only keeps its tera type
+    '''
+    if terastallized and mon.tera_type is not None:
+        return type_index(mon.tera_type), NO_TYPE
+    type_1, type_2 = mon.types
+    return type_index(type_1), type_index(type_2)
+
+
+class MoveBatch:
+    '''
+        Arrays describing a list of moves (usually battle.available_moves)
+    '''
+
+    def __init__(self, moves : list):
+        self.moves = moves
+        features = np.array([move_features(move) for move in moves], dtype=np.float64).reshape(len(moves), 2)
+        self.base_power = features[:, 0]
+        self.type_index = features[:, 1].astype(np.intp)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def multipliers(self, opp_mon) -> np.ndarray:
+        '''
+            Multipliers of every move in its two variants, shape (2, n_moves):
+            row 0 against the current types of opp_mon, row 1 against its tera type only
+        '''
+        defenders = np.array([defender_indices(opp_mon, False), defender_indices(opp_mon, True)], dtype=np.intp)
+        return DUAL_MATRIX[self.type_index[None, :], defenders[:, 0, None], defenders[:, 1, None]]
+
+    def scores(self, opp_mon, terastallized : bool = False) -> tuple:
+        '''
+            Scores base_power/100 * multiplier for every move in one pass.
+            Returns (multipliers, scores) for the requested variant
+        '''
+        type_1, type_2 = defender_indices(opp_mon, terastallized)
+        multipliers = DUAL_MATRIX[self.type_index, type_1, type_2]
+        return multipliers, self.base_power / 100 * multipliers
+
+    def best_move(self, opp_mon, terastallized : bool = False) -> tuple:
+        '''
+            Returns the index of the best move and the full score vector
+        '''
+        _, scores = self.scores(opp_mon, terastallized)
+        return last_argmax(scores), scores
+
+
+class SwitchBatch:
+    '''
+        Arrays describing the pokemons that can be switched in (usually battle.available_switches)
+    '''
+
+    def __init__(self, mons : list):
+        self.mons = mons
+        n_moves = max([MAX_MOVES] + [len(mon.moves) for mon in mons])
+        types = []
+        moves = []
+
+        for mon in mons:
+            types.append([type_index(type_) if type_ else NO_TYPE for type_ in mon.types])
+            features = [move_features(move) for move in mon.moves.values() if move]
+            # Padding with moves without base power, so they do not add anything
+            moves.append(features + [(0, NO_TYPE)] * (n_moves - len(features)))
+
+        self.type_index = np.array(types, dtype=np.intp).reshape(len(mons), 2)
+        moves = np.array(moves, dtype=np.float64).reshape(len(mons), n_moves, 2)
+        self.base_power = moves[:, :, 0]
+        self.move_type_index = moves[:, :, 1].astype(np.intp)
+
+    def __len__(self):
+        return len(self.mons)
+
+    def scores(self, opp_mon) -> np.ndarray:
+        '''
+            typing_advantage + moves_advantage of every candidate against opp_mon in one pass
+        '''
+        opp_1, opp_2 = defender_indices(opp_mon)
+        opp_rows = np.array([type_index(type_) for type_ in opp_mon.types if type_], dtype=np.intp)
+
+        # Type advantage of every candidate over the opponent
+        a_on_b = DUAL_MATRIX[self.type_index, opp_1, opp_2]
+        a_on_b = np.where(self.type_index == NO_TYPE, -np.inf, a_on_b).max(axis=1)
+
+        # Type advantage of the opponent over every candidate
+        if len(opp_rows):
+            b_on_a = DUAL_MATRIX[opp_rows[:, None], self.type_index[None, :, 0], self.type_index[None, :, 1]].max(axis=0)
+        else:
+            b_on_a = np.full(len(self.mons), -np.inf)
+
+        moves_advantage = (self.base_power / 100 * DUAL_MATRIX[self.move_type_index, opp_1, opp_2]).sum(axis=1)
+
+        return a_on_b - b_on_a + moves_advantage
+
+    def best_switch(self, opp_mon) -> tuple:
+        '''
+            Returns the index of the first best candidate and the full score vector
+        '''
+        scores = self.scores(opp_mon)
+        return int(np.argmax(scores)), scores
@@ -0,0 +1,181 @@
+'''
+    Synthetic gen 9 battles built without a Showdown server.
+
+    A fixture is a real poke_env Battle, fed with the same request and protocol
+    messages the server would send: a random team of 6 for our side (with stats,
+    abilities and the moves of its learnset), a random opponent switched in, and
+    optionally boosts, statuses, weather, trick room and a terastallized opponent.
+    The decision functions of the bots can then be called on it offline, for
+    benchmarks or to compare two versions of a heuristic.
+'''
+import logging
+import random
+from poke_env.data import GenData
+from poke_env.environment.battle import Battle
+from poke_env.environment.double_battle import DoubleBattle
+
+GEN : int = 9
+LEVEL : int = 80
+PLAYER_USERNAME : str = 'fixture_player'
+OPPONENT_USERNAME : str = 'fixture_opponent'
+
+STATS : tuple = ('atk', 'def', 'spa', 'spd', 'spe')
+BOOSTABLE_STATS : tuple = ('atk', 'def', 'spa', 'spd', 'spe', 'accuracy', 'evasion')
+STATUSES : tuple = ('brn', 'par', 'psn', 'tox', 'slp', 'frz')
+WEATHERS : tuple = ('SunnyDay', 'RainDance', 'Sandstorm', 'Snow')
+TERA_TYPES : tuple = ('Normal', 'Fire', 'Water', 'Electric', 'Grass', 'Ice', 'Fighting', 'Poison', 'Ground',
+                      'Flying', 'Psychic', 'Bug', 'Rock', 'Ghost', 'Dragon', 'Dark', 'Steel', 'Fairy')
+
+_LOGGER = logging.getLogger('battle_fixtures')
+_LOGGER.addHandler(logging.NullHandler())
+_SPECIES : list = None # (species name, ability, move ids available in gen 9), loaded once
+
+
+def _gen9_species() -> list:
+    '''
+        Species of the pokedex that can learn at least 4 gen 9 moves, one of them damaging
+    '''
+    global _SPECIES
+    if _SPECIES is None:
+        data = GenData.from_gen(GEN)
+        _SPECIES = []
+        for species, entry in data.learnset.items():
+            if species not in data.pokedex or data.pokedex[species]['num'] <= 0:
+                continue
+            moves = sorted(
+                move for move, sources in entry.get('learnset', {}).items()
+                if move in data.moves and not data.moves[move].get('isNonstandard')
+                and any(source.startswith(str(GEN)) for source in sources)
+            )
+            if len(moves) >= 4 and any(data.moves[move]['basePower'] > 0 for move in moves):
+                entry = data.pokedex[species]
+                ability = next(iter(entry['abilities'].values())).lower().replace(' ', '')
+                _SPECIES.append((entry['name'], ability, moves))
+    return _SPECIES
+
+
+def _random_moves(rng : random.Random, moves : list) -> list:
+    '''
+        4 moves, at least 2 of them damaging when the species has them (like random battle sets)
+    '''
+    moves_data = GenData.from_gen(GEN).moves
+    damaging = [move for move in moves if moves_data[move]['basePower'] > 0]
+    chosen = rng.sample(damaging, min(2, len(damaging)))
+    others = [move for move in moves if move not in chosen]
+    return chosen + rng.sample(others, 4 - len(chosen))
+
+
+def _request_pokemon(rng : random.Random, role : str, species : str, ability : str, moves : list, active : bool) -> dict:
+    hp = rng.randint(150, 350)
+    return {
+        'ident': f'{role}: {species}',
+        'details': f'{species}, L{LEVEL}',
+        'condition': f'{rng.randint(1, hp)}/{hp}',
+        'active': active,
+        'stats': {stat: rng.randint(80, 300) for stat in STATS},
+        'moves': moves,
+        'baseAbility': ability,
+        'item': '',
+        'teraType': rng.choice(TERA_TYPES),
+        'terastallized': '',
+    }
+
+
+def make_battle(seed : int = None, boosts : bool = True, statuses : bool = True, weather : bool = True,
+                trick_room : bool = True, tera : bool = True, battle_tag : str = None) -> Battle:
+    '''
+        Builds a random battle at the start of a turn, waiting for a decision of our side (p1).
+        Every optional condition is applied with a probability of 1/2 when enabled
+    '''
+    rng = random.Random(seed)
+    battle = Battle(battle_tag or f'battle-gen9randombattle-{seed}', PLAYER_USERNAME, _LOGGER, gen=GEN)
+    battle.parse_message(['', 'player', 'p1', PLAYER_USERNAME, '1', ''])
+    battle.parse_message(['', 'player', 'p2', OPPONENT_USERNAME, '2', ''])
+
+    species = _gen9_species()
+    team = rng.sample(species, 7)
+    side = [
+        _request_pokemon(rng, 'p1', name, ability, _random_moves(rng, moves), i == 0)
+        for i, (name, ability, moves) in enumerate(team[:6])
+    ]
+    active_moves = [{'move': move, 'id': move, 'pp': 16, 'maxpp': 16, 'target': 'normal', 'disabled': False} for move in side[0]['moves']]
+    active_request = {'moves': active_moves}
+    if tera:
+        active_request['canTerastallize'] = side[0]['teraType']
+
+    battle.parse_message(['', 'switch', f'p1a: {team[0][0]}', side[0]['details'], side[0]['condition']])
+    opponent = team[6][0]
+    battle.parse_message(['', 'switch', f'p2a: {opponent}', f'{opponent}, L{LEVEL}', f'{rng.randint(1, 100)}/100'])
+
+    if boosts:
+        for role in ('p1a', 'p2a'):
+            if rng.random() < 0.5:
+                for stat in rng.sample(BOOSTABLE_STATS, rng.randint(1, 3)):
+                    amount = rng.choice((-2, -1, 1, 2))
+                    battle.parse_message(['', '-boost' if amount > 0 else '-unboost', f'{role}: {team[0][0] if role == "p1a" else opponent}', stat, str(abs(amount))])
+    if statuses:
+        for role, name in (('p1a', team[0][0]), ('p2a', opponent)):
+            if rng.random() < 0.5:
+                battle.parse_message(['', '-status', f'{role}: {name}', rng.choice(STATUSES)])
+    if weather and rng.random() < 0.5:
+        battle.parse_message(['', '-weather', rng.choice(WEATHERS)])
+    if trick_room and rng.random() < 0.5:
+        battle.parse_message(['', '-fieldstart', 'move: Trick Room'])
+    if tera and rng.random() < 0.5:
+        battle.parse_message(['', '-terastallize', f'p2a: {opponent}', rng.choice(TERA_TYPES)])
+
+    battle.parse_message(['', 'turn', str(rng.randint(1, 20))])
+    battle.parse_request({'active': [active_request], 'side': {'name': PLAYER_USERNAME, 'id': 'p1', 'pokemon': side}, 'rqid': 1})
+    return battle
+
+
+def make_double_battle(seed : int = None, weather : bool = True, trick_room : bool = True, tera : bool = True,
+                       battle_tag : str = None) -> DoubleBattle:
+    '''
+        Builds a random doubles battle at the start of a turn, two active pokemons on each
+        side, waiting for a decision of our side (p1)
+    '''
+    rng = random.Random(seed)
+    battle = DoubleBattle(battle_tag or f'battle-gen9randomdoublesbattle-{seed}', PLAYER_USERNAME, _LOGGER, gen=GEN)
+    battle.parse_message(['', 'player', 'p1', PLAYER_USERNAME, '1', ''])
+    battle.parse_message(['', 'player', 'p2', OPPONENT_USERNAME, '2', ''])
+
+    team = rng.sample(_gen9_species(), 8)
+    side = [
+        _request_pokemon(rng, 'p1', name, ability, _random_moves(rng, moves), i < 2)
+        for i, (name, ability, moves) in enumerate(team[:6])
+    ]
+    moves_data = GenData.from_gen(GEN).moves
+    active_requests = []
+    for slot, position in enumerate('ab'):
+        battle.parse_message(['', 'switch', f'p1{position}: {team[slot][0]}', side[slot]['details'], side[slot]['condition']])
+        opponent = team[6 + slot][0]
+        battle.parse_message(['', 'switch', f'p2{position}: {opponent}', f'{opponent}, L{LEVEL}', f'{rng.randint(1, 100)}/100'])
+        active_moves = [{'move': move, 'id': move, 'pp': 16, 'maxpp': 16, 'target': moves_data[move]['target'], 'disabled': False}
+                        for move in side[slot]['moves']]
+        active_requests.append({'moves': active_moves})
+        if tera:
+            active_requests[-1]['canTerastallize'] = side[slot]['teraType']
+
+    if weather and rng.random() < 0.5:
+        battle.parse_message(['', '-weather', rng.choice(WEATHERS)])
+    if trick_room and rng.random() < 0.5:
+        battle.parse_message(['', '-fieldstart', 'move: Trick Room'])
+
+    battle.parse_message(['', 'turn', str(rng.randint(1, 20))])
+    battle.parse_request({'active': active_requests, 'side': {'name': PLAYER_USERNAME, 'id': 'p1', 'pokemon': side}, 'rqid': 1})
+    return battle
+
+
+def make_battles(n : int, seed : int = 0, **kwargs) -> list:
+    '''
+        n fixtures with consecutive seeds, so the same seed always gives the same battles
+    '''
+    return [make_battle(seed + i, battle_tag=f'battle-gen9randombattle-{seed + i}', **kwargs) for i in range(n)]
+
+
+def make_double_battles(n : int, seed : int = 0, **kwargs) -> list:
+    '''
+        n doubles fixtures with consecutive seeds
+    '''
+    return [make_double_battle(seed + i, battle_tag=f'battle-gen9randomdoublesbattle-{seed + i}', **kwargs) for i in range(n)]
@@ -0,0 +1,102 @@
+'''
+    Bounded retention of the finished battles of a player.
+
+    poke_env keeps every Battle a player plays in player.battles, for the whole life of
+    the process, and its win counters are recomputed from them. BattleRetention goes
+    before Player in the bases of a bot: every finished battle is reduced to a
+    BattleRecord and counted, and the full Battle is evicted once more than
+    max_retained_battles have finished after it or it finished more than
+    max_battle_age seconds ago. n_won_battles, n_finished_battles, n_lost_battles (so
+    n_tied_battles and win_rate too) come from the running counters, so they stay
+    right after the eviction.
+
+    The battles evicted are the oldest ones, when a newer battle finishes: the last one
+    is always kept, since poke_env waits forever for a battle it does not know when a
+    late message of its room arrives.
+'''
+import time
+from collections import OrderedDict, deque, namedtuple
+
+BattleRecord = namedtuple('BattleRecord', 'tag, won, turns, remaining_hp, opponent_remaining_hp, finished_at')
+
+
+def remaining_hp(team : dict) -> float:
+    '''
+        Sum of the HP fractions left in a team, 0 for the fainted pokemons
+    '''
+    return float(sum(mon.current_hp_fraction for mon in team.values()))
+
+
+class BattleRetention:
+    '''
+        Player mixin. Without max_retained_battles nor max_battle_age every battle is
+        kept, as in poke_env, but the counters and records are still there
+    '''
+
+    def __init__(self, *args, max_retained_battles : int = None, max_battle_age : float = None,
+                 max_records : int = 1000, **kwargs):
+        if max_retained_battles is not None and max_retained_battles < 1:
+            raise ValueError('max_retained_battles must keep at least the last battle')
+        super().__init__(*args, **kwargs)
+        self.max_retained_battles = max_retained_battles
+        self.max_battle_age = max_battle_age # seconds
+        self.records : deque = deque(maxlen=max_records) # Last BattleRecords, oldest first
+        self._finished : OrderedDict = OrderedDict() # tag -> finish time of the battles still retained
+        self._n_won : int = 0
+        self._n_lost : int = 0
+        self._n_finished : int = 0
+        self.total_turns : int = 0
+        self.n_evicted_battles : int = 0
+
+    def _battle_finished_callback(self, battle):
+        now = time.monotonic()
+        self.records.append(BattleRecord(battle.battle_tag, battle.won, battle.turn, remaining_hp(battle.team),
+                                         remaining_hp(battle.opponent_team), now))
+        self._n_finished += 1
+        self._n_won += bool(battle.won)
+        self._n_lost += bool(battle.lost)
+        self.total_turns += battle.turn
+        self._finished[battle.battle_tag] = now
+        self.evict(now)
+        super()._battle_finished_callback(battle)
+
+    def evict(self, now : float = None):
+        '''
+            Drops the oldest finished battles beyond the count or the age allowed
+        '''
+        now = time.monotonic() if now is None else now
+        while len(self._finished) > 1:
+            tag, finished_at = next(iter(self._finished.items()))
+            too_many = self.max_retained_battles is not None and len(self._finished) > self.max_retained_battles
+            too_old = self.max_battle_age is not None and now - finished_at > self.max_battle_age
+            if not too_many and not too_old:
+                break
+            del self._finished[tag]
+            if self._battles.pop(tag, None) is not None:
+                self.n_evicted_battles += 1
+
+    def reset_battles(self):
+        super().reset_battles()
+        self.records.clear()
+        self._finished.clear()
+        self._n_won = self._n_lost = self._n_finished = self.total_turns = 0
+
+    @property
+    def n_finished_battles(self) -> int:
+        return self._n_finished
+
+    @property
+    def n_won_battles(self) -> int:
+        return self._n_won
+
+    @property
+    def n_lost_battles(self) -> int:
+        return self._n_lost
+
+    @property
+    def mean_turns(self) -> float:
+        return self.total_turns / self._n_finished if self._n_finished else 0.0
+
+    def retention_stats(self) -> dict:
+        return {'retained': len(self._battles), 'evicted': self.n_evicted_battles, 'records': len(self.records),
+                'finished': self._n_finished, 'won': self._n_won, 'lost': self._n_lost, 'mean_turns': self.mean_turns}
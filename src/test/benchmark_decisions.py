@@ -0,0 +1,238 @@
+'''
+    Offline benchmark of the decision functions of the bots.
+
+    Every function is called on the same synthetic battles of battle_fixtures (no
+    Showdown server needed) and timed call by call, then called once more per battle
+    under tracemalloc to measure the memory it allocates. The results are written as
+    JSON, so the file of a previous commit can be given to --compare to spot
+    regressions:
+
+        python benchmark_decisions.py --output new.json --compare old.json
+'''
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from battle_fixtures import make_battles, make_double_battles
+from heuristic_bot import HeuristicPlayer
+from max_bot import MaxDamagePlayer
+from simpleRL_bot import BattleEmbedder, embed_battle
+from damage_calc import DamageBatch, expected_damage
+from doubles_engine import DoublesHeuristicPlayer
+from trajectory_logger import TrajectoryLogger, log_trajectories
+
+BENCHMARK_FILE : str = 'benchmark_results.json'
+
+
+def decision_functions() -> dict:
+    '''
+        Functions of a battle to benchmark, by name
+    '''
+    heuristic = HeuristicPlayer(battle_format='gen9randombattle', start_listening=False)
+    max_damage = MaxDamagePlayer(battle_format='gen9randombattle', start_listening=False)
+    heuristic_damage = HeuristicPlayer(battle_format='gen9randombattle', start_listening=False, use_damage_calc=True)
+    max_damage_calc = MaxDamagePlayer(battle_format='gen9randombattle', start_listening=False, use_damage_calc=True)
+    embedder = BattleEmbedder()
+    # The rows stay pending in the logger, as in the running battles, nothing is written
+    heuristic_logged = log_trajectories(HeuristicPlayer(battle_format='gen9randombattle', start_listening=False),
+                                        TrajectoryLogger(tempfile.mkdtemp(prefix='benchmark_trajectories_')))
+
+    def heuristic_choose_move(player):
+        def choose_move(battle):
+            # The turn and the last action change the next decision, every call starts from
+            # the same ones. The matchup data of the context is kept, as in a running battle
+            context = player.context(battle)
+            context.current_turn = 0
+            context.last_move = None
+            return player.choose_move(battle)
+        return choose_move
+
+    return {
+        'HeuristicPlayer.choose_move': heuristic_choose_move(heuristic),
+        'HeuristicPlayer.choose_move (damage calc)': heuristic_choose_move(heuristic_damage),
+        'HeuristicPlayer.choose_move (trajectories)': heuristic_choose_move(heuristic_logged),
+        'MaxDamagePlayer.choose_move': max_damage.choose_move,
+        'MaxDamagePlayer.choose_move (damage calc)': max_damage_calc.choose_move,
+        'DamageBatch.expected': lambda battle: DamageBatch(battle.active_pokemon, battle.available_moves, battle.can_tera).expected(
+            [battle.opponent_active_pokemon], battle.weather),
+        'expected_damage': lambda battle: expected_damage(battle.active_pokemon, battle.available_moves,
+                                                          battle.opponent_active_pokemon, battle.weather, battle.can_tera),
+        'embed_battle': embed_battle,
+        'SimpleRLPlayer.embed_battle': embedder,
+        'stats_balance': lambda battle: heuristic.stats_balance(battle.active_pokemon, battle.opponent_active_pokemon, False),
+        'typing_advantage': lambda battle: heuristic.typing_advantage(battle.active_pokemon, battle.opponent_active_pokemon, False),
+        'status_condition': lambda battle: heuristic.status_condition(battle.active_pokemon, battle.opponent_active_pokemon, False),
+        'weather_condition': lambda battle: heuristic.weather_condition(battle.active_pokemon, battle.opponent_active_pokemon, battle, False),
+    }
+
+
+def doubles_functions() -> dict:
+    '''
+        Functions of a doubles battle to benchmark, by name
+    '''
+    doubles = DoublesHeuristicPlayer(battle_format='gen9randomdoublesbattle', start_listening=False)
+    return {
+        'DoublesHeuristicPlayer.choose_move': doubles.choose_move,
+    }
+
+
+def time_function(function, battles : list, repeats : int) -> np.ndarray:
+    '''
+        Duration of every call in microseconds, after one warm-up pass
+    '''
+    for battle in battles:
+        function(battle)
+
+    durations = np.empty(repeats * len(battles))
+    i = 0
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            for battle in battles:
+                start_time = time.perf_counter_ns()
+                function(battle)
+                durations[i] = time.perf_counter_ns() - start_time
+                i += 1
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return durations / 1000
+
+
+def measure_allocations(function, battles : list) -> tuple:
+    '''
+        Mean (peak bytes, allocated blocks still alive) per call
+    '''
+    tracemalloc.start()
+    peaks = []
+    blocks = []
+    try:
+        for battle in battles:
+            before = tracemalloc.take_snapshot()
+            size_before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            function(battle)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - size_before)
+            statistics = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+            blocks.append(sum(max(statistic.count_diff, 0) for statistic in statistics))
+    finally:
+        tracemalloc.stop()
+    return float(np.mean(peaks)), float(np.mean(blocks))
+
+
+def run_benchmark(n_battles : int = 200, repeats : int = 20, seed : int = 0) -> dict:
+    battles = make_battles(n_battles, seed)
+    double_battles = make_double_battles(n_battles, seed)
+    functions = [(name, function, battles) for name, function in decision_functions().items()]
+    functions += [(name, function, double_battles) for name, function in doubles_functions().items()]
+    results = {}
+    for name, function, battles in functions:
+        durations = time_function(function, battles, repeats)
+        peak_bytes, blocks = measure_allocations(function, battles)
+        results[name] = {
+            'mean_us': float(durations.mean()),
+            'median_us': float(np.median(durations)),
+            'p95_us': float(np.percentile(durations, 95)),
+            'peak_bytes': peak_bytes,
+            'retained_blocks': blocks,
+        }
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'n_battles': n_battles,
+            'repeats': repeats,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(benchmark : dict, path : str = BENCHMARK_FILE):
+    with open(path, 'w') as file:
+        json.dump(benchmark, file, indent=4)
+
+
+def load_results(path : str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare_results(current : dict, previous : dict, tolerance : float = 0.1) -> dict:
+    '''
+        Ratio current / previous of the mean time of every function present in both runs,
+        and whether it is slower than the tolerance allows
+    '''
+    comparison = {}
+    for name, result in current['results'].items():
+        if name in previous['results']:
+            ratio = result['mean_us'] / previous['results'][name]['mean_us']
+            comparison[name] = {'ratio': ratio, 'regression': ratio > 1 + tolerance}
+    return comparison
+
+
+def overhead(benchmark : dict, suffix : str = ' (damage calc)') -> dict:
+    '''
+        Median time of every function with the option of suffix over the same function
+        without it, on the same battles: use_damage_calc over the base power ranking by default
+    '''
+    results = benchmark['results']
+    return {name[:-len(suffix)]: result['median_us'] / results[name[:-len(suffix)]]['median_us']
+            for name, result in results.items() if name.endswith(suffix) and name[:-len(suffix)] in results}
+
+
+def print_report(benchmark : dict, comparison : dict = None):
+    print(f"Commit {benchmark['meta']['commit']}, {benchmark['meta']['n_battles']} battles x {benchmark['meta']['repeats']} repeats")
+    print(f"{'function':<45}{'mean us':>10}{'median us':>11}{'p95 us':>10}{'peak B':>10}{'blocks':>8}{'vs prev':>10}")
+    for name, result in benchmark['results'].items():
+        line = (
+            f"{name:<45}{result['mean_us']:>10.2f}{result['median_us']:>11.2f}{result['p95_us']:>10.2f}"
+            f"{result['peak_bytes']:>10.0f}{result['retained_blocks']:>8.1f}"
+        )
+        if comparison and name in comparison:
+            line += f"{comparison[name]['ratio']:>9.2f}x"
+            if comparison[name]['regression']:
+                line += ' REGRESSION'
+        print(line)
+    for name, ratio in overhead(benchmark).items():
+        print(f'{name} with damage calc: {ratio:.2f}x the base power ranking')
+    for name, ratio in overhead(benchmark, ' (trajectories)').items():
+        print(f'{name} with trajectories: {ratio:.2f}x without logging')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the decision functions of the bots')
+    parser.add_argument('--battles', type=int, default=200, help='number of synthetic battles')
+    parser.add_argument('--repeats', type=int, default=20, help='timed passes over the battles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=BENCHMARK_FILE, help='JSON file for the results')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slowdown reported as a regression')
+    args = parser.parse_args()
+
+    benchmark = run_benchmark(args.battles, args.repeats, args.seed)
+    comparison = None
+    if args.compare:
+        comparison = compare_results(benchmark, load_results(args.compare), args.tolerance)
+    save_results(benchmark, args.output)
+    print_report(benchmark, comparison)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,190 @@
-import sys
+'''
+    Entry point to play the bots against each other.
+
+    Without arguments it shows the interactive menu. With a mode it runs without any prompt:
+        python campo_combate.py random-random 100
+        python campo_combate.py heuristic-max 100 --incumbent 0.55
+        python campo_combate.py heuristic-random 100 --trajectories trajectories
+        python campo_combate.py heuristic-max 100 --instrument
+        python campo_combate.py search 50 --generations 10 --population 8 --early-stopping
+        python campo_combate.py search 50 --generations 10 --restart
+        python campo_combate.py search 500 --generations 50 --local
+        python campo_combate.py tournament 1000 --ports 8000,8001 --matchup 4
+        python campo_combate.py league league.json
+        python campo_combate.py check-env
+    --startup-time prints how long the mode took to be ready to play (imports and players
+    created, from the start of this module) and exits before playing.
+
+    Every module a mode needs is imported when the mode runs and every player is created
+    by its factory the first time it is used, so a short run only pays for what it uses.
+'''
+import time
+_MODULE_START : float = time.perf_counter()
+import argparse
 import asyncio
+import os
+import sys
 import textwrap
-import time
-import matplotlib.pyplot as plt
-import numpy as np
-import gymnasium as gym
-from poke_env import AccountConfiguration,Player,RandomPlayer
-from max_bot import MaxDamagePlayer
-from heuristic_bot import HeuristicPlayer
-from simpleRL_bot import SimpleRLPlayer
-from gymnasium.utils.env_checker import check_env
 
 
 #battle_format="gen9vgc2024regg"
 
-first_player = RandomPlayer(start_timer_on_battle_start=True)
-second_player = RandomPlayer(start_timer_on_battle_start=True)
-max_bot = MaxDamagePlayer(start_timer_on_battle_start=True)
-_heuristic_bot = HeuristicPlayer(battle_format="gen9randombattle",
-                                 start_timer_on_battle_start=True,
-                                 training_mode=False
-                                 )
+MAX_RETAINED_BATTLES : int = 100
+
+
+def _random_player():
+    from poke_env import RandomPlayer
+    return RandomPlayer(start_timer_on_battle_start=True)
+
+
+def _max_damage_player():
+    from max_bot import MaxDamagePlayer
+    return MaxDamagePlayer(start_timer_on_battle_start=True, max_retained_battles=MAX_RETAINED_BATTLES)
+
+
+def _heuristic_player():
+    from heuristic_bot import HeuristicPlayer, PARAMETERS_FILE
+    return HeuristicPlayer(battle_format="gen9randombattle",
+                           start_timer_on_battle_start=True,
+                           training_mode=False,
+                           parameters_file=PARAMETERS_FILE,
+                           max_retained_battles=MAX_RETAINED_BATTLES
+                           )
+
+
+PLAYER_FACTORIES : dict = {
+    'first_random': _random_player,
+    'second_random': _random_player,
+    'max_damage': _max_damage_player,
+    'heuristic': _heuristic_player,
+}
+_PLAYERS : dict = {} # Players already created, reused by the next runs of the menu
+
+# Options of the menu that play one player against another, with their name as a mode
+MATCHUPS : dict = {
+    1: ('first_random', 'second_random'),
+    2: ('max_damage', 'second_random'),
+    3: ('heuristic', 'second_random'),
+    4: ('heuristic', 'max_damage'),
+}
+MATCHUP_MODES : dict = {'random-random': 1, 'max-random': 2, 'heuristic-random': 3, 'heuristic-max': 4}
+MODES : tuple = tuple(MATCHUP_MODES) + ('check-env', 'search', 'tournament', 'league')
+
+
+def get_player(name : str):
+    '''
+        Player of the menu, created by its factory on first use
+    '''
+    if name not in _PLAYERS:
+        _PLAYERS[name] = PLAYER_FACTORIES[name]()
+    return _PLAYERS[name]
+
+
+def tournament_matchup(matchup : int) -> tuple:
+    '''
+        ((player class, kwargs), (opponent class, kwargs)) of a matchup for the tournament runner
+    '''
+    from poke_env import RandomPlayer
+    from heuristic_bot import HeuristicPlayer, PARAMETERS_FILE
+    from max_bot import MaxDamagePlayer
+    # The same players as the factories of the menu, with the tuned weights and the bounded retention
+    heuristic = (HeuristicPlayer, {'battle_format': 'gen9randombattle', 'start_timer_on_battle_start': True, 'training_mode': False,
+                                   'parameters_file': PARAMETERS_FILE, 'max_retained_battles': MAX_RETAINED_BATTLES})
+    random = (RandomPlayer, {'start_timer_on_battle_start': True})
+    max_damage = (MaxDamagePlayer, {'start_timer_on_battle_start': True, 'max_retained_battles': MAX_RETAINED_BATTLES})
+    return {1: (random, random), 2: (max_damage, random), 3: (heuristic, random), 4: (heuristic, max_damage)}[matchup]
+
+
+def prepare_matchup(matchup : int, n_battles : int, incumbent_win_rate : float = None,
+                    trajectory_directory : str = None, instrument : bool = False):
+    player1, player2 = (get_player(name) for name in MATCHUPS[matchup])
+    return lambda: asyncio.run(create_battle(player1, player2, n_battles, incumbent_win_rate, trajectory_directory,
+                                             instrument))
+
+
+def prepare_check_env():
+    from gymnasium.utils.env_checker import check_env
+    from simpleRL_bot import SimpleRLPlayer
+    opponent = get_player('heuristic')
+
+    def run():
+        try:
+            rl_bot = SimpleRLPlayer(opponent=opponent, start_challenging=True)
+            test_env = rl_bot
+            check_env(test_env,skip_render_check=True)
+            test_env.close()
+            print('Enviroment is correct')
+        except Exception as e:
+            print(f"Error: {e.__str__()}")
+            sys.exit(1)
+    return run
+
+
+def prepare_search(n_battles : int, generations : int, population_size : int, early_stopping : bool, plot : bool = True,
+                   restart : bool = False, local : bool = False):
+    from checkpointing import SearchCheckpoint
+    from heuristic_bot import PARAMETER_NAMES, load_parameters
+    from max_bot import MaxDamagePlayer
+    from parameter_search import CMAES, ConcurrentEvaluator, ParameterSearch
+    initial = load_parameters()
+    strategy = CMAES([initial[name] for name in PARAMETER_NAMES], sigma=0.25, population_size=population_size)
+    # The players live for the whole search, only the last battles are kept in memory
+    retention = {'max_retained_battles': MAX_RETAINED_BATTLES}
+    arena = None
+    if local:
+        # In process battles (local_battle), the players never connect to the server
+        from local_battle import LocalArena
+        arena = LocalArena()
+        connection = {'start_listening': False}
+    else:
+        connection = {'start_timer_on_battle_start': True}
+    evaluator = ConcurrentEvaluator(strategy.population_size, MaxDamagePlayer,
+                                    player_kwargs={**connection, **retention},
+                                    opponent_kwargs={**connection, **retention}, arena=arena)
+    search = ParameterSearch(strategy, evaluator, n_battles, early_stopping=early_stopping)
+    # Every generation is checkpointed, an interrupted search goes on from its last one
+    checkpoint = SearchCheckpoint()
+    try:
+        if not restart and checkpoint.restore(search):
+            print(f'Resuming the search at generation {search.strategy.generation} (best win rate {search.best_win_rate})')
+    except ValueError as e:
+        checkpoint.close()
+        raise ValueError(f'{checkpoint.path} is the checkpoint of another search ({e}), start the search over instead') from e
+
+    def run():
+        try:
+            asyncio.run(search.run(generations, checkpoint=checkpoint))
+        except BaseException:
+            checkpoint.close()
+            raise
+        # Finished, the next search does not resume this one
+        checkpoint.remove()
+        print(f'Training completed:\nBest win rate: {search.best_win_rate}\nBest parameters: {search.best_parameters}')
+        print(f'Evaluations per second: {search.evaluations_per_second}')
+        if plot:
+            import matplotlib.pyplot as plt
+            plt.plot([mean for mean, _ in search.history], label='Mean win rate')
+            plt.plot([best for _, best in search.history], label='Best win rate')
+            plt.legend()
+            plt.show()
+    return run
+
+
+def prepare_tournament(n_battles : int, ports : list, matchup : int):
+    from tournament import run_tournament
+    player_spec, opponent_spec = tournament_matchup(matchup)
+    return lambda: print(run_tournament(player_spec, opponent_spec, n_battles, ports))
+
+
+def prepare_league(config : str, output : str = None):
+    from league import League, LEAGUE_FILE
+    league = League.from_config(config)
+
+    def run():
+        asyncio.run(league.run())
+        league.print_report()
+        league.save(output or LEAGUE_FILE)
+    return run
 
 
 def main():
@@ -37,64 +201,38 @@ def main():
                     4. Heuristic player vs Max damage player
                     5. Checking the enviroment of the SimpleRLPlayer
                     6. Heuristic player vs Max damage player finding the best configuration
+                    7. Tournament sharded across local Showdown servers
                     0. Exit
                     """
                 )
-            )            
-            
+            )
+
             option = int(input("Enter the option you want to test: "))
 
             if option == 0:
                 break
 
             n_battles = int(input('Enter the number of battles you want to play: '))
-            
-            if option == 1:
-                # Game between two players
-                asyncio.run(create_battle(first_player, second_player,n_battles))
-            elif option == 2:
-                asyncio.run(create_battle(max_bot, second_player,n_battles))
-            elif option == 3:
-                asyncio.run(create_battle(heuristic_bot, second_player,n_battles))
-            elif option == 4:
-                asyncio.run(create_battle(_heuristic_bot, max_bot,n_battles))
+            incumbent_win_rate = None
+            if option in (2, 3, 4):
+                answer = input('Enter the win rate to test against to stop early (empty to play every battle): ')
+                incumbent_win_rate = float(answer) if answer.strip() else None
+
+            if option in MATCHUPS:
+                prepare_matchup(option, n_battles, incumbent_win_rate)()
             elif option == 5:
-                try:
-                    rl_bot = SimpleRLPlayer(opponent=_heuristic_bot, start_challenging=True)
-                    test_env = rl_bot
-                    check_env(test_env,skip_render_check=True)
-                    test_env.close()
-                    print('Enviroment is correct')
-                except Exception as e:
-                    print(f"Error: {e.__str__()}")
-                    sys.exit(1)
+                prepare_check_env()()
             elif option == 6:
-                epochs = int(input('Enter the number of iterations you want to play: '))
-                best_win_rate : int = -1
-                last_win_rate : int = 0
-                acumulative_wins : int = 0
-                heuristic_bot = HeuristicPlayer(start_timer_on_battle_start=True,training_mode=True)
-                list_wins : list = []
-                
-                # Game between two players
-                for _ in range(epochs):
-                    asyncio.run(create_battle(heuristic_bot, max_bot,n_battles))
-                    last_win_rate = heuristic_bot.n_won_battles - acumulative_wins
-                    acumulative_wins = heuristic_bot.n_won_battles
-                    list_wins.append(last_win_rate)
-                    print(f'Epoch {_+1} completed\nWin rate: {last_win_rate}')
-
-                    if last_win_rate > best_win_rate: #Best performance
-                        best_win_rate = last_win_rate
-                        heuristic_bot.adjust_parameters(True) #Trying to improve the performance
-                        dicc_par = save_parameters(heuristic_bot)
-                    else:
-                        heuristic_bot.adjust_parameters(False,dicc_par= dicc_par) #Reverting the changes
-
-                print(f'Training completed:\nBest win rate: {best_win_rate}\nBest parameters: {dicc_par}')
-                print(f'Mean of all win rates: {np.mean(list_wins)}')
-                plt.plot(list_wins)
-                plt.show()
+                generations = int(input('Enter the number of generations you want to play: '))
+                population_size = int(input('Enter the number of candidates evaluated at the same time: '))
+                early_stopping = input('Stop the evaluation of a candidate once it is clearly better or worse? (y/n): ').strip().lower() == 'y'
+                from checkpointing import SEARCH_CHECKPOINT_FILE
+                restart = os.path.exists(SEARCH_CHECKPOINT_FILE) and input('Resume the interrupted search? (y/n): ').strip().lower() != 'y'
+                prepare_search(n_battles, generations, population_size, early_stopping, restart=restart)()
+            elif option == 7:
+                ports = [int(port) for port in input('Enter the ports of the local servers (e.g. 8000,8001): ').split(',')]
+                matchup = int(input('Enter the matchup (1: Random vs Random, 2: Max damage vs Random, 3: Heuristic vs Random, 4: Heuristic vs Max damage): '))
+                prepare_tournament(n_battles, ports, matchup)()
             else:
                 print('Error: Invalid option')
     except Exception as e:
@@ -102,8 +240,90 @@ def main():
         sys.exit(1)
 
 
-async def create_battle(player1, player2, n_battles):
+def parse_arguments(argv : list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Plays the bots against each other, the interactive menu without a mode')
+    parser.add_argument('mode', nargs='?', choices=MODES)
+    parser.add_argument('n_battles', nargs='?', help='Battles to play (per candidate in search), or the config of a league')
+    parser.add_argument('--incumbent', type=float, default=None, help='Win rate to test against to stop early')
+    parser.add_argument('--trajectories', default=None, metavar='DIR', help='Logs the decisions of the players to DIR')
+    parser.add_argument('--instrument', action='store_true', help='Measures the latencies of the run and exports them')
+    parser.add_argument('--generations', type=int, default=10)
+    parser.add_argument('--population', type=int, default=None, help='Candidates evaluated at the same time')
+    parser.add_argument('--early-stopping', action='store_true')
+    parser.add_argument('--restart', action='store_true', help='Starts the search over instead of resuming its checkpoint')
+    parser.add_argument('--local', action='store_true', help='Plays the search in process (local_battle), without a server')
+    parser.add_argument('--no-plot', action='store_true')
+    parser.add_argument('--ports', default='8000', help='Ports of the local servers, e.g. 8000,8001')
+    parser.add_argument('--matchup', type=int, default=1, choices=sorted(MATCHUPS))
+    parser.add_argument('--output', default=None, help='Results of a league')
+    parser.add_argument('--startup-time', action='store_true', help='Prints the time to get the mode ready and exits')
+    args = parser.parse_args(argv)
+    if args.mode not in (None, 'check-env') and args.n_battles is None:
+        parser.error(f'{args.mode} needs the number of battles (the config file for league)')
+    return args
+
+
+def run_mode(args : argparse.Namespace):
+    if args.mode == 'check-env':
+        run = prepare_check_env()
+    elif args.mode == 'league':
+        run = prepare_league(args.n_battles, args.output)
+    else:
+        n_battles = int(args.n_battles)
+        if args.mode in MATCHUP_MODES:
+            run = prepare_matchup(MATCHUP_MODES[args.mode], n_battles, args.incumbent, args.trajectories,
+                                  args.instrument)
+        elif args.mode == 'search':
+            run = prepare_search(n_battles, args.generations, args.population, args.early_stopping, not args.no_plot,
+                                 args.restart, args.local)
+        else:
+            run = prepare_tournament(n_battles, [int(port) for port in args.ports.split(',')], args.matchup)
+
+    if args.startup_time:
+        print(f'{args.mode} ready in {time.perf_counter() - _MODULE_START:.3f} s')
+        return
+    run()
+
+
+async def create_battle(player1, player2, n_battles, incumbent_win_rate=None, trajectory_directory=None,
+                        instrument=False):
+    # Every decision of both players, for offline analysis and training, only when asked for
+    trajectories = None
+    if trajectory_directory is not None:
+        from trajectory_logger import TrajectoryLogger, log_trajectories
+        trajectories = TrajectoryLogger(trajectory_directory)
+        log_trajectories(player1, trajectories)
+        log_trajectories(player2, trajectories)
+    # Decision latencies, server round-trips and turns of the run, exported at the end.
+    # Instrumented after the logging, the latencies include its cost
+    instrumentation = monitor = None
+    if instrument:
+        from instrumentation import EventLoopMonitor, Instrumentation, INSTRUMENTATION_FILE, instrument_player
+        instrumentation = Instrumentation()
+        instrument_player(player1, instrumentation)
+        instrument_player(player2, instrumentation)
+        monitor = EventLoopMonitor(instrumentation)
+        monitor.start()
+    try:
+        return await _play_battles(player1, player2, n_battles, incumbent_win_rate)
+    finally:
+        if trajectories is not None:
+            trajectories.close()
+        if instrumentation is not None:
+            monitor.stop()
+            instrumentation.print_summary()
+            instrumentation.export(INSTRUMENTATION_FILE)
+
+
+async def _play_battles(player1, player2, n_battles, incumbent_win_rate=None):
     start_time = time.time()
+    if incumbent_win_rate is not None:
+        from sequential_test import SPRT, evaluate_sequential
+        # Stops as soon as player1 is clearly better or worse than the incumbent win rate
+        result = await evaluate_sequential(player1, player2, SPRT(incumbent_win_rate), n_battles)
+        print(f"Player {player1.username} against a win rate of {incumbent_win_rate}: {result}\nTime elapsed: {result.elapsed}")
+        return result
+
     await player1.battle_against(player2, n_battles=n_battles)
     end_time = time.time()
     print(
@@ -113,16 +333,9 @@ async def create_battle(player1, player2, n_battles):
         f"Player {player2.username} won {player2.n_won_battles} out of {player2.n_finished_battles} played\nTime elapsed with {n_battles} battles: {end_time - start_time}"
     )
 
-def save_parameters(heuristic_bot):
-    dicc_par = {}
-    dicc_par['par_stats'] = heuristic_bot.par_stats
-    dicc_par['par_typing'] = heuristic_bot.par_typing
-    dicc_par['par_hp'] = heuristic_bot.par_hp
-    dicc_par['par_status'] = heuristic_bot.par_status
-    dicc_par['par_weather'] = heuristic_bot.par_weather
-
-    return dicc_par
-
 if __name__ == "__main__":
-    main()
-
+    arguments = parse_arguments()
+    if arguments.mode is None:
+        main()
+    else:
+        run_mode(arguments)
@@ -0,0 +1,200 @@
+'''
+    Periodic checkpoints of the long training runs, so a crashed or preempted run resumes
+    where it stopped instead of starting over.
+
+    - ParameterSearch (option 6 of campo_combate): after every generation, the state of
+      CMA-ES (mean, step size, paths, covariance, RNG of the sampling), the best
+      parameters and the win rate history go to a JSON file. A resumed search samples
+      the same next generation the interrupted one would have. The checkpoint of a
+      finished search is deleted, and one of another population size or number of
+      battles per candidate is refused.
+    - DQN of dqn_model: every interval steps, the weights of the Q-network and of the
+      target network, the state of the optimizer, the step of the agent (which drives the
+      epsilon annealing and the warmup), the global NumPy RNG of the policy and the
+      meta of the replay memory (ring position, size, RNG) go to one .npz file. The
+      transitions themselves stay in the memory-mapped files of ReplayMemory, flushed
+      before the checkpoint is written.
+    The state is copied on the training side, then written in a background thread, so
+    the run only waits for the copy. If the writer is still busy when the next
+    checkpoint comes, only the newest one is kept. Every file is written under a
+    temporary name and renamed, so a crash while saving leaves the previous checkpoint.
+'''
+import io
+import json
+import os
+import threading
+import numpy as np
+
+SEARCH_CHECKPOINT_FILE : str = 'search_checkpoint.json'
+DQN_CHECKPOINT_FILE : str = 'dqn_checkpoint.npz'
+DQN_CHECKPOINT_INTERVAL : int = 1000 # Steps of the agent
+
+
+def atomic_write(path : str, data : bytes):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class CheckpointWriter:
+    '''
+        Background thread running the last submitted write. Errors are kept in errors,
+        the training goes on with the previous checkpoint
+    '''
+
+    def __init__(self):
+        self._pending = None
+        self._closed : bool = False
+        self._condition = threading.Condition()
+        self.n_written : int = 0
+        self.n_skipped : int = 0 # Replaced by a newer checkpoint before being written
+        self.errors : list = []
+        self._thread = threading.Thread(target=self._write_loop, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, write, *args):
+        with self._condition:
+            if self._pending is not None:
+                self.n_skipped += 1
+            self._pending = (write, args)
+            self._condition.notify()
+
+    def close(self):
+        '''
+            Waits for the pending write
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                write, args = self._pending
+                self._pending = None
+            try:
+                write(*args)
+                self.n_written += 1
+            except Exception as e:
+                self.errors.append(repr(e))
+                print(f'Checkpoint failed: {e}')
+
+
+class SearchCheckpoint:
+    '''
+        Checkpoint of a ParameterSearch, saved every interval generations
+    '''
+
+    def __init__(self, path : str = SEARCH_CHECKPOINT_FILE, interval : int = 1):
+        self.path = path
+        self.interval = interval
+        self.writer = CheckpointWriter()
+
+    def save(self, search, force : bool = False):
+        if force or search.strategy.generation % self.interval == 0:
+            self.writer.submit(self._write, search.state())
+
+    def _write(self, state : dict):
+        atomic_write(self.path, json.dumps(state).encode())
+
+    def restore(self, search) -> bool:
+        '''
+            Loads the checkpoint into search, False when there is none
+        '''
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as file:
+            search.load_state(json.load(file))
+        return True
+
+    def close(self):
+        self.writer.close()
+
+    def remove(self):
+        '''
+            Deletes the checkpoint of a finished search, the next search starts over
+        '''
+        self.writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _optimizer_weights(agent) -> list:
+    optimizer = agent.trainable_model.optimizer
+    return optimizer.get_weights() if optimizer.weights else []
+
+
+def dqn_state(agent, memory, step : int = None) -> dict:
+    '''
+        Copy of everything of a DQNAgent and its ReplayMemory needed to resume its training
+        at step (the step of the agent by default)
+    '''
+    keys, position, has_gauss, cached_gaussian = np.random.get_state()[1:]
+    return {
+        'state': {
+            'step': int(agent.step if step is None else step),
+            'memory': memory.meta(),
+            'np_random': [int(position), int(has_gauss), float(cached_gaussian)],
+        },
+        'np_random_keys': keys,
+        'model': agent.model.get_weights(),
+        'target_model': agent.target_model.get_weights(),
+        'optimizer': _optimizer_weights(agent),
+    }
+
+
+def _write_dqn(path : str, state : dict, memory):
+    # The transitions go first: the checkpoint never points past what is on disk
+    memory.flush(state['state']['memory'])
+    arrays = {'state': np.array(json.dumps(state['state'])), 'np_random_keys': state['np_random_keys']}
+    for name in ('model', 'target_model', 'optimizer'):
+        arrays.update({f'{name}_{i}': weights for i, weights in enumerate(state[name])})
+        arrays[f'{name}_count'] = np.array(len(state[name]))
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    atomic_write(path, buffer.getvalue())
+
+
+def save_dqn(agent, memory, path : str = DQN_CHECKPOINT_FILE, writer : CheckpointWriter = None, step : int = None):
+    '''
+        Checkpoint of a DQNAgent, written by writer in the background when given
+    '''
+    state = dqn_state(agent, memory, step)
+    if writer is None:
+        _write_dqn(path, state, memory)
+    else:
+        writer.submit(_write_dqn, path, state, memory)
+
+
+def load_dqn(agent, memory, path : str = DQN_CHECKPOINT_FILE) -> int:
+    '''
+        Restores a checkpoint into a compiled DQNAgent and its ReplayMemory, returns the
+        step to resume from (0 when there is no checkpoint). keras-rl sets the step of the
+        agent to 0 when fit starts, dqn_model.DQNCheckpoint sets it back
+    '''
+    if not os.path.exists(path):
+        return 0
+    with np.load(path) as checkpoint:
+        state = json.loads(str(checkpoint['state']))
+        weights = {name: [checkpoint[f'{name}_{i}'] for i in range(int(checkpoint[f'{name}_count']))]
+                   for name in ('model', 'target_model', 'optimizer')}
+        keys = checkpoint['np_random_keys']
+
+    agent.model.set_weights(weights['model'])
+    agent.target_model.set_weights(weights['target_model'])
+    if weights['optimizer']:
+        optimizer = agent.trainable_model.optimizer
+        # The slots of the optimizer only exist after its first update
+        optimizer._create_all_weights(agent.trainable_model.trainable_weights)
+        optimizer.set_weights(weights['optimizer'])
+    memory.set_meta(state['memory'])
+    position, has_gauss, cached_gaussian = state['np_random']
+    np.random.set_state(('MT19937', keys, position, has_gauss, cached_gaussian))
+    return state['step']
@@ -0,0 +1,284 @@
+'''
+    Vectorized damage calculation.
+
+    DamageBatch computes the damage range of every (move x tera off/on x target) of
+    an attacker in one pass of NumPy operations, with the gen 9 damage formula: level,
+    base power, boosted attacking and defending stats, STAB (tera STAB included),
+    type effectiveness, weather, burn and the 0.85-1 random roll. Critical hits,
+    abilities, items and the intermediate roundings of the game are left out.
+
+    The stats of our pokemons come from the requests of the server. The stats of the
+    opponents are unknown, they are estimated from their base stats and level with
+    the EVs and IVs of random battles.
+
+    expected_damage is the same computation against a single target in plain Python,
+    used by the decisions of the bots, where arrays of 4 moves cost more than they save.
+'''
+import numpy as np
+from poke_env.data import GenData
+from poke_env.environment.move_category import MoveCategory
+from poke_env.environment.pokemon_type import PokemonType
+from poke_env.environment.status import Status
+from type_effectiveness import DUAL_MATRIX, NO_TYPE, N_TYPES, type_index
+
+STATS : tuple = ('hp', 'atk', 'def', 'spa', 'spd', 'spe')
+RANDOM_BATTLE_EVS : int = 85
+RANDOM_BATTLE_IVS : int = 31
+MIN_ROLL : float = 0.85
+MEAN_ROLL : float = (1 + MIN_ROLL) / 2
+
+PHYSICAL : int = 0
+SPECIAL : int = 1
+STATUS : int = 2
+_CATEGORIES : dict = {MoveCategory.PHYSICAL: PHYSICAL, MoveCategory.SPECIAL: SPECIAL, MoveCategory.STATUS: STATUS}
+
+# Multiplier of a boost stage, index stage + 6
+BOOST_MULTIPLIERS : np.ndarray = np.array([max(2, 2 + stage) / max(2, 2 - stage) for stage in range(-6, 7)])
+BOOST_TABLE : list = BOOST_MULTIPLIERS.tolist() # Plain floats keep the arithmetic out of NumPy scalars
+
+def _weather_row(fire : float, water : float) -> np.ndarray:
+    row = np.ones(N_TYPES + 1)
+    row[type_index(PokemonType.FIRE)] = fire
+    row[type_index(PokemonType.WATER)] = water
+    return row
+
+
+# Multiplier of every attacking type (NO_TYPE included) under a weather, by value of Weather
+WEATHER_MULTIPLIERS : dict = {
+    9: _weather_row(1.5, 0.5), # Sun
+    2: _weather_row(1.5, 0.0), # Desolate land
+    6: _weather_row(0.5, 1.5), # Rain
+    5: _weather_row(0.0, 1.5), # Primordial sea
+}
+DUAL_TABLE : list = DUAL_MATRIX.tolist()
+WEATHER_TABLES : dict = {weather: row.tolist() for weather, row in WEATHER_MULTIPLIERS.items()}
+
+_POKEDEX : dict = GenData.from_gen(9).pokedex
+
+# (base power, type ordinal, category, accuracy, expected hits) of every move seen, by move id
+_DAMAGE_FEATURES : dict = {}
+# (base power, expected hits, type ordinal, physical) of every move seen for expected_damage, by move id
+_EXPECTED_FEATURES : dict = {}
+# Original types of every species seen, the STAB types kept after terastallizing
+_SPECIES_TYPES : dict = {}
+# Estimated stats of opponents, by (species, level)
+_ESTIMATED_STATS : dict = {}
+
+
+def damage_features(move) -> tuple:
+    features = _DAMAGE_FEATURES.get(move.id)
+    if features is None:
+        category = _CATEGORIES[move.category]
+        features = (move.base_power, type_index(move.type), category, move.accuracy, move.expected_hits)
+        _DAMAGE_FEATURES[move.id] = features
+    return features
+
+
+def expected_features(move) -> tuple:
+    '''
+        (base power, expected hits * accuracy * mean roll, type ordinal, physical) of
+        move, the expected hits 0 for the moves without damage
+    '''
+    features = _EXPECTED_FEATURES.get(move.id)
+    if features is None:
+        base_power, move_type, category, accuracy, hits = damage_features(move)
+        expected = hits * accuracy * MEAN_ROLL if category != STATUS and base_power > 0 else 0.0
+        features = (base_power, expected, move_type, category == PHYSICAL)
+        _EXPECTED_FEATURES[move.id] = features
+    return features
+
+
+def species_types(mon) -> tuple:
+    '''
+        Type ordinals of the species of mon, before any terastallization
+    '''
+    types = _SPECIES_TYPES.get(mon.species)
+    if types is None:
+        entry = _POKEDEX.get(mon.species)
+        if entry is None:
+            types = tuple(type_index(type_) for type_ in mon.types if type_)
+        else:
+            types = tuple(type_index(PokemonType.from_name(name)) for name in entry['types'])
+        _SPECIES_TYPES[mon.species] = types
+    return types
+
+
+def estimate_stat(base : int, level : int, hp : bool = False) -> int:
+    '''
+        Stat of a random battle set (85 EVs, 31 IVs, neutral nature)
+    '''
+    value = (2 * base + RANDOM_BATTLE_IVS + RANDOM_BATTLE_EVS // 4) * level // 100
+    return value + level + 10 if hp else value + 5
+
+
+def mon_stats(mon) -> tuple:
+    '''
+        (hp, atk, def, spa, spd, spe) of mon, the known stats from the requests or the estimated ones
+    '''
+    known = mon.stats
+    if known and known.get('atk') is not None:
+        max_hp = mon.max_hp if mon.max_hp else estimate_stat(mon.base_stats['hp'], mon.level, hp=True)
+        return (max_hp, known['atk'], known['def'], known['spa'], known['spd'], known['spe'])
+
+    key = (mon.species, mon.level)
+    stats = _ESTIMATED_STATS.get(key)
+    if stats is None:
+        stats = tuple(estimate_stat(mon.base_stats[stat], mon.level, hp=stat == 'hp') for stat in STATS)
+        _ESTIMATED_STATS[key] = stats
+    return stats
+
+
+def defending_types(mon) -> tuple:
+    '''
+        Type ordinals mon defends with: only its tera type once terastallized.
+        Pokemon.types keeps the original second type after terastallizing, type_1 and
+        type_2 do not
+    '''
+    return type_index(mon.type_1), type_index(mon.type_2)
+
+
+def type_multipliers(moves : list, target) -> list:
+    '''
+        Type multiplier of every move against the current types of target
+    '''
+    type_1, type_2 = defending_types(target)
+    return [DUAL_TABLE[expected_features(move)[2]][type_1][type_2] for move in moves]
+
+
+def expected_damage(attacker, moves : list, target, weather=None, tera_type=None) -> list:
+    '''
+        DamageBatch(attacker, moves, tera_type).expected([target], weather) in plain
+        Python: (as it is, terastallized) for every move
+    '''
+    tera_type = tera_type or attacker.tera_type
+    tera = type_index(tera_type) if tera_type is not None else NO_TYPE
+    original = species_types(attacker)
+    terastallized = attacker.terastallized
+    _, atk, _, spa, _, _ = mon_stats(attacker)
+    boosts = attacker.boosts
+    level_factor = (2 * attacker.level // 5 + 2) / 50
+    physical_offense = level_factor * atk * BOOST_TABLE[boosts['atk'] + 6]
+    burn = 0.5 if attacker.status == Status.BRN else 1.0
+    special_offense = level_factor * spa * BOOST_TABLE[boosts['spa'] + 6]
+
+    hp, _, defense, _, special_defense, _ = mon_stats(target)
+    boosts = target.boosts
+    defense *= BOOST_TABLE[boosts['def'] + 6]
+    special_defense *= BOOST_TABLE[boosts['spd'] + 6]
+    type_1, type_2 = defending_types(target)
+    weather_rows = [WEATHER_TABLES[weather_type.value] for weather_type in weather or () if weather_type.value in WEATHER_TABLES]
+    damage = []
+    for move in moves:
+        base_power, expected, move_type, physical = expected_features(move)
+        if physical:
+            per_target = (base_power * physical_offense / defense + 2) * expected * burn
+        else:
+            per_target = (base_power * special_offense / special_defense + 2) * expected
+        per_target *= DUAL_TABLE[move_type][type_1][type_2] / hp
+        for weather_row in weather_rows:
+            per_target *= weather_row[move_type]
+        stab = 1.5 if move_type in original else 1.0
+        # Terastallized, the tera type gets STAB too, and 2 when it is one of the original types
+        tera_stab = (2.0 if stab > 1 else 1.5) if move_type == tera else stab
+        damage.append((tera_stab * per_target if terastallized else stab * per_target, tera_stab * per_target))
+    return damage
+
+
+class DamageBatch:
+    '''
+        Damage of the moves of an attacker. Index 0 of the tera axis is the attacker as it
+        is, index 1 the attacker terastallized with tera_type (the same when it already is).
+        tera_type defaults to the tera type of the attacker, known once it terastallized
+    '''
+
+    def __init__(self, attacker, moves : list, tera_type=None):
+        self.attacker = attacker
+        self.moves = moves
+        tera_type = tera_type or attacker.tera_type
+        tera = type_index(tera_type) if tera_type is not None else NO_TYPE
+        original = species_types(attacker)
+        terastallized = attacker.terastallized
+
+        _, atk, _, spa, _, _ = mon_stats(attacker)
+        boosts = attacker.boosts
+        atk *= BOOST_MULTIPLIERS[boosts['atk'] + 6]
+        spa *= BOOST_MULTIPLIERS[boosts['spa'] + 6]
+        level_factor = 2 * attacker.level // 5 + 2
+        burned = attacker.status == Status.BRN
+
+        # The part of the damage that does not depend on the target is built move by move
+        # (at most 4) and turned into arrays once, NumPy only pays off across the targets
+        rows = []
+        types = []
+        defense_columns = []
+        for move in moves:
+            base_power, move_type, category, accuracy, hits = damage_features(move)
+            physical = category == PHYSICAL
+            if category == STATUS or base_power <= 0:
+                hits = 0.0
+            elif burned and physical:
+                hits *= 0.5
+
+            stab = 1.5 if move_type in original else 1.0
+            # Terastallized, the tera type gets STAB too, and 2 when it is one of the original types
+            tera_stab = (2.0 if stab > 1 else 1.5) if move_type == tera else stab
+            if terastallized:
+                stab = tera_stab
+
+            offense = level_factor * base_power * (atk if physical else spa) / 50
+            expected = hits * accuracy * MEAN_ROLL
+            rows.append((offense, stab * hits, tera_stab * hits, stab * expected, tera_stab * expected, accuracy))
+            types.append(move_type)
+            defense_columns.append(1 if physical else 2)
+
+        features = np.array(rows, dtype=np.float64).reshape(len(moves), 6)
+        self._offense = features[:, :1]
+        self._modifiers = features[:, 1:3, None]
+        self._expected_modifiers = features[:, 3:5, None]
+        self.accuracy = features[:, 5]
+        self.type_index = np.array(types, dtype=np.intp)
+        self._type_column = self.type_index[:, None]
+        # Column of the defending stat of every move in the target rows of _per_target
+        self._defense_column = np.array(defense_columns, dtype=np.intp)
+
+    @property
+    def physical(self) -> np.ndarray:
+        return self._defense_column == 1
+
+    def _per_target(self, targets : list, weather) -> np.ndarray:
+        '''
+            Damage before the modifiers of the attacker, as a fraction of the max HP of
+            every target, shape (n_moves, n_targets)
+        '''
+        stats = []
+        types_1 = []
+        types_2 = []
+        for target in targets:
+            hp, _, defense, _, special_defense, _ = mon_stats(target)
+            boosts = target.boosts
+            stats.append((hp, defense * BOOST_MULTIPLIERS[boosts['def'] + 6], special_defense * BOOST_MULTIPLIERS[boosts['spd'] + 6]))
+            type_1, type_2 = defending_types(target)
+            types_1.append(type_1)
+            types_2.append(type_2)
+        stats = np.array(stats, dtype=np.float64).reshape(len(targets), 3)
+
+        multipliers = DUAL_MATRIX[self._type_column, types_1, types_2] / stats[:, 0]
+        for weather_type in weather or ():
+            weather_row = WEATHER_MULTIPLIERS.get(int(weather_type.value))
+            if weather_row is not None:
+                multipliers *= weather_row[self._type_column]
+        return (self._offense / stats[:, self._defense_column].T + 2) * multipliers
+
+    def ranges(self, targets : list, weather=None) -> tuple:
+        '''
+            (lowest, highest) damage as a fraction of the max HP of every target, multi-hit
+            moves counted with their expected hits. Each of shape (n_moves, 2, n_targets)
+        '''
+        high = self._modifiers * self._per_target(targets, weather)[:, None, :]
+        return MIN_ROLL * high, high
+
+    def expected(self, targets : list, weather=None) -> np.ndarray:
+        '''
+            Mean damage of the random roll times the accuracy, shape (n_moves, 2, n_targets)
+        '''
+        return self._expected_modifiers * self._per_target(targets, weather)[:, None, :]
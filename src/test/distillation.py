@@ -0,0 +1,130 @@
+'''
+    Distillation of HeuristicPlayer into the Q-network of the DQN of SimpleRLPlayer.
+
+    The DQN starts from random weights and spends its first thousands of steps acting
+    almost at random. Instead, the Q-network is first trained to pick the action
+    HeuristicPlayer would take:
+        - labelled pairs (observation of SimpleRLPlayer, action of HeuristicPlayer in the
+          action space of SimpleRLPlayer) are generated offline on synthetic battles
+          (battle_fixtures), split across processes, or read from the trajectories
+          logged by trajectory_logger during real battles,
+        - the network is fitted on them in batches, with a target of margin for the
+          action of the heuristic and 0 for every other action, so its greedy action is
+          the one of the heuristic while the Q-values stay on the scale of the rewards,
+        - dqn_model then fine-tunes those weights with a short warmup and a low epsilon.
+'''
+import multiprocessing
+import sys
+import numpy as np
+from battle_fixtures import make_battles
+from heuristic_bot import HeuristicPlayer
+from simpleRL_bot import EMBEDDING_SIZE, embed_battles, order_to_action
+from trajectory_logger import TrajectoryReader
+
+N_ACTIONS : int = 26 # Action space of Gen9EnvSinglePlayer
+DATASET_FILE : str = 'distillation_dataset.npz'
+CHUNK_SIZE : int = 1000 # Battles labelled by a worker at a time
+
+
+def label_battles(player, battles : list) -> tuple:
+    '''
+        (observations, actions) of the decisions of player in battles, the decisions that
+        have no action in the action space of SimpleRLPlayer left out
+    '''
+    actions = np.array([order_to_action(player.choose_move(battle), battle) for battle in battles], dtype=np.int16)
+    observations = embed_battles(battles, np.empty((len(battles), EMBEDDING_SIZE), dtype=np.float32))
+    valid = actions >= 0
+    return observations[valid], actions[valid]
+
+
+def _label_chunk(chunk : tuple) -> tuple:
+    seed, n_battles, player_kwargs = chunk
+    player = HeuristicPlayer(start_listening=False, **player_kwargs)
+    return label_battles(player, make_battles(n_battles, seed))
+
+
+def generate_dataset(n_battles : int, seed : int = 0, n_workers : int = None, player_kwargs : dict = None) -> tuple:
+    '''
+        Labels n_battles synthetic battles with HeuristicPlayer, in chunks over n_workers
+        processes (all the CPUs by default). The same seed gives the same dataset
+    '''
+    chunks = [(seed + start, min(CHUNK_SIZE, n_battles - start), player_kwargs or {})
+              for start in range(0, n_battles, CHUNK_SIZE)]
+    if n_workers == 1 or len(chunks) == 1:
+        results = [_label_chunk(chunk) for chunk in chunks]
+    else:
+        # poke_env runs its own loop thread, forking it is unsafe
+        with multiprocessing.get_context('spawn').Pool(n_workers) as pool:
+            results = pool.map(_label_chunk, chunks)
+    return np.concatenate([observations for observations, _ in results]), np.concatenate([actions for _, actions in results])
+
+
+def dataset_from_trajectories(directory : str, player : str = None) -> tuple:
+    '''
+        (observations, actions) of the decisions taken with the contextual score of
+        HeuristicPlayer in the trajectories of directory, only the ones of player when given
+    '''
+    observations = []
+    actions = []
+    for shard in TrajectoryReader(directory):
+        keep = (shard['action'] >= 0) & ~np.isnan(shard['components'][:, 0])
+        if player is not None:
+            keep &= shard['players'][shard['battle']] == player
+        observations.append(np.asarray(shard['embedding'][keep]))
+        actions.append(np.asarray(shard['action'][keep]))
+    if not observations:
+        return np.empty((0, EMBEDDING_SIZE), dtype=np.float32), np.empty(0, dtype=np.int16)
+    return np.concatenate(observations), np.concatenate(actions)
+
+
+def save_dataset(observations : np.ndarray, actions : np.ndarray, path : str = DATASET_FILE):
+    np.savez_compressed(path, observations=observations, actions=actions)
+
+
+def load_dataset(path : str = DATASET_FILE) -> tuple:
+    with np.load(path) as dataset:
+        return dataset['observations'], dataset['actions']
+
+
+def q_targets(actions : np.ndarray, n_actions : int = N_ACTIONS, margin : float = 1.0) -> np.ndarray:
+    '''
+        Targets of the Q-network: margin for the action of the heuristic, 0 for the others
+    '''
+    targets = np.zeros((len(actions), n_actions), dtype=np.float32)
+    targets[np.arange(len(actions)), actions] = margin
+    return targets
+
+
+def agreement(model, observations : np.ndarray, actions : np.ndarray, batch_size : int = 1024) -> float:
+    '''
+        Fraction of the observations where the greedy action of model is the one of the heuristic
+    '''
+    q_values = model.predict(observations[:, None, :], batch_size=batch_size, verbose=0)
+    return float(np.mean(q_values.argmax(axis=1) == actions))
+
+
+def held_out(observations : np.ndarray, actions : np.ndarray, validation_split : float = 0.1) -> tuple:
+    '''
+        The last validation_split of the dataset, which pretrain leaves out of the training
+        (Keras takes the validation data before shuffling)
+    '''
+    split_at = int(len(actions) * (1 - validation_split))
+    return observations[split_at:], actions[split_at:]
+
+
+def pretrain(model, observations : np.ndarray, actions : np.ndarray, epochs : int = 10, batch_size : int = 256,
+             margin : float = 1.0, validation_split : float = 0.1):
+    '''
+        Fits the Q-network (input shape (1, EMBEDDING_SIZE), as in dqn_model) on the
+        decisions of the heuristic. DQNAgent.compile recompiles the model afterwards and
+        keeps the weights
+    '''
+    model.compile(optimizer='adam', loss='mse')
+    return model.fit(observations[:, None, :], q_targets(actions, model.output_shape[-1], margin),
+                     epochs=epochs, batch_size=batch_size, validation_split=validation_split, shuffle=True, verbose=2)
+
+
+if __name__ == '__main__':
+    observations, actions = generate_dataset(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
+    save_dataset(observations, actions, sys.argv[2] if len(sys.argv) > 2 else DATASET_FILE)
+    print(f'{len(actions)} decisions, actions: {np.bincount(actions, minlength=N_ACTIONS)}')
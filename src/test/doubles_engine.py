@@ -0,0 +1,297 @@
+'''
+    Decision engine for doubles (gen9randomdoublesbattle, gen9vgc formats).
+
+    Every active slot gets its candidate actions: each available move with each of its
+    legal Showdown targets, with and without terastallizing when the slot can, and each
+    switch. A candidate is described by a vector of features, computed for all the moves
+    of a slot in one DamageBatch pass:
+        - the expected damage on each opponent slot, capped at its remaining HP (spread
+          moves hit both opponents at 0.75, random-target moves half each),
+        - the damage on our other active pokemon, negated,
+        - whether it terastallizes, negated,
+        - the switch score (typing and moves advantage of HeuristicPlayer against the
+          active opponents) relative to the pokemon in the slot.
+    A candidate is dropped when another one of the same slot is at least as high on every
+    feature. The joint value only grows with each feature, so the pruning never drops the
+    best joint order, and only a handful of candidates per slot reach the joint step. The
+    joint orders are then scored all at once as a grid: damage of both slots on each
+    opponent capped at its HP, a bonus per opponent knocked out, the damage to our side
+    and the switches, with the illegal pairs (both terastallizing, both switching to the
+    same pokemon) masked out.
+'''
+import numpy as np
+from poke_env import Player
+from poke_env.environment.double_battle import DoubleBattle
+from poke_env.environment.move import SPECIAL_MOVES
+from poke_env.environment.target import Target
+from poke_env.player.battle_order import DoubleBattleOrder
+from batch_scoring import SwitchBatch
+from damage_calc import DamageBatch
+
+SPREAD_MODIFIER : float = 0.75
+KO_BONUS : float = 0.5 # Per opponent knocked out, in fractions of its max HP
+ALLY_DAMAGE_WEIGHT : float = 1.0
+TERA_COST : float = 0.05 # Terastallizing is only worth it when it does more damage
+SWITCH_WEIGHT : float = 0.25
+MAX_SLOT_ACTIONS : int = 12 # Candidates of a slot kept for the joint step after the pruning
+
+# Columns of the features of a candidate
+OPPONENT_1 : int = 0
+OPPONENT_2 : int = 1
+ALLY : int = 2
+TERA : int = 3
+SWITCH : int = 4
+N_FEATURES : int = 5
+
+_SPREAD_FOES = (Target.ALL_ADJACENT_FOES,)
+_SPREAD_ALL = (Target.ALL_ADJACENT,)
+_RANDOM_FOE = (Target.RANDOM_NORMAL,)
+
+# Showdown targets of every kind of move, as in DoubleBattle.get_possible_showdown_targets:
+# 'ally' and 'self' stand for the positions of the slot
+_TARGET_POSITIONS : dict = {
+    Target.ADJACENT_ALLY: ('ally',),
+    Target.ADJACENT_ALLY_OR_SELF: ('ally', 'self'),
+    Target.ADJACENT_FOE: (DoubleBattle.OPPONENT_1_POSITION, DoubleBattle.OPPONENT_2_POSITION),
+    Target.ANY: ('ally', DoubleBattle.OPPONENT_1_POSITION, DoubleBattle.OPPONENT_2_POSITION),
+    Target.NORMAL: ('ally', DoubleBattle.OPPONENT_1_POSITION, DoubleBattle.OPPONENT_2_POSITION),
+    None: (DoubleBattle.OPPONENT_1_POSITION, DoubleBattle.OPPONENT_2_POSITION),
+}
+_MOVE_TARGETS : dict = {} # move id -> Target of its entry
+
+
+def deduced_target(move):
+    '''
+        Move.deduced_target, with the target of the entry of the move parsed once per move
+    '''
+    if move.request_target is not None:
+        return move.request_target
+    if move.id not in _MOVE_TARGETS:
+        _MOVE_TARGETS[move.id] = move.target
+    return _MOVE_TARGETS[move.id]
+
+
+def showdown_targets(battle, slot : int, move, mon, positions : set) -> list:
+    '''
+        DoubleBattle.get_possible_showdown_targets of a move of the slot, which parses the
+        targets of every kind of move on every call. positions are the occupied ones
+    '''
+    if move.id in SPECIAL_MOVES or move.non_ghost_target or mon.is_dynamaxed:
+        return battle.get_possible_showdown_targets(move, mon)
+    self_position = DoubleBattle.POKEMON_1_POSITION if slot == 0 else DoubleBattle.POKEMON_2_POSITION
+    ally_position = DoubleBattle.POKEMON_2_POSITION if slot == 0 else DoubleBattle.POKEMON_1_POSITION
+    targets = _TARGET_POSITIONS.get(deduced_target(move), (DoubleBattle.EMPTY_TARGET_POSITION,))
+    targets = [ally_position if target == 'ally' else self_position if target == 'self' else target for target in targets]
+    return [target for target in targets if target in positions]
+
+
+def _features(damage : np.ndarray, target : int, move_target, present : np.ndarray) -> np.ndarray:
+    '''
+        Damage features of a move for one Showdown target. damage and present are
+        (opponent 1, opponent 2, ally)
+    '''
+    features = np.zeros(3)
+    if target in (DoubleBattle.OPPONENT_1_POSITION, DoubleBattle.OPPONENT_2_POSITION):
+        column = target - 1
+        features[column] = damage[column]
+    elif target in (DoubleBattle.POKEMON_1_POSITION, DoubleBattle.POKEMON_2_POSITION):
+        features[ALLY] = damage[ALLY]
+    elif move_target in _SPREAD_FOES or move_target in _SPREAD_ALL:
+        hit = present.copy()
+        if move_target in _SPREAD_FOES:
+            hit[ALLY] = False
+        features[hit] = damage[hit] * (SPREAD_MODIFIER if hit.sum() > 1 else 1.0)
+    elif move_target in _RANDOM_FOE:
+        foes = present[:ALLY]
+        features[:ALLY][foes] = damage[:ALLY][foes] / max(foes.sum(), 1)
+    return features
+
+
+class SlotCandidates:
+    '''
+        Candidate actions of one active slot: orders, features (n, N_FEATURES) and the
+        pokemon switched in by each one (None for the moves)
+    '''
+
+    def __init__(self, orders : list, features : np.ndarray, switches : list):
+        self.orders = orders
+        self.features = features
+        self.switches = switches
+
+    def __len__(self):
+        return len(self.orders)
+
+    def subset(self, keep : np.ndarray):
+        indices = np.flatnonzero(keep)
+        return SlotCandidates([self.orders[i] for i in indices], self.features[indices], [self.switches[i] for i in indices])
+
+
+def slot_candidates(player, battle, slot : int) -> SlotCandidates:
+    '''
+        Every legal action of a slot with its features, the damage capped at the HP left
+    '''
+    mon = battle.active_pokemon[slot]
+    ally = battle.active_pokemon[1 - slot]
+    targets = list(battle.opponent_active_pokemon) + [ally]
+    present = np.array([target is not None and not target.fainted for target in targets])
+    positions = {DoubleBattle.EMPTY_TARGET_POSITION}
+    positions.update(position for position, active in zip((DoubleBattle.POKEMON_1_POSITION, DoubleBattle.POKEMON_2_POSITION,
+                                                           DoubleBattle.OPPONENT_1_POSITION, DoubleBattle.OPPONENT_2_POSITION),
+                                                          list(battle.active_pokemon) + list(battle.opponent_active_pokemon))
+                     if active is not None)
+    hp = np.array([target.current_hp_fraction if is_present else 0.0 for target, is_present in zip(targets, present)])
+    orders = []
+    rows = []
+    switches = []
+
+    moves = battle.available_moves[slot] if mon is not None and not battle.force_switch[slot] else []
+    if moves and present[:ALLY].any():
+        can_tera = battle.can_tera[slot]
+        batch = DamageBatch(mon, moves, can_tera or None)
+        damage = np.zeros((len(moves), 2, 3))
+        damage[:, :, present] = batch.expected([target for target, is_present in zip(targets, present) if is_present], battle.weather)
+        damage = np.minimum(damage, hp)
+        for i, move in enumerate(moves):
+            move_targets = showdown_targets(battle, slot, move, mon, positions)
+            move_target = deduced_target(move)
+            for tera in ((False, True) if can_tera else (False,)):
+                for target in move_targets:
+                    row = np.zeros(N_FEATURES)
+                    row[:3] = _features(damage[i, int(tera)], target, move_target, present)
+                    row[ALLY] = -row[ALLY]
+                    row[TERA] = -float(tera)
+                    orders.append(player.create_order(move, move_target=target, terastallize=tera))
+                    rows.append(row)
+                    switches.append(None)
+
+    available_switches = battle.available_switches[slot] if mon is not None or battle.force_switch[slot] else []
+    opponents = [target for target, is_present in zip(targets[:ALLY], present[:ALLY]) if is_present]
+    if available_switches and opponents:
+        # Switch score of the candidates against the active opponents, relative to the pokemon in the slot
+        scores = np.mean([SwitchBatch(available_switches).scores(opp_mon) for opp_mon in opponents], axis=0)
+        current = np.mean([SwitchBatch([mon]).scores(opp_mon)[0] for opp_mon in opponents]) if mon is not None and not mon.fainted else 0.0
+        for switch, score in zip(available_switches, scores.tolist()):
+            row = np.zeros(N_FEATURES)
+            row[SWITCH] = SWITCH_WEIGHT * (score - current)
+            orders.append(player.create_order(switch))
+            rows.append(row)
+            switches.append(switch)
+
+    return SlotCandidates(orders, np.array(rows, dtype=np.float64).reshape(len(rows), N_FEATURES), switches)
+
+
+def undominated(features : np.ndarray, switching : np.ndarray) -> np.ndarray:
+    '''
+        Mask of the rows no other row matches or exceeds on every feature (the first of equal
+        rows is kept). A switch never drops another one: the other slot may switch to the
+        same pokemon, which makes it illegal in the joint order
+    '''
+    n = len(features)
+    at_least = (features[:, None, :] >= features[None, :, :]).all(axis=2) # [i, j]: i is at least as good as j
+    better = (features[:, None, :] > features[None, :, :]).any(axis=2)
+    earlier = np.tri(n, k=-1, dtype=bool).T # [i, j]: i < j
+    dominated = (at_least & (better | earlier) & ~(switching[:, None] & switching[None, :])).any(axis=0)
+    return ~dominated
+
+
+def slot_value(features : np.ndarray) -> np.ndarray:
+    '''
+        Value of the candidates of a slot played alone
+    '''
+    return (features[:, OPPONENT_1] + features[:, OPPONENT_2] + ALLY_DAMAGE_WEIGHT * features[:, ALLY]
+            + TERA_COST * features[:, TERA] + features[:, SWITCH])
+
+
+def prune(candidates : SlotCandidates, max_actions : int = MAX_SLOT_ACTIONS) -> SlotCandidates:
+    '''
+        Drops the dominated candidates, then keeps the max_actions best ones
+    '''
+    if len(candidates) <= 1:
+        return candidates
+    switching = np.array([switch is not None for switch in candidates.switches], dtype=bool)
+    candidates = candidates.subset(undominated(candidates.features, switching))
+    if len(candidates) > max_actions:
+        keep = np.zeros(len(candidates), dtype=bool)
+        keep[np.argsort(-slot_value(candidates.features), kind='stable')[:max_actions]] = True
+        candidates = candidates.subset(keep)
+    return candidates
+
+
+def joint_values(first : SlotCandidates, second : SlotCandidates, hp : np.ndarray) -> np.ndarray:
+    '''
+        Value of every pair of candidates, shape (len(first), len(second)), -inf for the illegal pairs
+    '''
+    a = first.features[:, None, :]
+    b = second.features[None, :, :]
+    damage = a[..., :ALLY] + b[..., :ALLY]
+    knocked_out = (damage >= hp - 1e-9) & (hp > 0)
+    values = (np.minimum(damage, hp).sum(axis=2) + KO_BONUS * knocked_out.sum(axis=2)
+              + ALLY_DAMAGE_WEIGHT * (a[..., ALLY] + b[..., ALLY])
+              + TERA_COST * (a[..., TERA] + b[..., TERA])
+              + a[..., SWITCH] + b[..., SWITCH])
+
+    both_tera = (a[..., TERA] < 0) & (b[..., TERA] < 0)
+    same_switch = np.array([[switch is not None and switch is other for other in second.switches] for switch in first.switches],
+                           dtype=bool).reshape(len(first), len(second))
+    values[both_tera | same_switch] = -np.inf
+    return values
+
+
+class DoublesEngine:
+    '''
+        Chooses the joint order of both active slots of a DoubleBattle
+    '''
+
+    def __init__(self, max_slot_actions : int = MAX_SLOT_ACTIONS):
+        self.max_slot_actions = max_slot_actions
+        self.n_decisions : int = 0
+        self.n_candidates : int = 0 # Before the pruning
+        self.n_joint_orders : int = 0 # Scored after the pruning
+
+    def choose(self, player, battle):
+        '''
+            Best DoubleBattleOrder, None when no slot has a legal action
+        '''
+        slots = [slot_candidates(player, battle, slot) for slot in range(2)]
+        self.n_decisions += 1
+        self.n_candidates += sum(len(candidates) for candidates in slots)
+        first, second = (prune(candidates, self.max_slot_actions) for candidates in slots)
+
+        if not len(first) and not len(second):
+            return None
+        if not len(first) or not len(second):
+            # One slot only: the other one is empty or does not need a decision
+            candidates = first if len(first) else second
+            return DoubleBattleOrder(candidates.orders[int(np.argmax(slot_value(candidates.features)))], None)
+
+        hp = np.array([mon.current_hp_fraction if mon is not None and not mon.fainted else 0.0
+                       for mon in battle.opponent_active_pokemon])
+        values = joint_values(first, second, hp)
+        self.n_joint_orders += values.size
+        i, j = np.unravel_index(int(np.argmax(values)), values.shape)
+        if values[i, j] == -np.inf:
+            return DoubleBattleOrder(first.orders[int(np.argmax(slot_value(first.features)))], None)
+        return DoubleBattleOrder(first.orders[i], second.orders[j])
+
+    def stats(self) -> dict:
+        return {
+            'decisions': self.n_decisions,
+            'mean_candidates': self.n_candidates / self.n_decisions if self.n_decisions else 0.0,
+            'mean_joint_orders': self.n_joint_orders / self.n_decisions if self.n_decisions else 0.0,
+        }
+
+
+class DoublesHeuristicPlayer(Player):
+    '''
+        Plays doubles formats with DoublesEngine
+    '''
+
+    def __init__(self, max_slot_actions : int = MAX_SLOT_ACTIONS, **kwargs):
+        super().__init__(**kwargs)
+        self.engine = DoublesEngine(max_slot_actions)
+
+    def choose_move(self, battle):
+        if not isinstance(battle, DoubleBattle):
+            raise ValueError('DoublesHeuristicPlayer only plays doubles formats')
+        order = self.engine.choose(self, battle)
+        return order if order is not None else self.choose_random_doubles_move(battle)
@@ -1,20 +1,102 @@
 from tensorflow.python.keras.layers import Dense, Flatten
 from tensorflow.python.keras.models import Sequential
 from tensorflow.python.keras.optimizers import adam_v2 as Adam
+import os
+import numpy as np
 from rl.agents.dqn import DQNAgent
-from rl.memory import SequentialMemory
+from rl.callbacks import Callback
 from rl.policy import LinearAnnealedPolicy, EpsGreedyQPolicy
 from simpleRL_bot import SimpleRLPlayer
 from heuristic_bot import HeuristicPlayer
+from replay_memory import ReplayMemory
+from distillation import agreement, generate_dataset, held_out, pretrain
+from checkpointing import CheckpointWriter, DQN_CHECKPOINT_FILE, DQN_CHECKPOINT_INTERVAL, load_dqn, save_dqn
+
+MEMORY_LIMIT : int = 1_000_000
+MEMORY_FILE : str = 'replay_memory' # Directory of the memory-mapped replay memory
+PRIORITIZED_REPLAY : bool = False # Samples the transitions by TD error instead of uniformly
+MODEL_FILE : str = 'dqn_model.h5' # Checkpoint of the Q-network, playable in a league by BatchedPolicyPlayer
+# The Q-network is first trained on the decisions of HeuristicPlayer on synthetic battles
+DISTILLATION_BATTLES : int = 50_000
+DISTILLATION_EPOCHS : int = 10
+TRAINING_STEPS : int = 10000
+
+
+class PrioritizedDQNAgent(DQNAgent):
+    '''
+        DQNAgent giving the TD errors of every batch it trains on back to a prioritized
+        ReplayMemory. The importance sampling weights are not applied to the loss, the
+        training step of keras-rl has no sample weights
+    '''
+
+    def backward(self, reward, terminal):
+        metrics = super().backward(reward, terminal)
+        indices = self.memory.last_sampled
+        if self.memory.prioritized and indices is not None:
+            self.memory.last_sampled = None
+            self.memory.update_priorities(indices, self.td_errors(indices))
+        return metrics
+
+    def td_errors(self, indices : np.ndarray) -> np.ndarray:
+        '''
+            TD errors of the transitions of the memory at indices, with the networks after the update
+        '''
+        memory = self.memory
+        # (batch, window_length, observation) as the networks expect it
+        observations = self.process_state_batch(memory.observations[indices][:, None])
+        next_observations = self.process_state_batch(memory.next_observations[indices][:, None])
+        rows = np.arange(len(indices))
+
+        next_q = self.target_model.predict_on_batch(next_observations)
+        if self.enable_double_dqn:
+            next_values = next_q[rows, np.argmax(self.model.predict_on_batch(next_observations), axis=1)]
+        else:
+            next_values = np.max(next_q, axis=1)
+        targets = memory.rewards[indices] + self.gamma * (1.0 - memory.dones[indices]) * next_values
+        return targets - self.model.predict_on_batch(observations)[rows, memory.actions[indices]]
+
+
+class DQNCheckpoint(Callback):
+    '''
+        Checkpoints the agent every interval steps and at the end of fit. fit starts from
+        step 0, a resumed run gets its step back when the first episode begins
+    '''
+
+    def __init__(self, memory : ReplayMemory, path : str = DQN_CHECKPOINT_FILE, interval : int = DQN_CHECKPOINT_INTERVAL,
+                 resume_step : int = 0):
+        super().__init__()
+        self.memory = memory
+        self.path = path
+        self.interval = interval
+        self.resume_step = resume_step
+        self.writer = CheckpointWriter()
+
+    def on_episode_begin(self, episode, logs={}):
+        if self.resume_step:
+            self.model.step = self.resume_step
+            self.resume_step = 0
+
+    def on_step_end(self, step, logs={}):
+        # keras-rl counts the step after the callbacks
+        steps_done = int(self.model.step) + 1
+        if steps_done % self.interval == 0:
+            save_dqn(self.model, self.memory, self.path, self.writer, steps_done)
+
+    def on_train_end(self, logs={}):
+        save_dqn(self.model, self.memory, self.path, self.writer)
+        self.writer.close()
 
-heuristic_bot = HeuristicPlayer(battle_format="gen9randombattle", start_timer_on_battle_start=True) 
-train_env = SimpleRLPlayer(battle_format="gen9randombattle", 
-                           start_timer_on_battle_start=True,
-                           start_challenging=True,
-                           opponent=heuristic_bot
-                           )
 
 def main():
+    # The players are created here and not when the module is imported: the workers of
+    # generate_dataset re-import this module, they must not connect to the server
+    heuristic_bot = HeuristicPlayer(battle_format="gen9randombattle", start_timer_on_battle_start=True) 
+    train_env = SimpleRLPlayer(battle_format="gen9randombattle", 
+                               start_timer_on_battle_start=True,
+                               start_challenging=True,
+                               opponent=heuristic_bot
+                               )
+
     # Create a model
     # Compute dimensions
     n_action = train_env.action_space.n
@@ -27,24 +109,33 @@ def main():
     model.add(Dense(64, activation="elu"))
     model.add(Dense(n_action, activation="linear"))
 
+    # A checkpoint replaces the pretrained weights, no need to pretrain again
+    resuming = os.path.exists(DQN_CHECKPOINT_FILE)
+    if DISTILLATION_BATTLES and not resuming:
+        observations, actions = generate_dataset(DISTILLATION_BATTLES)
+        pretrain(model, observations, actions, epochs=DISTILLATION_EPOCHS)
+        print(f'Agreement with the heuristic after pretraining: {agreement(model, *held_out(observations, actions))}')
+
     # Defining the DQN
-    memory = SequentialMemory(limit=10000, window_length=1)
+    memory = ReplayMemory(limit=MEMORY_LIMIT, observation_shape=train_env.observation_space.shape,
+                          prioritized=PRIORITIZED_REPLAY, filename=MEMORY_FILE)
 
+    # A pretrained network already plays like the heuristic, it only needs a little exploration
     policy = LinearAnnealedPolicy(
         EpsGreedyQPolicy(),
         attr="eps",
-        value_max=1.0,
+        value_max=0.2 if DISTILLATION_BATTLES else 1.0,
         value_min=0.05,
         value_test=0.0,
-        nb_steps=10000,
+        nb_steps=2000 if DISTILLATION_BATTLES else 10000,
     )
 
-    dqn = DQNAgent(
+    dqn = PrioritizedDQNAgent(
         model=model,
         nb_actions=n_action,
         policy=policy,
         memory=memory,
-        nb_steps_warmup=1000,
+        nb_steps_warmup=100 if DISTILLATION_BATTLES else 1000,
         gamma=0.5,
         target_model_update=1,
         delta_clip=0.01,
@@ -52,7 +143,13 @@ def main():
     )
     dqn.compile(Adam(learning_rate=0.00025), metrics=["mae"])
 
-    dqn.fit(train_env, nb_steps=10000)
+    resume_step = load_dqn(dqn, memory)
+    if resume_step:
+        print(f'Resuming the training at step {resume_step}')
+    if resume_step < TRAINING_STEPS:
+        dqn.fit(train_env, nb_steps=TRAINING_STEPS, callbacks=[DQNCheckpoint(memory, resume_step=resume_step)])
+    model.save(MODEL_FILE)
+    memory.flush()
     train_env.close()
 
 if __name__ == "__main__":
@@ -1,48 +1,114 @@
+import json
+import os
 import numpy as np
 import random
-from poke_env.data import GenData
 from poke_env import Player
 from poke_env.environment.pokemon_type import PokemonType
 from poke_env.environment.pokemon import Pokemon
+from battle_retention import BattleRetention
+from type_effectiveness import best_multiplier, multiplier_against
+from batch_scoring import MoveBatch, SwitchBatch, last_argmax, running_best
+from matchup_cache import MatchupCache, matchup_key
+from team_matchups import TeamMatchups
+from damage_calc import expected_damage, type_multipliers
+from lookahead import LookaheadSearch
+from set_index import SetIndex
+
+
+# Weights of the contextual score, in the order used by the parameter search
+PARAMETER_NAMES : tuple = ('par_stats', 'par_typing', 'par_hp', 'par_status', 'par_weather')
+# Terms of the contextual score, in the order they are added
+SCORE_COMPONENTS : tuple = ('speed', 'stats', 'typing', 'hp', 'status', 'weather')
+DEFAULT_PARAMETERS : dict = {
+    'par_stats': 1.113727387000199,
+    'par_typing': 0.9582001361390107,
+    'par_hp': 1.6876925933704248,
+    'par_status': 1.2996384594734227,
+    'par_weather': 1.8776382680824122,
+}
+PARAMETERS_FILE : str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parameters.json')
+# Weathers scored by weather_condition, by value of Weather
+WEATHER_NAMES : dict = {9: 'Sunny', 6: 'Rainy', 7: 'Sandstorm', 4: 'Hail/Snowy', 8: 'Hail/Snowy'}
+
+
+def load_parameters(path : str = PARAMETERS_FILE) -> dict:
+    '''
+        Reads the weights of the contextual score saved by the parameter search.
+        The weights missing in the file keep their default value
+    '''
+    with open(path) as file:
+        saved = json.load(file)
+    return {name: float(saved.get(name, DEFAULT_PARAMETERS[name])) for name in PARAMETER_NAMES}
+
+
+class BattleContext:
+    '''
+        State of HeuristicPlayer in one battle, so concurrent battles do not share
+        the turn counter or the last action
+    '''
+
+    def __init__(self):
+        self.current_turn : int = 0
+        self.last_move = None
+        self.team_matchups = TeamMatchups() # Switch scores of our team against the opponents seen
+        self.last_search = None # SearchResult of the last decision, in search mode
+        self.score_components = None # Weighted terms of the last contextual score, as in SCORE_COMPONENTS
 
 
-class HeuristicPlayer(Player):
+class HeuristicPlayer(BattleRetention, Player):
 
-    def __init__(self, training_mode:bool=None,par_stats=None, par_typing=None, par_hp=None, par_status=None, par_weather=None,**kwargs):
+    def __init__(self, training_mode:bool=None,par_stats=None, par_typing=None, par_hp=None, par_status=None, par_weather=None,parameters_file:str=None,matchup_cache_size:int=4096,use_damage_calc:bool=False,
+                 search_time_budget:float=None,search_depth:int=2,set_index_file:str=None,**kwargs):
         super().__init__(**kwargs)
-        self.current_turn : int = 0
         self.training_mode = training_mode
-        self.par_stats = 1.113727387000199
-        self.par_typing = 0.9582001361390107
-        self.par_hp = 1.6876925933704248
-        self.par_status = 1.2996384594734227
-        self.par_weather = 1.8776382680824122
-        self.last_move = None
+        self.use_damage_calc = use_damage_calc # Ranks the moves by expected damage instead of base power
+        # With the set index, the likely moves of the opponents count in the switches and the search
+        self.set_index = SetIndex(set_index_file) if set_index_file else None
+        # With a time budget (seconds per decision), the moves are chosen by a lookahead search
+        self.lookahead = LookaheadSearch(search_time_budget, search_depth, set_index=self.set_index) if search_time_budget else None
+        self.set_parameters(DEFAULT_PARAMETERS)
+        self._contexts : dict = {} # battle tag -> BattleContext
+        self.matchups = MatchupCache(matchup_cache_size) # Shared by all the battles of the player
+
+        if parameters_file is not None:
+            self.set_parameters(load_parameters(parameters_file))
 
         if self.training_mode:
-            self.par_stats = random.uniform(1,2)
-            self.par_typing = random.uniform(1,2)
-            self.par_hp = random.uniform(1,2)
-            self.par_status = random.uniform(1,2)
-            self.par_weather = random.uniform(1,2)
- 
-
-    def modify_parameter(self,parameter):
-        return parameter + random.uniform(-0.05,0.05)
-    
-    def adjust_parameters(self, best:bool,dicc_par : dict = None):
-        if best:
-            self.par_stats = self.modify_parameter(self.par_stats)
-            self.par_typing = self.modify_parameter(self.par_typing)
-            self.par_hp = self.modify_parameter(self.par_hp)
-            self.par_status = self.modify_parameter(self.par_status)
-            self.par_weather = self.modify_parameter(self.par_weather)
-        else:
-            self.par_stats = self.modify_parameter(dicc_par['par_stats'])
-            self.par_typing = self.modify_parameter(dicc_par['par_typing'])
-            self.par_hp = self.modify_parameter(dicc_par['par_hp'])
-            self.par_status = self.modify_parameter(dicc_par['par_status'])
-            self.par_weather = self.modify_parameter(dicc_par['par_weather'])
+            self.set_parameters({name: random.uniform(1,2) for name in PARAMETER_NAMES})
+
+        # The weights given explicitly have priority over the file and the training mode
+        explicit = dict(par_stats=par_stats, par_typing=par_typing, par_hp=par_hp, par_status=par_status, par_weather=par_weather)
+        self.set_parameters({name: value for name, value in explicit.items() if value is not None})
+
+    def get_parameters(self) -> dict:
+        return {name: getattr(self, name) for name in PARAMETER_NAMES}
+
+    def set_parameters(self, parameters : dict):
+        for name, value in parameters.items():
+            if name not in PARAMETER_NAMES:
+                raise ValueError(f'Unknown parameter {name}')
+            setattr(self, name, float(value))
+
+    def context(self, battle) -> BattleContext:
+        '''
+            Context of the battle, created at its first decision
+        '''
+        context = self._contexts.get(battle.battle_tag)
+        if context is None:
+            context = self._contexts[battle.battle_tag] = BattleContext()
+        return context
+
+    def drop_context(self, battle):
+        self._contexts.pop(battle.battle_tag, None)
+
+    def teampreview(self, battle):
+        # The matchups against the team shown in the preview are ready for the first switch
+        self.context(battle).team_matchups.update(battle)
+        return super().teampreview(battle)
+
+    def _battle_finished_callback(self, battle):
+        self.drop_context(battle)
+        super()._battle_finished_callback(battle)
 
     def choose_move(self, battle):
         debug : bool = False
@@ -53,49 +119,79 @@ class HeuristicPlayer(Player):
             # 2. Otherwise, change the active pokemon to one that is not weak to the opponent's active pokemon
             my_mon = battle.active_pokemon
             opp_mon = battle.opponent_active_pokemon
+            context = self.context(battle)
+            context.score_components = None
             contextual_score : float = 0.0
 
-            if self.is_faster(battle,my_mon, opp_mon):
-                    contextual_score += 2
+            if self.lookahead is not None:
+                return self.search_move(battle, context)
 
-            contextual_score += self.par_stats * self.stats_balance(my_mon, opp_mon, debug)
-            contextual_score += self.par_typing * self.typing_advantage(my_mon, opp_mon, debug)
-            contextual_score += self.par_hp * (my_mon.current_hp_fraction - opp_mon.current_hp_fraction)
-            contextual_score += self.par_status * self.status_condition(my_mon, opp_mon, debug)
-            contextual_score += self.par_weather * self.weather_condition(my_mon, opp_mon, battle, debug)
+            context.score_components = (
+                2 if self.is_faster(battle,my_mon, opp_mon) else 0,
+                self.par_stats * self.stats_balance(my_mon, opp_mon, debug),
+                self.par_typing * self.typing_advantage(my_mon, opp_mon, debug),
+                self.par_hp * (my_mon.current_hp_fraction - opp_mon.current_hp_fraction),
+                self.par_status * self.status_condition(my_mon, opp_mon, debug),
+                self.par_weather * self.weather_condition(my_mon, opp_mon, battle, debug),
+            )
+            for component in context.score_components:
+                contextual_score += component
 
             if debug:
-                print(f'Turn {self.current_turn}\nContextual score: {contextual_score}\n')
+                print(f'Turn {context.current_turn}\nContextual score: {contextual_score}\n')
            
-            if contextual_score <= -1 and battle.available_switches != [] and not isinstance(self.last_move,Pokemon): # If the score is negative, we change the active pokemon
-                best_move = self.best_switch_action(battle.available_switches, opp_mon, debug)
-                self.last_move = best_move
+            if contextual_score <= -1 and battle.available_switches != [] and not isinstance(context.last_move,Pokemon): # If the score is negative, we change the active pokemon
+                best_move = self.best_switch_action(battle.available_switches, opp_mon, debug, battle)
+                context.last_move = best_move
 
             if opp_mon.terastallized:
                 # Checking the best move to use - Also we need to check the ability of the pokemon
                 best_move = self.choose_best_move(battle, opp_mon, True)
-                self.last_move = best_move
+                context.last_move = best_move
             else:
                 best_move = self.choose_best_move(battle, opp_mon, False)
-                self.last_move = best_move
+                context.last_move = best_move
                 
             
             return self.create_order(best_move)
                 
         else:
+            if battle.battle_tag in self._contexts:
+                self._contexts[battle.battle_tag].score_components = None
             return self.choose_random_move(battle)
-        
+
+    def score_components(self, battle) -> tuple:
+        '''
+            Weighted terms of the contextual score of the last decision in the battle, as in
+            SCORE_COMPONENTS. None when it was not taken with the contextual score
+        '''
+        context = self._contexts.get(battle.battle_tag)
+        return context.score_components if context is not None else None
+
+    def search_move(self, battle, context : BattleContext):
+        '''
+            Order of the best action found by the lookahead search within the time budget
+        '''
+        self.increment_turn(battle)
+        result = self.lookahead.search(battle)
+        context.last_search = result
+        context.last_move = result.action[1]
+        if result.action[0] == 'switch':
+            return self.create_order(result.action[1])
+        return self.create_order(result.action[1], terastallize=result.action[2])
+
     def is_faster(self,battle,my_mon, opp_mon) -> bool:
         field_state = battle.fields
+        context = self.context(battle)
         trick_room : bool = False
 
         # Checking whether trick room is active
         for field in field_state:
-            if int(field.value) == 11 and int(field_state[field])+3 > self.current_turn:
+            if int(field.value) == 11 and int(field_state[field])+3 > context.current_turn:
                 trick_room = True
                 break
 
-        self.increment_turn()
+        self.increment_turn(battle)
         if trick_room:
             return my_mon.base_stats['spe'] <= opp_mon.base_stats['spe']
         
@@ -128,63 +224,85 @@ class HeuristicPlayer(Player):
         return balance
     
     def typing_advantage(self, my_mon, opp_mon, debug):
+        advantage = self.matchups.cached('typing', my_mon, opp_mon, lambda: self._typing_advantage(my_mon, opp_mon))
+        if debug:
+            print(f'performance type advantage: {advantage}')
+        return advantage
+
+    def _typing_advantage(self, my_mon, opp_mon) -> float:
         # We evaluate the performance on mon_a against mon_b as its type advantage
-        a_on_b = b_on_a = -np.inf
-        for type_ in my_mon.types:
-            if type_:
-                a_on_b = max(
-                    a_on_b,
-                    type_.damage_multiplier(
-                        *opp_mon.types, type_chart=GenData.from_gen(8).type_chart
-                    ),
-                )
+        a_on_b = best_multiplier(my_mon.types, opp_mon.types)
         # We do the same for mon_b over mon_a
-        for type_ in opp_mon.types:
-            if type_:
-                b_on_a = max(
-                    b_on_a,
-                    type_.damage_multiplier(
-                        *my_mon.types, type_chart=GenData.from_gen(8).type_chart
-                    ),
-                )
+        b_on_a = best_multiplier(opp_mon.types, my_mon.types)
         # Our performance metric is the different between the two
-        if debug:
-            print(f'performance type advantage: {a_on_b - b_on_a}')
         return a_on_b - b_on_a
     
     def moves_advantage(self, my_mon, opp_mon, debug):
         '''
             Checks the advantage of the moves of the pokemon
         '''
-        my_moves = my_mon.moves
-        advantage : float = 0.0
-
-        for move in my_moves.values():
-            if move:
-                advantage += move.base_power/100 * move.type.damage_multiplier(*opp_mon.types,type_chart=GenData.from_gen(8).type_chart)
+        advantage = self.matchups.cached('moves', my_mon, opp_mon, lambda: self._moves_advantage(my_mon, opp_mon))
         if debug:
             print(f'Moves advantage: {advantage}')
 
         return advantage
-    
-    def best_switch_action(self, available_switches : list, opp_mon, debug : bool):
+
+    def _moves_advantage(self, my_mon, opp_mon) -> float:
+        advantage : float = 0.0
+
+        for move in my_mon.moves.values():
+            if move:
+                advantage += move.base_power/100 * multiplier_against(move.type, opp_mon)
+        return advantage
+
+    def opponent_threat(self, my_mon, opp_mon) -> float:
+        '''
+            Advantage of the moves opp_mon is likely to have against my_mon, the revealed ones
+            and the ones of its random battle sets weighted by their probability
+        '''
+        revealed = tuple(opp_mon.moves)
+        return self.matchups.cached(('threat', revealed), my_mon, opp_mon, lambda: self._opponent_threat(my_mon, opp_mon))
+
+    def _opponent_threat(self, my_mon, opp_mon) -> float:
+        moves = {move.id: (move, 1.0) for move in opp_mon.moves.values()}
+        for move, probability in self.set_index.weighted_moves(opp_mon.species):
+            moves.setdefault(move.id, (move, probability))
+
+        threat : float = 0.0
+        for move, probability in moves.values():
+            threat += probability * move.base_power/100 * multiplier_against(move.type, my_mon)
+        return threat
+
+    def best_switch_action(self, available_switches : list, opp_mon, debug : bool, battle=None):
         '''
             Returns the best switch action to take with the aviable mons
-            according to the type advantage and the moves of the pokemon waiting for the switch
+            according to the type advantage and the moves of the pokemon waiting for the switch.
+            With the battle, the scores are read from the matchup matrix of its context
         '''
-        best_score = -np.inf
-        best_mon = None
+        if battle is not None and opp_mon in battle.opponent_team.values():
+            scores = self.context(battle).team_matchups.switch_scores(battle, available_switches, opp_mon)
+        else:
+            # Only the candidates missing from the cache are scored, in a single batch
+            keys = [matchup_key('switch', mon, opp_mon) for mon in available_switches]
+            scores = [self.matchups.get(key) for key in keys]
+            missing = [i for i, score in enumerate(scores) if score is None]
+            if missing:
+                computed = SwitchBatch([available_switches[i] for i in missing]).scores(opp_mon)
+                for i, score in zip(missing, computed.tolist()):
+                    scores[i] = score
+                    self.matchups.put(keys[i], score)
+
+        if self.set_index is not None:
+            scores = np.asarray(scores) - [self.opponent_threat(mon, opp_mon) for mon in available_switches]
+        best_index = int(np.argmax(scores))
 
-        for mons in available_switches:
-            actual_score = self.typing_advantage(mons, opp_mon,False) + self.moves_advantage(mons, opp_mon, debug)
-            if actual_score > best_score:
-                best_score = actual_score
-                best_mon = mons
+        if debug:
+            print(f'Switch scores: {scores}')
 
-        return best_mon
+        return available_switches[best_index]
     
-    def increment_turn(self):
-        self.current_turn += 1
+    def increment_turn(self, battle):
+        self.context(battle).current_turn += 1
 
     def status_condition(self, my_mon, opp_mon, debug):
         '''
@@ -230,66 +348,77 @@ class HeuristicPlayer(Player):
         actual_weather : str = 'None'
 
         for weather in weather_state:
-            # Checking whether the weather is sunny
-            if int(weather.value) == 9:
-                actual_weather = 'Sunny'
-                if self.check_desire_type(my_mon,PokemonType.FIRE): # Checking if the pokemon is a fire type
-                    wheather_condition += 1
-                    if PokemonType.FIRE.damage_multiplier(*opp_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition += 0.5
-
-                elif self.check_desire_type(opp_mon,PokemonType.FIRE):
-                    wheather_condition -= 1
-                    if PokemonType.FIRE.damage_multiplier(*my_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition -= 0.5
-
-                if self.check_desire_type(my_mon,PokemonType.WATER): # Checking if the pokemon is a water type
+            weather_value = int(weather.value)
+            if weather_value in WEATHER_NAMES:
+                actual_weather = WEATHER_NAMES[weather_value]
+                # The score only depends on the types of both pokemons
+                wheather_condition += self.matchups.cached(('weather', weather_value), my_mon, opp_mon,
+                                                           lambda: self.weather_score(weather_value, my_mon, opp_mon))
+
+        if debug:
+            print(f'Weather condition score: {wheather_condition} in {actual_weather}')    
+
+        return wheather_condition
+
+    def weather_score(self, weather_value : int, my_mon, opp_mon) -> float:
+        '''
+            Score of the types of both pokemons under the weather of the given value
+        '''
+        wheather_condition : float = 0.0
+
+        # Checking whether the weather is sunny
+        if weather_value == 9:
+            if self.check_desire_type(my_mon,PokemonType.FIRE): # Checking if the pokemon is a fire type
+                wheather_condition += 1
+                if multiplier_against(PokemonType.FIRE, opp_mon) > 1:
+                    wheather_condition += 0.5
+
+            elif self.check_desire_type(opp_mon,PokemonType.FIRE):
+                wheather_condition -= 1
+                if multiplier_against(PokemonType.FIRE, my_mon) > 1:
                     wheather_condition -= 0.5
-                elif self.check_desire_type(opp_mon,PokemonType.WATER):
+
+            if self.check_desire_type(my_mon,PokemonType.WATER): # Checking if the pokemon is a water type
+                wheather_condition -= 0.5
+            elif self.check_desire_type(opp_mon,PokemonType.WATER):
+                wheather_condition += 0.5
+        # Checking whether the weather is rainy
+        elif weather_value == 6:
+            if self.check_desire_type(my_mon,PokemonType.WATER): # Checking if the pokemon is a water type
+                wheather_condition += 1
+                if multiplier_against(PokemonType.WATER, opp_mon) > 1:
                     wheather_condition += 0.5
-            # Checking whether the weather is rainy
-            elif int(weather.value) == 6:
-                actual_weather = 'Rainy'
-                if self.check_desire_type(my_mon,PokemonType.WATER): # Checking if the pokemon is a water type
-                    wheather_condition += 1
-                    if PokemonType.WATER.damage_multiplier(*opp_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition += 0.5
-
-                elif self.check_desire_type(opp_mon,PokemonType.WATER):
-                    wheather_condition -= 1
-                    if PokemonType.WATER.damage_multiplier(*my_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition -= 0.5
-
-                if self.check_desire_type(my_mon,PokemonType.FIRE): # Checking if the pokemon is a fire type
+
+            elif self.check_desire_type(opp_mon,PokemonType.WATER):
+                wheather_condition -= 1
+                if multiplier_against(PokemonType.WATER, my_mon) > 1:
                     wheather_condition -= 0.5
-                elif self.check_desire_type(opp_mon,PokemonType.FIRE):
+
+            if self.check_desire_type(my_mon,PokemonType.FIRE): # Checking if the pokemon is a fire type
+                wheather_condition -= 0.5
+            elif self.check_desire_type(opp_mon,PokemonType.FIRE):
+                wheather_condition += 0.5
+        # Checking whether the weather is sandstorm
+        elif weather_value == 7:
+            if self.check_desire_type(my_mon,PokemonType.ROCK): # Checking if the pokemon is a rock type
+                wheather_condition += 1
+                if multiplier_against(PokemonType.ROCK, opp_mon) > 1:
                     wheather_condition += 0.5
-            # Checking whether the weather is sandstorm
-            elif int(weather.value) == 7:
-                actual_weather = 'Sandstorm'
-                if self.check_desire_type(my_mon,PokemonType.ROCK): # Checking if the pokemon is a rock type
-                    wheather_condition += 1
-                    if PokemonType.ROCK.damage_multiplier(*opp_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition += 0.5
-
-                elif self.check_desire_type(opp_mon,PokemonType.ROCK):
-                    wheather_condition -= 1
-                    if PokemonType.ROCK.damage_multiplier(*my_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition -= 0.5
-            # Checking wheter the weather is hail or snowy
-            elif int(weather.value) == 4 or int(weather.value) == 8:
-                actual_weather = 'Hail/Snowy'
-                if self.check_desire_type(my_mon,PokemonType.ICE): # Checking if the pokemon is an ice type
-                    wheather_condition += 1
-                    if PokemonType.ICE.damage_multiplier(*opp_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition += 0.5
-                elif self.check_desire_type(opp_mon,PokemonType.ICE):
-                    wheather_condition -= 1
-                    if PokemonType.ICE.damage_multiplier(*my_mon.types, type_chart=GenData.from_gen(8).type_chart) > 1:
-                        wheather_condition -= 0.5
 
-        if debug:
-            print(f'Weather condition score: {wheather_condition} in {actual_weather}')    
+            elif self.check_desire_type(opp_mon,PokemonType.ROCK):
+                wheather_condition -= 1
+                if multiplier_against(PokemonType.ROCK, my_mon) > 1:
+                    wheather_condition -= 0.5
+        # Checking wheter the weather is hail or snowy
+        elif weather_value == 4 or weather_value == 8:
+            if self.check_desire_type(my_mon,PokemonType.ICE): # Checking if the pokemon is an ice type
+                wheather_condition += 1
+                if multiplier_against(PokemonType.ICE, opp_mon) > 1:
+                    wheather_condition += 0.5
+            elif self.check_desire_type(opp_mon,PokemonType.ICE):
+                wheather_condition -= 1
+                if multiplier_against(PokemonType.ICE, my_mon) > 1:
+                    wheather_condition -= 0.5
 
         return wheather_condition
     
@@ -306,24 +435,31 @@ class HeuristicPlayer(Player):
     def choose_best_move(self, battle, opp_mon, terastallized : bool):
         # Checking if the mon has al least one move which affects neutral against the opponent.
         # Otherwise, we will change the active pokemon
-        best_move = None
-        best_score = -np.inf
+        if self.use_damage_calc:
+            return self.choose_damage_move(battle, opp_mon)
+
+        moves = MoveBatch(battle.available_moves)
+        multipliers, scores = moves.scores(opp_mon, terastallized)
+
+        if np.all(multipliers < 1) and battle.available_switches != [] and not isinstance(self.context(battle).last_move,Pokemon):
+            return self.best_switch_action(battle.available_switches, opp_mon, False, battle)
 
         if terastallized:
-            if all(move.type.damage_multiplier(opp_mon.tera_type,type_chart=GenData.from_gen(8).type_chart) < 1 for move in battle.available_moves) and battle.available_switches != [] and not isinstance(self.last_move,Pokemon):
-                return self.best_switch_action(battle.available_switches, opp_mon, False)
-            
-            for move in battle.available_moves:
-                if move.base_power/100 * move.type.damage_multiplier(opp_mon.tera_type,type_chart=GenData.from_gen(8).type_chart) >= best_score:
-                    best_score = move.base_power/100 * move.type.damage_multiplier(*opp_mon.types,type_chart=GenData.from_gen(8).type_chart)
-                    best_move = move
-        else:
-            if all(move.type.damage_multiplier(*opp_mon.types,type_chart=GenData.from_gen(8).type_chart) < 1 for move in battle.available_moves) and battle.available_switches != [] and not isinstance(self.last_move,Pokemon):
-                return self.best_switch_action(battle.available_switches, opp_mon, False)
-            
-            for move in battle.available_moves:
-                if move.base_power/100 * move.type.damage_multiplier(*opp_mon.types,type_chart=GenData.from_gen(8).type_chart) >= best_score:
-                    best_score = move.base_power/100 * move.type.damage_multiplier(*opp_mon.types,type_chart=GenData.from_gen(8).type_chart)
-                    best_move = move
+            # Moves are ranked by their score on the tera type, but the best score kept
+            # is the one on the types of the opponent
+            _, types_scores = moves.scores(opp_mon, False)
+            return moves.moves[running_best(scores, types_scores)]
+
+        return moves.moves[last_argmax(scores)]
+
+    def choose_damage_move(self, battle, opp_mon):
+        '''
+            choose_best_move ranking the moves by expected damage
+        '''
+        moves = battle.available_moves
+        if all(multiplier < 1 for multiplier in type_multipliers(moves, opp_mon)) and battle.available_switches != [] and not isinstance(self.context(battle).last_move,Pokemon):
+            return self.best_switch_action(battle.available_switches, opp_mon, False, battle)
 
-        return best_move
+        damage = expected_damage(battle.active_pokemon, moves, opp_mon, battle.weather)
+        # The last of the best moves, as last_argmax
+        return moves[max(reversed(range(len(damage))), key=lambda i: damage[i][0])]
@@ -0,0 +1,139 @@
+'''
+    Batched policy inference for many concurrent battles.
+
+    Every battle that needs a decision puts its observation in a queue and waits.
+    A single worker task takes up to max_batch_size pending observations (waiting at
+    most max_wait seconds for the batch to fill), runs one forward pass of the model
+    for all of them and sends each action back to its battle, where it is turned into
+    an order through action_to_order, the same mapping as SimpleRLPlayer.action_to_move.
+'''
+import asyncio
+import time
+from collections import Counter
+import numpy as np
+from poke_env import Player
+from simpleRL_bot import action_to_order, embed_battle
+
+
+def keras_predict(model):
+    '''
+        Wraps a Keras model built for SimpleRLPlayer (input of shape (batch, 1, dim),
+        the window of keras-rl) as a function of a (batch, dim) array
+    '''
+    def predict(observations : np.ndarray) -> np.ndarray:
+        return model.predict_on_batch(observations[:, None, :])
+    return predict
+
+
+class InferenceBatcher:
+
+    def __init__(self, predict, observation_shape : tuple, max_batch_size : int = 32, max_wait : float = 0.002):
+        '''
+            predict maps a (batch,) + observation_shape array to the (batch, n_actions) Q-values
+        '''
+        self.predict_batch = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._buffer = np.zeros((max_batch_size,) + tuple(observation_shape), dtype=np.float32)
+        self._queue = None
+        self._worker = None
+
+        # Metrics
+        self.n_requests : int = 0
+        self.n_batches : int = 0
+        self.batch_sizes : Counter = Counter()
+        self.max_queue_depth : int = 0
+        self.inference_time : float = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def predict(self, observation : np.ndarray) -> int:
+        '''
+            Returns the greedy action for the observation, batched with the other pending ones
+        '''
+        loop = asyncio.get_running_loop()
+        # The queue and the worker live in the loop of the battles (the poke_env loop)
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        self._queue.put_nowait((observation, future))
+        self.n_requests += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            n = len(batch)
+            for i, (observation, _) in enumerate(batch):
+                self._buffer[i] = observation
+
+            start_time = time.time()
+            try:
+                # The forward pass runs out of the loop, so the battles keep queueing meanwhile
+                q_values = await loop.run_in_executor(None, self.predict_batch, self._buffer[:n])
+                actions = np.argmax(np.asarray(q_values).reshape(n, -1), axis=1)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.inference_time += time.time() - start_time
+                self.n_batches += 1
+                self.batch_sizes[n] += 1
+
+            for (_, future), action in zip(batch, actions.tolist()):
+                if not future.done():
+                    future.set_result(action)
+
+    def metrics(self) -> dict:
+        return {
+            'requests': self.n_requests,
+            'batches': self.n_batches,
+            'mean_batch_size': self.n_requests / self.n_batches if self.n_batches else 0.0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'mean_inference_time': self.inference_time / self.n_batches if self.n_batches else 0.0,
+        }
+
+
+class BatchedPolicyPlayer(Player):
+    '''
+        Plays a trained SimpleRLPlayer policy in any number of concurrent battles,
+        every decision going through a shared InferenceBatcher
+    '''
+
+    def __init__(self, batcher : InferenceBatcher, **kwargs):
+        super().__init__(**kwargs)
+        self.batcher = batcher
+
+    async def choose_move(self, battle):
+        action = await self.batcher.predict(embed_battle(battle))
+        return action_to_order(self, action, battle)
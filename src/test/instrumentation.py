@@ -0,0 +1,184 @@
+'''
+    Instrumentation of the players during real battles.
+
+    instrument_player wraps choose_move of any player (and the components of the
+    contextual score when the player has them) to record:
+        - the latency of every decision,
+        - the time spent in every component of the contextual score,
+        - the server round-trip, from the end of a decision to the next request of the
+          same battle (the opponent decision and the server are both in it),
+        - the number of turns of every finished battle.
+    EventLoopMonitor measures how late the poke_env event loop wakes up, which grows
+    when the loop is saturated. Every sample goes to an Instrumentation, which gives
+    percentiles and histograms and exports them as JSON and CSV, so it can be told
+    whether a run is limited by the bot, the event loop or the server.
+'''
+import asyncio
+import csv
+import json
+import time
+from collections import defaultdict
+from typing import Awaitable
+import numpy as np
+from poke_env.concurrency import POKE_LOOP
+
+# Components of the contextual score of HeuristicPlayer
+COMPONENTS : tuple = ('is_faster', 'stats_balance', 'typing_advantage', 'status_condition', 'weather_condition',
+                      'choose_best_move', 'best_switch_action')
+PERCENTILES : tuple = (50, 90, 99)
+INSTRUMENTATION_FILE : str = 'instrumentation'
+
+
+class Instrumentation:
+    '''
+        Samples of every metric, by name ('<player>/<metric>')
+    '''
+
+    def __init__(self):
+        self.samples : dict = defaultdict(list)
+
+    def record(self, name : str, value : float):
+        self.samples[name].append(value)
+
+    def summary(self, name : str) -> dict:
+        values = np.asarray(self.samples[name], dtype=np.float64)
+        if len(values) == 0:
+            return {'count': 0}
+        summary = {'count': len(values), 'mean': float(values.mean()), 'total': float(values.sum())}
+        for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            summary[f'p{percentile}'] = float(value)
+        summary['max'] = float(values.max())
+        return summary
+
+    def histogram(self, name : str, bins : int = 20) -> dict:
+        '''
+            Counts over logarithmic bins, latencies spread over several orders of magnitude
+        '''
+        values = np.asarray(self.samples[name], dtype=np.float64)
+        positive = values[values > 0]
+        if len(positive) == 0:
+            return {'edges': [], 'counts': []}
+        low, high = positive.min(), positive.max()
+        edges = np.geomspace(low, high, bins + 1) if high > low else np.array([low, high + 1])
+        counts, edges = np.histogram(positive, edges)
+        return {'edges': edges.tolist(), 'counts': counts.tolist()}
+
+    def to_json(self, path : str):
+        with open(path, 'w') as file:
+            json.dump({
+                name: {'summary': self.summary(name), 'histogram': self.histogram(name)}
+                for name in sorted(self.samples)
+            }, file, indent=4)
+
+    def to_csv(self, path : str):
+        columns = ['count', 'mean', 'total'] + [f'p{percentile}' for percentile in PERCENTILES] + ['max']
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['metric'] + columns)
+            for name in sorted(self.samples):
+                summary = self.summary(name)
+                writer.writerow([name] + [summary.get(column, '') for column in columns])
+
+    def export(self, path : str = INSTRUMENTATION_FILE):
+        '''
+            Writes path.json (summaries and histograms) and path.csv (summaries)
+        '''
+        self.to_json(path + '.json')
+        self.to_csv(path + '.csv')
+
+    def print_summary(self):
+        print(f"{'metric':<50}{'count':>8}{'mean':>12}{'p50':>12}{'p90':>12}{'p99':>12}{'max':>12}")
+        for name in sorted(self.samples):
+            summary = self.summary(name)
+            print(
+                f"{name:<50}{summary['count']:>8}{summary['mean']:>12.2f}{summary['p50']:>12.2f}"
+                f"{summary['p90']:>12.2f}{summary['p99']:>12.2f}{summary['max']:>12.2f}"
+            )
+
+
+def _timed(player, name : str, function):
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            player._instrumentation.record(f'{player.username}/{name}_us', (time.perf_counter() - start_time) * 1e6)
+    return wrapper
+
+
+def instrument_player(player, instrumentation : Instrumentation):
+    '''
+        Records the metrics of player in instrumentation. A player already instrumented
+        only switches to the new instrumentation
+    '''
+    already_instrumented = hasattr(player, '_instrumentation')
+    player._instrumentation = instrumentation
+    if already_instrumented:
+        return player
+
+    prefix = player.username
+    decision_end = {} # battle tag -> time of the end of the last decision
+    choose_move = player.choose_move
+    battle_finished_callback = player._battle_finished_callback
+
+    def decided(battle, start_time : float):
+        end_time = time.perf_counter()
+        player._instrumentation.record(f'{prefix}/choose_move_us', (end_time - start_time) * 1e6)
+        decision_end[battle.battle_tag] = end_time
+
+    async def decided_async(battle, order, start_time : float):
+        try:
+            return await order
+        finally:
+            decided(battle, start_time)
+
+    def instrumented_choose_move(battle):
+        start_time = time.perf_counter()
+        last_decision = decision_end.pop(battle.battle_tag, None)
+        if last_decision is not None:
+            player._instrumentation.record(f'{prefix}/server_round_trip_ms', (start_time - last_decision) * 1e3)
+
+        order = choose_move(battle)
+        # Players deciding asynchronously (batched inference) are timed until the order is ready
+        if isinstance(order, Awaitable):
+            return decided_async(battle, order, start_time)
+        decided(battle, start_time)
+        return order
+
+    def instrumented_battle_finished_callback(battle):
+        decision_end.pop(battle.battle_tag, None)
+        player._instrumentation.record(f'{prefix}/turns_per_battle', battle.turn)
+        return battle_finished_callback(battle)
+
+    player.choose_move = instrumented_choose_move
+    player._battle_finished_callback = instrumented_battle_finished_callback
+    for component in COMPONENTS:
+        if hasattr(player, component):
+            setattr(player, component, _timed(player, component, getattr(player, component)))
+    return player
+
+
+class EventLoopMonitor:
+    '''
+        Records how late the poke_env event loop wakes up from a sleep of interval seconds
+    '''
+
+    def __init__(self, instrumentation : Instrumentation, interval : float = 0.01):
+        self.instrumentation = instrumentation
+        self.interval = interval
+        self._future = None
+
+    async def _monitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start_time = loop.time()
+            await asyncio.sleep(self.interval)
+            self.instrumentation.record('event_loop_lag_ms', (loop.time() - start_time - self.interval) * 1e3)
+
+    def start(self):
+        self._future = asyncio.run_coroutine_threadsafe(self._monitor(), POKE_LOOP)
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
@@ -0,0 +1,263 @@
+'''
+    Headless round-robin league between bot configurations, with Elo ratings.
+
+    The league is described by a JSON config:
+        {
+            "battles_per_pairing": 50,
+            "max_concurrent_battles": 16,
+            "entries": [
+                {"name": "random", "class": "RandomPlayer"},
+                {"name": "max_damage", "class": "MaxDamagePlayer", "kwargs": {"use_damage_calc": true}},
+                {"name": "heuristic", "class": "HeuristicPlayer", "kwargs": {"parameters_file": "parameters.json"}},
+                {"name": "dqn", "class": "BatchedPolicyPlayer", "checkpoint": "dqn_model.h5"}
+            ]
+        }
+    Every pairing of two entries gets its own two players and all the pairings run at
+    the same time. The battles of a pairing are launched in rounds, each round takes as
+    many battles as the global limit of concurrent battles leaves free, so the server
+    never runs more than max_concurrent_battles league battles. The win-rate matrix and
+    the Elo ratings are updated as every battle finishes. The entries of a checkpoint
+    (a Keras model of SimpleRLPlayer) share one InferenceBatcher.
+
+        python league.py league.json [league_results.json]
+'''
+import asyncio
+import json
+import sys
+import threading
+import time
+import numpy as np
+from poke_env import RandomPlayer
+from heuristic_bot import HeuristicPlayer
+from inference_batcher import BatchedPolicyPlayer, InferenceBatcher, keras_predict
+from max_bot import MaxDamagePlayer
+from simpleRL_bot import EMBEDDING_SIZE
+
+PLAYER_CLASSES : dict = {
+    'RandomPlayer': RandomPlayer,
+    'MaxDamagePlayer': MaxDamagePlayer,
+    'HeuristicPlayer': HeuristicPlayer,
+    'BatchedPolicyPlayer': BatchedPolicyPlayer,
+}
+LEAGUE_FILE : str = 'league_results.json'
+INITIAL_RATING : float = 1500.0
+ELO_K : float = 16.0
+MAX_RETAINED_BATTLES : int = 10 # For the bots that support it, the league only needs the outcomes
+
+
+def load_checkpoint(path : str):
+    '''
+        Prediction function of a Keras model saved by dqn_model
+    '''
+    from tensorflow.python.keras.models import load_model # Only the leagues with checkpoints need TensorFlow
+    return keras_predict(load_model(path))
+
+
+def battle_score(battle) -> float:
+    '''
+        Score of the player of the battle: 1 won, 0 lost, 0.5 tied
+    '''
+    if battle.won:
+        return 1.0
+    return 0.0 if battle.lost else 0.5
+
+
+class EloRatings:
+
+    def __init__(self, names : list, initial : float = INITIAL_RATING, k : float = ELO_K):
+        self.k = k
+        self.ratings : dict = {name: initial for name in names}
+
+    def expected(self, a : str, b : str) -> float:
+        '''
+            Expected score of a against b
+        '''
+        return 1 / (1 + 10 ** ((self.ratings[b] - self.ratings[a]) / 400))
+
+    def update(self, a : str, b : str, score : float):
+        '''
+            Updates both ratings with the score of a in one battle against b
+        '''
+        change = self.k * (score - self.expected(a, b))
+        self.ratings[a] += change
+        self.ratings[b] -= change
+
+
+class BattleSlots:
+    '''
+        Global limit of concurrent battles, granted to the pairings by rounds
+    '''
+
+    def __init__(self, limit : int):
+        self.free = limit
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, wanted : int) -> int:
+        '''
+            Waits for a free slot and takes up to wanted of them, returns how many were taken
+        '''
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.free > 0)
+            granted = min(wanted, self.free)
+            self.free -= granted
+            return granted
+
+    async def release(self, n : int):
+        async with self._condition:
+            self.free += n
+            self._condition.notify_all()
+
+
+class League:
+
+    def __init__(self, entries : list, battles_per_pairing : int = 50, max_concurrent_battles : int = 16,
+                 k : float = ELO_K, verbose : bool = True):
+        for entry in entries:
+            if entry['class'] not in PLAYER_CLASSES:
+                raise ValueError(f"Unknown player class {entry['class']} of {entry['name']}")
+        self.entries = entries
+        self.names : list = [entry['name'] for entry in entries]
+        self.battles_per_pairing = battles_per_pairing
+        self.max_concurrent_battles = max_concurrent_battles
+        self.verbose = verbose
+
+        n = len(entries)
+        self.scores : np.ndarray = np.zeros((n, n)) # Points of the row against the column, ties count 1/2
+        self.games : np.ndarray = np.zeros((n, n), dtype=np.int64)
+        self.elo = EloRatings(self.names, k=k)
+        self.errors : list = []
+        self.elapsed : float = 0.0
+        self._batchers : dict = {} # checkpoint -> InferenceBatcher shared by its players
+        # The battles finish in the poke_env loop thread
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, path : str, **kwargs):
+        with open(path) as file:
+            config = json.load(file)
+        return cls(config['entries'], config.get('battles_per_pairing', 50), config.get('max_concurrent_battles', 16), **kwargs)
+
+    @property
+    def pairings(self) -> list:
+        return [(i, j) for i in range(len(self.entries)) for j in range(i + 1, len(self.entries))]
+
+    @property
+    def n_battles(self) -> int:
+        return int(self.games.sum() // 2)
+
+    def create_player(self, index : int, max_concurrent_battles : int):
+        entry = self.entries[index]
+        player_class = PLAYER_CLASSES[entry['class']]
+        kwargs = {'battle_format': 'gen9randombattle', 'max_concurrent_battles': max_concurrent_battles}
+        if player_class in (MaxDamagePlayer, HeuristicPlayer):
+            kwargs['max_retained_battles'] = MAX_RETAINED_BATTLES
+        kwargs.update(entry.get('kwargs', {}))
+        if player_class is BatchedPolicyPlayer:
+            checkpoint = entry['checkpoint']
+            if checkpoint not in self._batchers:
+                self._batchers[checkpoint] = InferenceBatcher(load_checkpoint(checkpoint), (EMBEDDING_SIZE,))
+            kwargs['batcher'] = self._batchers[checkpoint]
+        return player_class(**kwargs)
+
+    def record(self, i : int, j : int, score : float):
+        '''
+            Adds the outcome of one battle of i against j (score of i)
+        '''
+        with self._lock:
+            self.scores[i, j] += score
+            self.scores[j, i] += 1 - score
+            self.games[i, j] += 1
+            self.games[j, i] += 1
+            self.elo.update(self.names[i], self.names[j], score)
+
+    def _follow(self, player, i : int, j : int):
+        # Every finished battle of player is recorded right away
+        battle_finished_callback = player._battle_finished_callback
+
+        def recorded_battle_finished_callback(battle):
+            self.record(i, j, battle_score(battle))
+            return battle_finished_callback(battle)
+
+        player._battle_finished_callback = recorded_battle_finished_callback
+
+    async def _play_pairing(self, i : int, j : int, slots : BattleSlots):
+        per_pairing = min(self.battles_per_pairing, self.max_concurrent_battles)
+        player = self.create_player(i, per_pairing)
+        opponent = self.create_player(j, per_pairing)
+        self._follow(player, i, j)
+
+        remaining = self.battles_per_pairing
+        while remaining > 0:
+            n_battles = await slots.acquire(min(remaining, per_pairing))
+            try:
+                await player.battle_against(opponent, n_battles=n_battles)
+            finally:
+                await slots.release(n_battles)
+            remaining -= n_battles
+        if self.verbose:
+            print(f'{self.names[i]} vs {self.names[j]}: {self.scores[i, j]} - {self.scores[j, i]}')
+
+    async def run(self):
+        '''
+            Plays every pairing, a failed pairing is reported in errors without stopping the others
+        '''
+        slots = BattleSlots(self.max_concurrent_battles)
+        start_time = time.time()
+        pairings = self.pairings
+        results = await asyncio.gather(*(self._play_pairing(i, j, slots) for i, j in pairings), return_exceptions=True)
+        self.elapsed += time.time() - start_time
+        for (i, j), result in zip(pairings, results):
+            if isinstance(result, Exception):
+                self.errors.append({'pairing': [self.names[i], self.names[j]], 'error': repr(result)})
+        return self
+
+    def win_rates(self) -> np.ndarray:
+        '''
+            Win rate of every row against every column, NaN where they did not play
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.games > 0, self.scores / self.games, np.nan)
+
+    def standings(self) -> list:
+        '''
+            (name, rating, win rate over all its battles) from the best rating
+        '''
+        games = self.games.sum(axis=1)
+        win_rates = np.divide(self.scores.sum(axis=1), games, out=np.zeros(len(self.names)), where=games > 0)
+        return sorted(((name, self.elo.ratings[name], float(win_rate)) for name, win_rate in zip(self.names, win_rates)),
+                      key=lambda standing: -standing[1])
+
+    def to_json(self) -> dict:
+        return {
+            'names': self.names,
+            'win_rates': [[None if np.isnan(value) else float(value) for value in row] for row in self.win_rates()],
+            'games': self.games.tolist(),
+            'ratings': self.elo.ratings,
+            'standings': self.standings(),
+            'n_battles': self.n_battles,
+            'elapsed': self.elapsed,
+            'errors': self.errors,
+        }
+
+    def save(self, path : str = LEAGUE_FILE):
+        with open(path, 'w') as file:
+            json.dump(self.to_json(), file, indent=4)
+
+    def print_report(self):
+        width = max(len(name) for name in self.names) + 2
+        print(' ' * width + ''.join(f'{name[:8]:>9}' for name in self.names))
+        for name, row in zip(self.names, self.win_rates()):
+            print(f'{name:<{width}}' + ''.join('        -' if np.isnan(value) else f'{value:9.2f}' for value in row))
+        print()
+        for rank, (name, rating, win_rate) in enumerate(self.standings(), 1):
+            print(f'{rank}. {name:<{width}} Elo {rating:7.1f}   win rate {win_rate:.2f}')
+        print(f'{self.n_battles} battles in {self.elapsed:.1f} s')
+        for error in self.errors:
+            print(f"Pairing {' vs '.join(error['pairing'])} failed: {error['error']}")
+
+
+if __name__ == '__main__':
+    league = League.from_config(sys.argv[1])
+    asyncio.run(league.run())
+    league.print_report()
+    league.save(sys.argv[2] if len(sys.argv) > 2 else LEAGUE_FILE)
@@ -0,0 +1,502 @@
+'''
+    In-process stand-in for the Showdown server, for bulk evaluations without network.
+
+    LocalBattle plays a simplified gen 9 random singles battle between two players. Each
+    player gets its own poke_env Battle, registered in player.battles and fed with the
+    protocol messages and requests the server would send from its side (exact HP of its
+    pokemons, percentages of the opponents), so choose_move, embed_battle and the
+    battle finished callbacks of the bots run unchanged. The decisions of both sides
+    are awaited together, so the async players (BatchedPolicyPlayer) batch across the
+    battles running at the same time.
+
+    The rules are a subset of the game:
+        - teams of 6 random species of the gen 9 pokedex with 4 moves of their learnset
+          (as battle_fixtures), level 80 and the stats of random battle sets,
+        - switches first, then moves by priority and speed (boosts, paralysis), ties at
+          random,
+        - damage of DamageBatch (gen 9 formula, STAB and tera STAB, types, boosts, burn)
+          with a random roll between its lowest and highest value, and accuracy,
+        - drain, recoil, the boosts of the moves, the statuses of the status moves
+          (with the immunities of the types), healing moves, sleep, paralysis,
+          burn/poison/toxic residual damage, one terastallization per side,
+        - abilities, items, critical hits, secondary effects, fixed damage moves,
+          weather, terrains, hazards, multi-turn moves, PP and switching moves are left
+          out, and a battle still going after MAX_TURNS turns is a tie.
+    The battles are deterministic: the same seed gives the same teams and rolls. The
+    bots also draw from the global random module (choose_random_move, on every forced
+    switch of HeuristicPlayer and MaxDamagePlayer, RandomPlayer), so it is reseeded from
+    the RNG of the battle before every decision. An async player is reseeded when its
+    coroutine starts, the draws it makes after its first await are not covered.
+    poke_env copies every pokemon of a Battle into battle.observations at every turn,
+    about a third of the time of a local battle. None of the bots reads them, they are
+    only recorded with record_observations=True.
+
+        arena = LocalArena(seed=0)
+        asyncio.run(arena.battle_against(player, opponent, n_battles=1000))
+'''
+import asyncio
+import random
+from typing import Awaitable
+from poke_env.data import GenData
+from poke_env.data.normalize import to_id_str
+from poke_env.environment.battle import Battle
+from poke_env.environment.move import Move
+from poke_env.environment.move_category import MoveCategory
+from poke_env.environment.pokemon import Pokemon
+from poke_env.environment.pokemon_type import PokemonType
+from poke_env.environment.status import Status
+from poke_env.environment.target import Target
+from battle_fixtures import GEN, LEVEL, TERA_TYPES, _gen9_species, _random_moves
+from damage_calc import BOOST_MULTIPLIERS, STATS, DamageBatch, estimate_stat
+
+MAX_TURNS : int = 300
+TEAM_SIZE : int = 6
+BOOSTS : tuple = ('atk', 'def', 'spa', 'spd', 'spe', 'accuracy', 'evasion')
+FULL_PARALYSIS : float = 0.25
+SLEEP_TURNS : tuple = (1, 3)
+RESIDUAL_DAMAGE : dict = {Status.BRN: 1 / 16, Status.PSN: 1 / 8} # Toxic: turns / 16
+STATUS_IMMUNITIES : dict = {
+    Status.BRN: (PokemonType.FIRE,),
+    Status.PAR: (PokemonType.ELECTRIC,),
+    Status.PSN: (PokemonType.POISON, PokemonType.STEEL),
+    Status.TOX: (PokemonType.POISON, PokemonType.STEEL),
+    Status.FRZ: (PokemonType.ICE,),
+    Status.SLP: (),
+}
+
+_POKEDEX : dict = GenData.from_gen(GEN).pokedex
+# (priority, accuracy, damaging, status, boosts, targets self, self boosts, heal, drain, recoil) by move id
+_MOVE_EFFECTS : dict = {}
+_TEAM_SPECIES : list = None
+
+
+def move_effects(move) -> tuple:
+    effects = _MOVE_EFFECTS.get(move.id)
+    if effects is None:
+        damaging = move.category != MoveCategory.STATUS and move.base_power > 0
+        effects = (move.priority, move.accuracy, damaging, move.status, move.boosts, move.target == Target.SELF,
+                   move.self_boost, move.heal, move.drain, move.recoil)
+        _MOVE_EFFECTS[move.id] = effects
+    return effects
+
+
+class LocalPokemon:
+    '''
+        State of a pokemon in the engine, the truth the Battles of both sides mirror
+    '''
+
+    def __init__(self, species : str, ability : str, moves : list, tera_type : str):
+        self.species = species
+        self.ability = ability
+        self.moves = moves
+        self.tera_type = tera_type
+        base_stats = _POKEDEX[to_id_str(species)]['baseStats']
+        self.stats : dict = {stat: estimate_stat(base_stats[stat], LEVEL, hp=stat == 'hp') for stat in STATS}
+        self.max_hp : int = self.stats['hp']
+        self.hp : int = self.max_hp
+        self.status : Status = None
+        self.boosts : dict = dict.fromkeys(BOOSTS, 0)
+        self.terastallized : bool = False
+        self.sleep_turns : int = 0
+        self.toxic_turns : int = 0
+        self._request : dict = None # Parts of the request that never change
+        self.move_requests : list = [{'move': move, 'id': move, 'pp': 16, 'maxpp': 16, 'target': 'normal', 'disabled': False}
+                                     for move in moves]
+
+    @property
+    def fainted(self) -> bool:
+        return self.hp <= 0
+
+    @property
+    def speed(self) -> float:
+        speed = self.stats['spe'] * BOOST_MULTIPLIERS[self.boosts['spe'] + 6]
+        return speed / 2 if self.status == Status.PAR else speed
+
+    def condition(self, own : bool) -> str:
+        '''
+            HP as the server shows it: exact to its side, in percent to the opponent
+        '''
+        if self.fainted:
+            return '0 fnt'
+        hp = f'{self.hp}/{self.max_hp}' if own else f'{max(1, round(100 * self.hp / self.max_hp))}/100'
+        return f'{hp} {self.status.name.lower()}' if self.status else hp
+
+    def request(self, role : str, active : bool) -> dict:
+        if self._request is None:
+            self._request = {
+                'ident': f'{role}: {self.species}',
+                'details': f'{self.species}, L{LEVEL}',
+                'stats': {stat: self.stats[stat] for stat in STATS[1:]},
+                'moves': self.moves,
+                'baseAbility': self.ability,
+                'item': '',
+                'teraType': self.tera_type,
+            }
+        return {**self._request, 'condition': self.condition(own=True), 'active': active,
+                'terastallized': self.tera_type if self.terastallized else ''}
+
+
+def team_species() -> list:
+    '''
+        Species of battle_fixtures with one form per name: the forms of Gastrodon and
+        Tatsugiri share their name, so they would share their ident in a team
+    '''
+    global _TEAM_SPECIES
+    if _TEAM_SPECIES is None:
+        names = set()
+        _TEAM_SPECIES = []
+        for species in _gen9_species():
+            if species[0] not in names:
+                names.add(species[0])
+                _TEAM_SPECIES.append(species)
+    return _TEAM_SPECIES
+
+
+def random_team(rng : random.Random) -> list:
+    return [LocalPokemon(name, ability, _random_moves(rng, moves), rng.choice(TERA_TYPES))
+            for name, ability, moves in rng.sample(team_species(), TEAM_SIZE)]
+
+
+class LocalSide:
+
+    def __init__(self, player, role : str, team : list, battle_tag : str):
+        self.player = player
+        self.role = role
+        self.team = team
+        self.active : int = 0
+        self.can_tera : bool = True
+        self.battle = Battle(battle_tag, player.username, player.logger, gen=GEN)
+        self.n_invalid_orders : int = 0
+        self._rqid : int = 0
+        self._views : list = None
+
+    @property
+    def mon(self) -> LocalPokemon:
+        return self.team[self.active]
+
+    @property
+    def ident(self) -> str:
+        return f'{self.role}a: {self.mon.species}'
+
+    @property
+    def defeated(self) -> bool:
+        return all(mon.fainted for mon in self.team)
+
+    @property
+    def views(self) -> list:
+        '''
+            Pokemon of the Battle of the side, in the order of team: the Battle adds them
+            in the order of the first request
+        '''
+        if self._views is None:
+            self._views = list(self.battle.team.values())
+        return self._views
+
+    def view(self, mon : LocalPokemon) -> Pokemon:
+        '''
+            Pokemon of mon in the Battle of its own side, with the stats of the requests
+        '''
+        return self.views[self.team.index(mon)]
+
+    def request(self, force_switch : bool = False) -> dict:
+        self._rqid += 1
+        request = {
+            'rqid': self._rqid,
+            'side': {'name': self.player.username, 'id': self.role,
+                     'pokemon': [mon.request(self.role, i == self.active) for i, mon in enumerate(self.team)]},
+        }
+        if force_switch:
+            request['forceSwitch'] = [True]
+        else:
+            active = {'moves': self.mon.move_requests}
+            if self.can_tera:
+                active['canTerastallize'] = self.mon.tera_type
+            request['active'] = [active]
+        return request
+
+    def switch_index(self, mon : Pokemon) -> int:
+        '''
+            Index in the team of a Pokemon of the Battle, None if it can not switch in
+        '''
+        for i, view in enumerate(self.views):
+            if view is mon:
+                return i if not self.team[i].fainted and i != self.active else None
+        return None
+
+    def first_switch(self) -> int:
+        return next(i for i, mon in enumerate(self.team) if not mon.fainted and i != self.active)
+
+
+async def _seeded(order : Awaitable, seed : int):
+    random.seed(seed)
+    return await order
+
+
+class LocalBattle:
+    '''
+        One battle between two players, played by run
+    '''
+
+    def __init__(self, player, opponent, seed, battle_tag : str = None, record_observations : bool = False):
+        self.rng = random.Random(seed)
+        self.record_observations = record_observations
+        battle_tag = battle_tag or f'battle-gen9randombattle-local-{seed}'
+        self.sides = (LocalSide(player, 'p1', random_team(self.rng), battle_tag),
+                      LocalSide(opponent, 'p2', random_team(self.rng), battle_tag))
+        self.turn : int = 0
+        self.winner : LocalSide = None
+
+    def _send(self, *parts):
+        for side in self.sides:
+            side.battle.parse_message(['', *parts])
+
+    def _send_condition(self, kind : str, side : LocalSide, mon : LocalPokemon, *parts):
+        '''
+            Message with the HP of mon, each side seeing its own version
+        '''
+        for viewer in self.sides:
+            viewer.battle.parse_message(['', kind, f'{side.role}a: {mon.species}', *parts, mon.condition(viewer is side)])
+
+    def _switch_in(self, side : LocalSide, index : int):
+        side.mon.boosts = dict.fromkeys(BOOSTS, 0)
+        side.mon.toxic_turns = 0
+        side.active = index
+        self._send_condition('switch', side, side.mon, f'{side.mon.species}, L{LEVEL}')
+
+    async def _decide(self, sides : list, force_switch : bool = False) -> list:
+        '''
+            Actions of the sides. Only the orders of the async players are awaited, the
+            others cost no task
+        '''
+        orders = []
+        for side in sides:
+            side.battle.parse_request(side.request(force_switch))
+            seed = self.rng.getrandbits(64)
+            random.seed(seed)
+            order = side.player.choose_move(side.battle)
+            orders.append(_seeded(order, seed) if isinstance(order, Awaitable) else order)
+        pending = [order for order in orders if isinstance(order, Awaitable)]
+        if pending:
+            results = iter(await asyncio.gather(*pending))
+            orders = [next(results) if isinstance(order, Awaitable) else order for order in orders]
+        return [self._action(side, order, force_switch) for side, order in zip(sides, orders)]
+
+    def _action(self, side : LocalSide, order, force_switch : bool) -> tuple:
+        '''
+            ('switch', index) or ('move', move id, terastallize), the invalid orders
+            replaced as the server default would
+        '''
+        choice = getattr(order, 'order', None)
+        if isinstance(choice, Pokemon):
+            index = side.switch_index(choice)
+            if index is not None:
+                return ('switch', index)
+        elif isinstance(choice, Move) and not force_switch and choice.id in side.mon.moves:
+            return ('move', choice.id, bool(getattr(order, 'terastallize', False)) and side.can_tera)
+        if choice is not None:
+            side.n_invalid_orders += 1
+        if force_switch:
+            return ('switch', side.first_switch())
+        return ('move', side.mon.moves[0], False)
+
+    def _boost(self, side : LocalSide, mon : LocalPokemon, boosts : dict):
+        for stat, amount in boosts.items():
+            before = mon.boosts[stat]
+            mon.boosts[stat] = max(-6, min(6, before + amount))
+            change = mon.boosts[stat] - before
+            if change:
+                self._send('-boost' if change > 0 else '-unboost', f'{side.role}a: {mon.species}', stat, str(abs(change)))
+
+    def _damage(self, side : LocalSide, mon : LocalPokemon, amount : int):
+        mon.hp = max(0, mon.hp - amount)
+        self._send_condition('-damage', side, mon)
+        if mon.fainted:
+            self._send('faint', f'{side.role}a: {mon.species}')
+
+    def _heal(self, side : LocalSide, mon : LocalPokemon, amount : int):
+        if amount > 0 and mon.hp < mon.max_hp:
+            mon.hp = min(mon.max_hp, mon.hp + amount)
+            self._send_condition('-heal', side, mon)
+
+    def _set_status(self, side : LocalSide, mon : LocalPokemon, status : Status):
+        view = side.view(mon)
+        types = (view.type_1, view.type_2) # Pokemon.types keeps the second type after terastallizing
+        if mon.status is not None or mon.fainted or any(type_ in types for type_ in STATUS_IMMUNITIES.get(status, ())):
+            return
+        mon.status = status
+        if status == Status.SLP:
+            mon.sleep_turns = self.rng.randint(*SLEEP_TURNS)
+        self._send('-status', f'{side.role}a: {mon.species}', status.name.lower())
+
+    def _can_move(self, side : LocalSide) -> bool:
+        mon = side.mon
+        if mon.status == Status.SLP:
+            mon.sleep_turns -= 1
+            if mon.sleep_turns > 0:
+                self._send('cant', side.ident, 'slp')
+                return False
+            mon.status = None
+            self._send('-curestatus', side.ident, 'slp')
+        elif mon.status == Status.FRZ:
+            if self.rng.random() >= 0.2:
+                self._send('cant', side.ident, 'frz')
+                return False
+            mon.status = None
+            self._send('-curestatus', side.ident, 'frz')
+        elif mon.status == Status.PAR and self.rng.random() < FULL_PARALYSIS:
+            self._send('cant', side.ident, 'par')
+            return False
+        return True
+
+    def _use_move(self, side : LocalSide, target : LocalSide, move_id : str):
+        if not self._can_move(side):
+            return
+        attacker = side.mon
+        move = side.view(attacker).moves[move_id]
+        _, accuracy, damaging, status, boosts, targets_self, self_boosts, heal, drain, recoil = move_effects(move)
+        self._send('move', side.ident, move_id, target.ident)
+        defender = target.mon
+        if not targets_self and defender.fainted:
+            return
+        if not targets_self and self.rng.random() >= accuracy:
+            self._send('-miss', side.ident, target.ident)
+            return
+
+        if damaging:
+            low, high = DamageBatch(side.view(attacker), [move]).ranges([target.view(defender)])
+            fraction = self.rng.uniform(float(low[0, 0, 0]), float(high[0, 0, 0]))
+            if fraction <= 0:
+                self._send('-immune', target.ident)
+                return
+            damage = min(defender.hp, max(1, int(fraction * defender.max_hp)))
+            self._damage(target, defender, damage)
+            if drain:
+                self._heal(side, attacker, max(1, int(damage * drain)))
+            if recoil:
+                self._damage(side, attacker, max(1, int(damage * recoil)))
+            if self_boosts and not attacker.fainted:
+                self._boost(side, attacker, self_boosts)
+        else:
+            if status is not None:
+                self._set_status(target, defender, status)
+            if boosts:
+                if targets_self:
+                    self._boost(side, attacker, boosts)
+                else:
+                    self._boost(target, defender, boosts)
+            if heal:
+                self._heal(side, attacker, int(heal * attacker.max_hp))
+
+    def _residual(self, side : LocalSide):
+        mon = side.mon
+        if mon.fainted:
+            return
+        if mon.status == Status.TOX:
+            mon.toxic_turns += 1
+            damage = mon.toxic_turns / 16
+        else:
+            damage = RESIDUAL_DAMAGE.get(mon.status, 0)
+        if damage:
+            self._damage(side, mon, max(1, int(damage * mon.max_hp)))
+
+    def _order_key(self, side : LocalSide, action : tuple) -> tuple:
+        priority = move_effects(side.view(side.mon).moves[action[1]])[0]
+        return (-priority, -side.mon.speed, self.rng.random())
+
+    async def _play_turn(self):
+        actions = await self._decide(self.sides)
+
+        for side, action in zip(self.sides, actions):
+            if action[0] == 'switch':
+                self._switch_in(side, action[1])
+        for side, action in zip(self.sides, actions):
+            if action[0] == 'move' and action[2]:
+                side.can_tera = False
+                side.mon.terastallized = True
+                self._send('-terastallize', side.ident, side.mon.tera_type)
+
+        movers = [(side, target, action) for (side, action), target in zip(zip(self.sides, actions), reversed(self.sides))
+                  if action[0] == 'move']
+        movers.sort(key=lambda mover: self._order_key(mover[0], mover[2]))
+        for side, target, action in movers:
+            if not side.mon.fainted:
+                self._use_move(side, target, action[1])
+        for side in sorted(self.sides, key=lambda side: -side.mon.speed):
+            self._residual(side)
+
+    async def _replace_fainted(self):
+        fainted = [side for side in self.sides if side.mon.fainted]
+        actions = await self._decide(fainted, force_switch=True)
+        for side, action in zip(fainted, actions):
+            self._switch_in(side, action[1])
+
+    def _finish(self):
+        for side in self.sides:
+            if self.winner is None:
+                side.battle.tied()
+            else:
+                side.battle.won_by(self.winner.player.username)
+        for side in self.sides:
+            side.player._battle_finished_callback(side.battle)
+
+    async def run(self):
+        '''
+            Plays the battle to the end, returns the winning player (None for a tie)
+        '''
+        for side in self.sides:
+            side.player._battles[side.battle.battle_tag] = side.battle
+            for other in self.sides:
+                side.battle.parse_message(['', 'player', other.role, other.player.username, '', ''])
+        for side in self.sides:
+            side.battle.parse_request(side.request())
+            self._send_condition('switch', side, side.mon, f'{side.mon.species}, L{LEVEL}')
+
+        while self.turn < MAX_TURNS:
+            self.turn += 1
+            if self.record_observations:
+                self._send('turn', str(self.turn))
+            else:
+                for side in self.sides:
+                    side.battle.end_turn(self.turn)
+            await self._play_turn()
+            defeated = [side for side in self.sides if side.defeated]
+            if defeated:
+                if len(defeated) == 1:
+                    self.winner = self.sides[1 - self.sides.index(defeated[0])]
+                break
+            if any(side.mon.fainted for side in self.sides):
+                await self._replace_fainted()
+        self._finish()
+        return self.winner.player if self.winner is not None else None
+
+
+class LocalArena:
+    '''
+        Plays local battles with the interface of Player.battle_against. Every battle
+        gets the next seed of the arena, so a run is reproducible from the seed
+    '''
+
+    def __init__(self, seed : int = 0, record_observations : bool = False):
+        self.seed = seed
+        self.record_observations = record_observations
+        self.n_battles : int = 0
+        self.n_turns : int = 0
+        self.n_invalid_orders : int = 0
+
+    async def battle_against(self, player, opponent, n_battles : int = 1):
+        battles = []
+        for _ in range(n_battles):
+            seed = f'{self.seed}-{self.n_battles}'
+            battles.append(LocalBattle(player, opponent, seed, f'battle-gen9randombattle-local-{seed}', self.record_observations))
+            self.n_battles += 1
+        await asyncio.gather(*(battle.run() for battle in battles))
+        for battle in battles:
+            self.n_turns += battle.turn
+            self.n_invalid_orders += sum(side.n_invalid_orders for side in battle.sides)
+
+    def stats(self) -> dict:
+        return {
+            'battles': self.n_battles,
+            'mean_turns': self.n_turns / self.n_battles if self.n_battles else 0.0,
+            'invalid_orders': self.n_invalid_orders,
+        }
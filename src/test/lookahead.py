@@ -0,0 +1,312 @@
+'''
+    Time-budgeted lookahead for HeuristicPlayer.
+
+    The battle is reduced to the HP fractions of both teams and the two active
+    pokemons. Every turn we choose a move (with or without terastallizing the active
+    pokemon) or a switch, and the opponent replies with one of its revealed moves or
+    a STAB move of each of its types. The faster pokemon attacks first and a pokemon
+    knocked out is replaced by the one of its team that hits hardest. When no revealed
+    opponent is left, an unrevealed one comes in: its moves and HP are not known, so it
+    neither deals nor takes damage. The damage of every (attacker, move, target) comes
+    from DamageBatch, computed once per decision.
+
+    The opponent is an expectation node: with probability reply_weight it plays its
+    best reply, otherwise any of its replies uniformly. Iterative deepening searches
+    1, 2, ... turns ahead and keeps the best action of the deepest completed search
+    when the time budget runs out. Values are memoized in a transposition table keyed
+    by (state, depth), shared by the iterations of a decision.
+
+    The defensive types of a terastallized pokemon of ours, statuses, boosts after
+    the current turn and switches of the opponent are not modelled.
+'''
+import time
+from poke_env.environment.field import Field
+from poke_env.environment.move import Move
+from poke_env.environment.pokemon_type import PokemonType
+from damage_calc import DamageBatch, mon_stats
+from set_index import MOVES_PER_SET
+
+TEAM_SIZE : int = 6
+KO_VALUE : float = 0.5 # Value of a pokemon still standing, on top of its HP fraction
+
+# Move assumed for every type of an opponent whose moves are not revealed yet
+STAB_MOVES : dict = {
+    PokemonType.BUG: 'xscissor', PokemonType.DARK: 'crunch', PokemonType.DRAGON: 'dragonpulse',
+    PokemonType.ELECTRIC: 'thunderbolt', PokemonType.FAIRY: 'moonblast', PokemonType.FIGHTING: 'closecombat',
+    PokemonType.FIRE: 'flamethrower', PokemonType.FLYING: 'airslash', PokemonType.GHOST: 'shadowball',
+    PokemonType.GRASS: 'energyball', PokemonType.GROUND: 'earthquake', PokemonType.ICE: 'icebeam',
+    PokemonType.NORMAL: 'bodyslam', PokemonType.POISON: 'sludgebomb', PokemonType.PSYCHIC: 'psychic',
+    PokemonType.ROCK: 'stoneedge', PokemonType.STEEL: 'flashcannon', PokemonType.WATER: 'surf',
+}
+_STAB_MOVE_OBJECTS : dict = {}
+
+
+class _Timeout(Exception):
+    pass
+
+
+def opponent_moves(mon, set_index=None) -> list:
+    '''
+        Revealed moves of the opponent, completed with its most likely moves from the set
+        index, plus a STAB move for every type they do not cover
+    '''
+    moves = [move for move in mon.moves.values() if move.base_power > 0]
+    if set_index is not None:
+        revealed = set(mon.moves)
+        for move, _ in set_index.weighted_moves(mon.species):
+            if len(revealed) >= MOVES_PER_SET:
+                break
+            if move.id not in revealed:
+                revealed.add(move.id)
+                if move.base_power > 0:
+                    moves.append(move)
+    covered = set(move.type for move in moves)
+    for type_ in mon.types:
+        if type_ in STAB_MOVES and type_ not in covered:
+            move = _STAB_MOVE_OBJECTS.get(type_)
+            if move is None:
+                move = _STAB_MOVE_OBJECTS[type_] = Move(STAB_MOVES[type_], gen=9)
+            moves.append(move)
+    return moves
+
+
+class SearchResult:
+
+    def __init__(self, action : tuple, value : float, depth : int, nodes : int, elapsed : float):
+        self.action = action # ('move', Move, terastallize) or ('switch', Pokemon)
+        self.value = value
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    @property
+    def nodes_per_second(self) -> float:
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return f'{self.action} value {self.value:.3f}, depth {self.depth}, {self.nodes} nodes, {self.nodes_per_second:.0f} nodes/s'
+
+
+class LookaheadSearch:
+
+    def __init__(self, time_budget : float = 0.05, max_depth : int = 2, reply_weight : float = 0.7, set_index=None):
+        '''
+            time_budget is in seconds per decision, max_depth in turns. With a SetIndex,
+            the unrevealed moves of the opponents are their most likely ones
+        '''
+        self.time_budget = time_budget
+        self.set_index = set_index
+        self.max_depth = max_depth
+        self.reply_weight = reply_weight
+
+        # Totals over every search, to compare latency and depth reached
+        self.n_searches : int = 0
+        self.total_nodes : int = 0
+        self.total_time : float = 0.0
+        self.depths : dict = {}
+
+    @property
+    def nodes_per_second(self) -> float:
+        return self.total_nodes / self.total_time if self.total_time else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'searches': self.n_searches,
+            'nodes_per_second': self.nodes_per_second,
+            'mean_time': self.total_time / self.n_searches if self.n_searches else 0.0,
+            'depths': dict(sorted(self.depths.items())),
+        }
+
+    def _prepare(self, battle):
+        '''
+            Damage tables of the decision, as lists for a fast lookup during the search
+        '''
+        mine = [battle.active_pokemon] + [mon for mon in battle.team.values() if mon is not battle.active_pokemon]
+        theirs = [battle.opponent_active_pokemon] + [
+            mon for mon in battle.opponent_team.values() if mon is not battle.opponent_active_pokemon
+        ]
+        self._mine, self._theirs = mine, theirs
+        self._unknown = TEAM_SIZE - len(theirs)
+        self._switches = [mine.index(mon) for mon in battle.available_switches]
+        self._can_tera = bool(battle.can_tera)
+
+        # _my_damage[i][j][m][tera]: damage of our pokemon i with its move m on opponent j
+        self._my_moves = [battle.available_moves] + [list(mon.moves.values()) for mon in mine[1:]]
+        self._my_damage = []
+        for i, mon in enumerate(mine):
+            if self._my_moves[i]:
+                batch = DamageBatch(mon, self._my_moves[i], battle.can_tera if i == 0 else None)
+                damage = batch.expected(theirs, battle.weather).transpose(2, 0, 1).tolist()
+            else:
+                damage = [[] for _ in theirs]
+            self._my_damage.append(damage)
+
+        # _their_damage[j][r][i]: damage of opponent j with its reply r on our pokemon i
+        self._their_damage = []
+        for mon in theirs:
+            moves = opponent_moves(mon, self.set_index)
+            if moves:
+                damage = DamageBatch(mon, moves).expected(mine, battle.weather)[:, 0, :].tolist()
+            else:
+                damage = []
+            self._their_damage.append(damage)
+        # The unrevealed opponent, index len(theirs), has no known replies
+        self._unrevealed = len(theirs)
+        self._their_damage.append([])
+
+        # Hardest hit of every pokemon on every opponent, to choose the replacements
+        # _my_best[j][i]: of our pokemon i on opponent j, _their_best[i][j]: of opponent j on our pokemon i
+        self._my_best = [[max((max(row[0], row[1]) for row in self._my_damage[i][j]), default=0.0) for i in range(len(mine))]
+                         for j in range(len(theirs))]
+        self._their_best = [[max((row[i] for row in self._their_damage[j]), default=0.0) for j in range(len(theirs))]
+                            for i in range(len(mine))]
+
+        trick_room = Field.TRICK_ROOM in battle.fields
+        my_speed = [self._speed(mon, i == 0) for i, mon in enumerate(mine)]
+        their_speed = [self._speed(mon, j == 0) for j, mon in enumerate(theirs)]
+        # _first[i][j]: whether our pokemon i moves before opponent j (ties go to the opponent)
+        self._first = [[(a < b) if trick_room else (a > b) for b in their_speed] for a in my_speed]
+
+    @staticmethod
+    def _speed(mon, active : bool) -> float:
+        speed = mon_stats(mon)[5]
+        if active:
+            boost = mon.boosts['spe']
+            speed *= max(2, 2 + boost) / max(2, 2 - boost)
+        return speed
+
+    def _evaluate(self, state : tuple) -> float:
+        _, _, my_hp, their_hp, _ = state
+        mine = sum(my_hp) + KO_VALUE * sum(hp > 0 for hp in my_hp)
+        theirs = sum(their_hp) + KO_VALUE * sum(hp > 0 for hp in their_hp) + (1 + KO_VALUE) * self._unknown
+        return mine - theirs
+
+    @staticmethod
+    def _replacement(hp : tuple, hits : list) -> int:
+        '''
+            Pokemon still standing with the hardest hit, -1 when none is left
+        '''
+        best, best_hit = -1, -1.0
+        for k, value in enumerate(hp):
+            if value > 0 and hits[k] > best_hit:
+                best, best_hit = k, hits[k]
+        return best
+
+    def _actions(self, state : tuple, root : bool) -> list:
+        mine, _, my_hp, _, tera_used = state
+        actions = []
+        n_moves = len(self._my_moves[mine])
+        for m in range(n_moves):
+            actions.append(('move', m, False))
+        # Only the active pokemon of the decision can terastallize, it is the only tera type known
+        if mine == 0 and self._can_tera and not tera_used:
+            for m in range(n_moves):
+                actions.append(('move', m, True))
+        switches = self._switches if root else [i for i, hp in enumerate(my_hp) if hp > 0 and i != mine]
+        for i in switches:
+            actions.append(('switch', i))
+        return actions
+
+    def _transition(self, state : tuple, action : tuple, reply : int) -> tuple:
+        mine, theirs, my_hp, their_hp, tera_used = state
+        if theirs == self._unrevealed:
+            # Only our switches change anything against an unrevealed opponent
+            return (action[1] if action[0] == 'switch' else mine), theirs, my_hp, their_hp, tera_used
+        my_hp = list(my_hp)
+        their_hp = list(their_hp)
+        their_damage = self._their_damage[theirs]
+
+        if action[0] == 'switch':
+            mine = action[1]
+            if their_damage:
+                my_hp[mine] -= their_damage[reply][mine]
+        else:
+            _, m, tera = action
+            tera_used = tera_used or tera
+            hit = self._my_damage[mine][theirs][m][1 if tera_used and mine == 0 else 0]
+            taken = their_damage[reply][mine] if their_damage else 0.0
+            if self._first[mine][theirs]:
+                their_hp[theirs] -= hit
+                if their_hp[theirs] > 0:
+                    my_hp[mine] -= taken
+            else:
+                my_hp[mine] -= taken
+                if my_hp[mine] > 0:
+                    their_hp[theirs] -= hit
+
+        my_hp = tuple(max(hp, 0.0) for hp in my_hp)
+        their_hp = tuple(max(hp, 0.0) for hp in their_hp)
+        if their_hp[theirs] == 0:
+            theirs = self._replacement(their_hp, self._their_best[mine])
+            if theirs < 0:
+                theirs = self._unrevealed if self._unknown else 0
+        if my_hp[mine] == 0:
+            mine = max(self._replacement(my_hp, self._my_best[theirs]), 0)
+        return mine, theirs, my_hp, their_hp, tera_used
+
+    def _terminal(self, state : tuple) -> bool:
+        _, _, my_hp, their_hp, _ = state
+        return not any(my_hp) or (not any(their_hp) and self._unknown == 0)
+
+    def _value(self, state : tuple, depth : int, root : bool = False) -> tuple:
+        '''
+            Returns (value, best action) of the state searched depth turns ahead
+        '''
+        self._nodes += 1
+        if self._nodes & 255 == 0 and time.perf_counter() > self._deadline:
+            raise _Timeout()
+        if depth == 0 or self._terminal(state):
+            return self._evaluate(state), None
+
+        key = (state, depth)
+        entry = self._table.get(key)
+        if entry is not None and not root:
+            return entry
+
+        n_replies = len(self._their_damage[state[1]]) or 1
+        best_value, best_action = -float('inf'), None
+        for action in self._actions(state, root):
+            values = [self._value(self._transition(state, action, reply), depth - 1)[0] for reply in range(n_replies)]
+            value = self.reply_weight * min(values) + (1 - self.reply_weight) * sum(values) / n_replies
+            if value > best_value:
+                best_value, best_action = value, action
+
+        self._table[key] = (best_value, best_action)
+        return best_value, best_action
+
+    def search(self, battle) -> SearchResult:
+        start_time = time.perf_counter()
+        self._deadline = start_time + self.time_budget
+        self._nodes = 0
+        self._table = {}
+        self._prepare(battle)
+
+        state = (
+            0, 0,
+            tuple(mon.current_hp_fraction for mon in self._mine),
+            tuple(mon.current_hp_fraction for mon in self._theirs),
+            bool(battle.active_pokemon.terastallized),
+        )
+        best = (0.0, ('move', 0, False))
+        depth_reached = 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                value, action = self._value(state, depth, root=True)
+            except _Timeout:
+                break
+            if action is not None:
+                best = (value, action)
+                depth_reached = depth
+
+        value, action = best
+        if action[0] == 'move':
+            action = ('move', battle.available_moves[action[1]], action[2])
+        else:
+            action = ('switch', self._mine[action[1]])
+
+        elapsed = time.perf_counter() - start_time
+        self.n_searches += 1
+        self.total_nodes += self._nodes
+        self.total_time += elapsed
+        self.depths[depth_reached] = self.depths.get(depth_reached, 0) + 1
+        return SearchResult(action, value, depth_reached, self._nodes, elapsed)
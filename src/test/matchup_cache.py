@@ -0,0 +1,85 @@
+'''
+    Memoization of the matchup scores of HeuristicPlayer.
+
+    The type advantage, the moves advantage and the type-dependent part of the
+    weather score only depend on the species, the current types, the tera state and
+    the known moves of both pokemons. They are cached under a key made of those
+    values, shared by all the battles of a player: a terastallization or a newly
+    revealed move changes the key, so a stale value is never returned. The tera state
+    is part of the key on its own, a pokemon terastallizing into its own first type
+    keeps the same types.
+'''
+from collections import OrderedDict
+
+
+def mon_key(mon, with_moves : bool = True) -> tuple:
+    '''
+        (species, types, terastallized, tera type, move ids) of a pokemon
+    '''
+    if with_moves:
+        return mon.species, mon.types, mon.terastallized, mon.tera_type, tuple(mon.moves)
+    return mon.species, mon.types, mon.terastallized, mon.tera_type
+
+
+def matchup_key(kind, my_mon, opp_mon) -> tuple:
+    '''
+        Key of a score of my_mon against opp_mon. Only my moves matter for the scores
+        cached, the opponent is keyed by species and types
+    '''
+    return (kind,) + mon_key(my_mon) + mon_key(opp_mon, with_moves=False)
+
+
+class MatchupCache:
+    '''
+        Bounded LRU of matchup scores with hit and miss counters
+    '''
+
+    def __init__(self, maxsize : int = 4096):
+        self.maxsize = maxsize
+        self._entries : OrderedDict = OrderedDict()
+        self.hits : int = 0
+        self.misses : int = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key : tuple):
+        '''
+            Cached value of key, None when missing
+        '''
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key : tuple, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def cached(self, kind, my_mon, opp_mon, compute):
+        '''
+            Value of compute() for the matchup, computed only on a miss
+        '''
+        key = matchup_key(kind, my_mon, opp_mon)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {'size': len(self), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
@@ -1,14 +1,33 @@
 from poke_env import Player
+from battle_retention import BattleRetention
+from damage_calc import expected_damage
+
+class MaxDamagePlayer(BattleRetention, Player):
+
+    def __init__(self, use_damage_calc : bool = False, **kwargs):
+        '''
+            With use_damage_calc, the moves are ranked by their expected damage
+            instead of their base power
+        '''
+        super().__init__(**kwargs)
+        self.use_damage_calc = use_damage_calc
 
-class MaxDamagePlayer(Player):
     def choose_move(self, battle):
         # If the player can attack, it will
         if battle.available_moves:
             # Finds the move that does the most damage
-            best_move = max(battle.available_moves, key=lambda move: move.base_power)
+            if self.use_damage_calc:
+                can_tera = battle.can_tera
+                damage = expected_damage(battle.active_pokemon, battle.available_moves, battle.opponent_active_pokemon,
+                                         battle.weather, can_tera)
+                tera = 1 if can_tera else 0
+                best_move = battle.available_moves[max(range(len(damage)), key=lambda i: damage[i][tera])]
+            else:
+                # A plain max over at most 4 moves is cheaper than any array
+                best_move = max(battle.available_moves, key=lambda move: move.base_power)
             if battle.can_tera:
                 return self.create_order(best_move, terastallize=True)
             
             return self.create_order(best_move)
         else:
-            return self.choose_random_move(battle)
\ No newline at end of file
+            return self.choose_random_move(battle)
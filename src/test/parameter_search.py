@@ -0,0 +1,267 @@
+'''
+    Population based search of the weights of the contextual score of HeuristicPlayer.
+
+    A CMA-ES strategy proposes a population of parameter vectors per generation and
+    every candidate is evaluated at the same time, each one by its own HeuristicPlayer
+    playing against its own opponent in the same event loop. The best vector found so
+    far is written to parameters.json as soon as it improves, so HeuristicPlayer can
+    load it at startup with parameters_file.
+'''
+import asyncio
+import json
+import os
+import time
+import numpy as np
+from heuristic_bot import HeuristicPlayer, PARAMETER_NAMES, PARAMETERS_FILE
+from sequential_test import SPRT, evaluate_sequential
+
+
+class CMAES:
+    '''
+        (mu/mu_w, lambda)-CMA-ES maximizing the fitness given to tell
+    '''
+
+    def __init__(self, mean, sigma : float = 0.25, population_size : int = None, seed : int = None):
+        self.mean = np.array(mean, dtype=np.float64)
+        self.sigma = sigma
+        self.n = n = len(self.mean)
+        self.population_size = population_size or 4 + int(3 * np.log(n))
+        if self.population_size < 2:
+            raise ValueError(f'CMA-ES needs a population of at least 2 candidates, got {self.population_size}')
+        self.rng = np.random.default_rng(seed)
+        self.generation : int = 0
+
+        # Recombination weights of the best half of the population
+        self.mu = self.population_size // 2
+        weights = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / np.sum(self.weights ** 2)
+
+        # Adaptation constants
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        # Evolution paths and covariance matrix (C = B diag(D^2) B^T)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.C = np.eye(n)
+        self.B = np.eye(n)
+        self.D = np.ones(n)
+
+    def ask(self) -> np.ndarray:
+        '''
+            Samples a new population, shape (population_size, n)
+        '''
+        z = self.rng.standard_normal((self.population_size, self.n))
+        return self.mean + self.sigma * (z * self.D) @ self.B.T
+
+    def tell(self, candidates : np.ndarray, fitness : np.ndarray):
+        '''
+            Updates the distribution with the fitness of the candidates (higher is better)
+        '''
+        self.generation += 1
+        order = np.argsort(-np.asarray(fitness), kind='stable')
+        selected = candidates[order[:self.mu]]
+        y = (selected - self.mean) / self.sigma
+        y_w = self.weights @ y
+        self.mean = self.weights @ selected
+
+        c_invsqrt = self.B @ np.diag(1 / self.D) @ self.B.T
+        self.ps = (1 - self.cs) * self.ps + np.sqrt(self.cs * (2 - self.cs) * self.mueff) * c_invsqrt @ y_w
+        hsig = np.linalg.norm(self.ps) / np.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) / self.chi_n < 1.4 + 2 / (self.n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * y_w
+
+        rank_one = np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.C
+        rank_mu = (y.T * self.weights) @ y
+        self.C = (1 - self.c1 - self.cmu) * self.C + self.c1 * rank_one + self.cmu * rank_mu
+        self.sigma *= np.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chi_n - 1))
+
+        self.C = (self.C + self.C.T) / 2
+        eigenvalues, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+    def state(self) -> dict:
+        '''
+            Everything tell changes, with the state of the RNG of ask, as JSON types
+        '''
+        return {
+            'mean': self.mean.tolist(),
+            'sigma': self.sigma,
+            'generation': self.generation,
+            'population_size': self.population_size,
+            'pc': self.pc.tolist(),
+            'ps': self.ps.tolist(),
+            'C': self.C.tolist(),
+            'B': self.B.tolist(),
+            'D': self.D.tolist(),
+            'rng': self.rng.bit_generator.state,
+        }
+
+    def load_state(self, state : dict):
+        if len(state['mean']) != self.n:
+            raise ValueError(f"State of {len(state['mean'])} parameters for a strategy of {self.n}")
+        if state.get('population_size', self.population_size) != self.population_size:
+            raise ValueError(f"State of a population of {state['population_size']} for a strategy of {self.population_size}")
+        self.mean = np.array(state['mean'])
+        self.sigma = state['sigma']
+        self.generation = state['generation']
+        for name in ('pc', 'ps', 'C', 'B', 'D'):
+            setattr(self, name, np.array(state[name]))
+        self.rng.bit_generator.state = state['rng']
+
+
+class ConcurrentEvaluator:
+    '''
+        Evaluates a whole population at once: every candidate gets its own HeuristicPlayer
+        and its own opponent, and all the pairs battle concurrently in the same event loop.
+        The players are reused between generations. With an arena (local_battle.LocalArena)
+        the battles are played in process instead of on the server
+    '''
+
+    def __init__(self, population_size : int, opponent_class, player_kwargs : dict = None, opponent_kwargs : dict = None,
+                 arena=None):
+        self.pairs = [
+            (HeuristicPlayer(**(player_kwargs or {})), opponent_class(**(opponent_kwargs or {})))
+            for _ in range(population_size)
+        ]
+        self.arena = arena
+        self.n_battles_played : int = 0
+
+    def _battle_against(self, player, opponent, n_battles : int):
+        if self.arena is None:
+            return player.battle_against(opponent, n_battles=n_battles)
+        return self.arena.battle_against(player, opponent, n_battles=n_battles)
+
+    async def evaluate(self, candidates : np.ndarray, n_battles : int, incumbent : float = None) -> np.ndarray:
+        '''
+            Returns the win rate of every candidate over n_battles. With an incumbent win rate,
+            every candidate stops as soon as a sequential test decides it is better or worse
+        '''
+        pairs = self.pairs[:len(candidates)]
+        for (player, _), candidate in zip(pairs, candidates):
+            player.set_parameters(dict(zip(PARAMETER_NAMES, candidate)))
+
+        if incumbent is None:
+            won_before = [player.n_won_battles for player, _ in pairs]
+            await asyncio.gather(*(self._battle_against(player, opponent, n_battles) for player, opponent in pairs))
+            self.n_battles_played += len(pairs) * n_battles
+            return np.array([(player.n_won_battles - won) / n_battles for (player, _), won in zip(pairs, won_before)])
+
+        results = await asyncio.gather(*(
+            evaluate_sequential(player, opponent, SPRT(incumbent), n_battles, arena=self.arena)
+            for player, opponent in pairs
+        ))
+        self.n_battles_played += sum(result.n_finished_battles for result in results)
+        return np.array([result.win_rate for result in results])
+
+
+def save_best_parameters(parameters : dict, path : str = PARAMETERS_FILE):
+    '''
+        Writes the parameters with a rename, so a reader never finds a half written file
+    '''
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(parameters, file, indent=4)
+    os.replace(temporary, path)
+
+
+class ParameterSearch:
+    '''
+        Drives the strategy and the evaluator, keeping track of the best vector and the
+        evaluation throughput
+    '''
+
+    def __init__(self, strategy : CMAES, evaluator : ConcurrentEvaluator, n_battles : int, parameters_file : str = PARAMETERS_FILE,
+                 early_stopping : bool = False):
+        self.strategy = strategy
+        self.early_stopping = early_stopping
+        self.evaluator = evaluator
+        self.n_battles = n_battles
+        self.parameters_file = parameters_file
+        self.best_parameters : dict = None
+        self.best_win_rate : float = -1.0
+        self.history : list = [] # (mean win rate, best win rate) per generation
+        self.n_evaluations : int = 0
+        self.elapsed : float = 0.0
+
+    @property
+    def evaluations_per_second(self) -> float:
+        return self.n_evaluations / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def battles_per_second(self) -> float:
+        return self.evaluator.n_battles_played / self.elapsed if self.elapsed else 0.0
+
+    def state(self) -> dict:
+        '''
+            State of the search between two generations, as JSON types
+        '''
+        return {
+            'strategy': self.strategy.state(),
+            'n_battles': self.n_battles,
+            'best_parameters': dict(self.best_parameters) if self.best_parameters is not None else None,
+            'best_win_rate': self.best_win_rate,
+            # Copies, the writer thread serializes them while the next generation runs
+            'history': list(self.history),
+            'n_evaluations': self.n_evaluations,
+            'elapsed': self.elapsed,
+            'n_battles_played': self.evaluator.n_battles_played,
+            # A resumed local search goes on with the next seeds of its arena
+            'arena_battles': self.evaluator.arena.n_battles if self.evaluator.arena is not None else None,
+        }
+
+    def load_state(self, state : dict):
+        if state.get('n_battles', self.n_battles) != self.n_battles:
+            raise ValueError(f"State of a search of {state['n_battles']} battles per candidate for one of {self.n_battles}")
+        self.strategy.load_state(state['strategy'])
+        self.best_parameters = state['best_parameters']
+        self.best_win_rate = state['best_win_rate']
+        self.history = [tuple(generation) for generation in state['history']]
+        self.n_evaluations = state['n_evaluations']
+        self.elapsed = state['elapsed']
+        self.evaluator.n_battles_played = state['n_battles_played']
+        if self.evaluator.arena is not None and state.get('arena_battles') is not None:
+            self.evaluator.arena.n_battles = state['arena_battles']
+
+    async def step(self):
+        '''
+            Plays one generation
+        '''
+        start_time = time.time()
+        candidates = self.strategy.ask()
+        # With early stopping, the candidates are tested against the mean win rate of the
+        # previous generation, so the clearly worse and clearly better ones stop early
+        incumbent = self.history[-1][0] if self.early_stopping and self.history else None
+        win_rates = await self.evaluator.evaluate(candidates, self.n_battles, incumbent)
+        self.strategy.tell(candidates, win_rates)
+
+        self.n_evaluations += len(candidates)
+        self.elapsed += time.time() - start_time
+        self.history.append((float(np.mean(win_rates)), float(np.max(win_rates))))
+
+        best = int(np.argmax(win_rates))
+        if win_rates[best] > self.best_win_rate:
+            self.best_win_rate = float(win_rates[best])
+            self.best_parameters = dict(zip(PARAMETER_NAMES, candidates[best].tolist()))
+            save_best_parameters(self.best_parameters, self.parameters_file)
+
+    async def run(self, generations : int, verbose : bool = True, checkpoint=None):
+        '''
+            Plays until the strategy reaches generations, a resumed search only plays the
+            ones left. checkpoint is a checkpointing.SearchCheckpoint saved after every generation
+        '''
+        while self.strategy.generation < generations:
+            await self.step()
+            if checkpoint is not None:
+                checkpoint.save(self)
+            if verbose:
+                mean_win_rate, max_win_rate = self.history[-1]
+                print(
+                    f'Generation {self.strategy.generation} completed\n'
+                    f'Mean win rate: {mean_win_rate} Best win rate: {max_win_rate} (best so far {self.best_win_rate})\n'
+                    f'{self.evaluations_per_second} evaluations/s, {self.battles_per_second} battles/s'
+                )
@@ -0,0 +1,268 @@
+'''
+    Replay memory of preallocated NumPy arrays for the DQN of SimpleRLPlayer.
+
+    Transitions (observation, action, reward, next observation, done) are written in
+    place in ring buffers sized for the fixed embedding, instead of being kept as
+    Python objects. Sampling can be uniform or proportional to the priorities kept in
+    a sum-tree. With a filename, every array lives in a memory-mapped file inside that
+    directory, so buffers with millions of transitions are paged by the OS and a new
+    run reopens the transitions of the previous one.
+
+    The keras-rl memory interface (append, get_recent_state, sample, nb_entries) is
+    implemented too, so the memory can be given to DQNAgent directly. DQNAgent never
+    gives the TD errors back: a prioritized memory goes with PrioritizedDQNAgent of
+    dqn_model, which updates the priorities of every batch it trains on.
+'''
+import json
+import os
+from collections import namedtuple
+import numpy as np
+
+# Same fields as the Experience of keras-rl
+Experience = namedtuple('Experience', 'state0, action, reward, state1, terminal1')
+
+
+def _array(directory, name : str, dtype, shape : tuple, fill=0) -> np.ndarray:
+    '''
+        In memory array, or memory-mapped file directory/name.npy reopened when it already exists
+    '''
+    if directory is None:
+        return np.full(shape, fill, dtype=dtype)
+
+    path = os.path.join(directory, name + '.npy')
+    if os.path.exists(path):
+        array = np.lib.format.open_memmap(path, mode='r+')
+        if array.shape == shape and array.dtype == np.dtype(dtype):
+            return array
+        del array
+
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    array[...] = fill
+    return array
+
+
+class SumTree:
+    '''
+        Binary tree where every node holds the sum of its children, over a power of two
+        number of leaves. Finding the leaf of a prefix sum costs log(capacity)
+    '''
+
+    def __init__(self, capacity : int, directory : str = None):
+        self.size = 1 << max(1, int(np.ceil(np.log2(capacity))))
+        self.depth = int(np.log2(self.size))
+        self.tree = _array(directory, 'priorities', np.float64, (2 * self.size,))
+
+    @property
+    def total(self) -> float:
+        return float(self.tree[1])
+
+    def update(self, indices : np.ndarray, priorities : np.ndarray):
+        nodes = np.asarray(indices, dtype=np.int64) + self.size
+        self.tree[nodes] = priorities
+        # Recomputing the parents level by level, every level in a single pass
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values : np.ndarray) -> np.ndarray:
+        '''
+            Leaves where the prefix sums given in values fall
+        '''
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            go_right = values > self.tree[left]
+            values -= np.where(go_right, self.tree[left], 0.0)
+            nodes = left + go_right
+        return nodes - self.size
+
+    def priorities(self, indices : np.ndarray) -> np.ndarray:
+        return self.tree[np.asarray(indices, dtype=np.int64) + self.size]
+
+
+class ReplayMemory:
+
+    def __init__(self, limit : int, observation_shape : tuple = (10,), prioritized : bool = False,
+                 alpha : float = 0.6, beta : float = 0.4, filename : str = None, window_length : int = 1, seed : int = None):
+        '''
+            limit is the number of transitions kept, the oldest ones are overwritten.
+            filename is a directory for the memory-mapped arrays (None keeps them in RAM)
+        '''
+        if window_length != 1:
+            raise ValueError('ReplayMemory only stores single observations (window_length=1)')
+
+        self.limit = limit
+        self.observation_shape = tuple(observation_shape)
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.window_length = window_length
+        self.filename = filename
+        self.rng = np.random.default_rng(seed)
+
+        if filename is not None:
+            os.makedirs(filename, exist_ok=True)
+        self.observations = _array(filename, 'observations', np.float32, (limit,) + self.observation_shape)
+        self.next_observations = _array(filename, 'next_observations', np.float32, (limit,) + self.observation_shape)
+        self.actions = _array(filename, 'actions', np.int32, (limit,))
+        self.rewards = _array(filename, 'rewards', np.float32, (limit,))
+        self.dones = _array(filename, 'dones', np.bool_, (limit,))
+        self.tree = SumTree(limit, filename) if prioritized else None
+
+        self.position : int = 0
+        self.size : int = 0
+        self.max_priority : float = 1.0
+        self._load_meta()
+
+        # Indices of the last batch given to keras-rl by sample, for update_priorities
+        self.last_sampled = None
+        # Last step given to append, waiting for its next observation
+        self._pending = None
+        self._pending_after_terminal : bool = False
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nb_entries(self) -> int:
+        return self.size
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.filename, 'meta.json')
+
+    def _load_meta(self):
+        if self.filename is not None and os.path.exists(self._meta_path()):
+            with open(self._meta_path()) as file:
+                self.set_meta(json.load(file))
+
+    def meta(self) -> dict:
+        '''
+            Everything of the memory that is not in the arrays: ring position, size, highest
+            priority and state of the sampling RNG
+        '''
+        return {'limit': self.limit, 'position': self.position, 'size': self.size, 'max_priority': self.max_priority,
+                'rng': self.rng.bit_generator.state}
+
+    def set_meta(self, meta : dict):
+        '''
+            Restores a meta of the same limit, the others are ignored
+        '''
+        if meta['limit'] == self.limit:
+            self.position = meta['position']
+            self.size = meta['size']
+            self.max_priority = meta['max_priority']
+            if 'rng' in meta:
+                self.rng.bit_generator.state = meta['rng']
+
+    def flush(self, meta : dict = None):
+        '''
+            Writes the arrays and the ring position to disk (only with a filename). meta is
+            a meta() taken earlier, the current one by default
+        '''
+        if self.filename is None:
+            return
+        meta = meta or self.meta()
+        for array in (self.observations, self.next_observations, self.actions, self.rewards, self.dones):
+            array.flush()
+        if self.tree is not None:
+            self.tree.tree.flush()
+
+        temporary = self._meta_path() + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(meta, file)
+        os.replace(temporary, self._meta_path())
+
+    def add(self, observation, action : int, reward : float, next_observation, done : bool):
+        i = self.position
+        self.observations[i] = observation
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_observations[i] = next_observation
+        self.dones[i] = done
+        if self.tree is not None:
+            # New transitions get the highest priority, so they are sampled at least once
+            self.tree.update([i], [self.max_priority ** self.alpha])
+
+        self.position = (i + 1) % self.limit
+        self.size = min(self.size + 1, self.limit)
+
+    def sample_indices(self, batch_size : int) -> tuple:
+        '''
+            Returns (indices, importance sampling weights) of a batch
+        '''
+        if self.tree is None:
+            return self.rng.integers(0, self.size, batch_size), np.ones(batch_size, dtype=np.float32)
+
+        # One value in every segment of the total priority
+        segment = self.tree.total / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        indices = np.minimum(self.tree.find(values), self.size - 1)
+
+        probabilities = self.tree.priorities(indices) / self.tree.total
+        weights = (self.size * probabilities) ** -self.beta
+        return indices, (weights / weights.max()).astype(np.float32)
+
+    def sample_batch(self, batch_size : int) -> tuple:
+        '''
+            Returns (indices, observations, actions, rewards, next_observations, dones, weights)
+        '''
+        indices, weights = self.sample_indices(batch_size)
+        return (
+            indices,
+            self.observations[indices],
+            self.actions[indices],
+            self.rewards[indices],
+            self.next_observations[indices],
+            self.dones[indices],
+            weights,
+        )
+
+    def update_priorities(self, indices, td_errors):
+        '''
+            Sets the priorities of sampled transitions from their TD errors
+        '''
+        if self.tree is None:
+            return
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + 1e-6
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+    # keras-rl memory interface
+
+    def append(self, observation, action, reward, terminal, training : bool = True):
+        '''
+            keras-rl gives the reward and terminal flag of a step together with the observation
+            it was taken from, the transition is stored when the next observation arrives.
+            After a terminal step keras-rl appends the last observation of the episode, which
+            does not start a transition
+        '''
+        if not training:
+            return
+        if self._pending is not None and not self._pending_after_terminal:
+            previous_observation, previous_action, previous_reward, previous_terminal = self._pending
+            self.add(previous_observation, previous_action, previous_reward, observation, previous_terminal)
+
+        self._pending_after_terminal = self._pending is not None and bool(self._pending[3])
+        self._pending = (np.array(observation, dtype=np.float32), action, reward, terminal)
+
+    def get_recent_state(self, current_observation) -> list:
+        return [current_observation]
+
+    def sample(self, batch_size : int, batch_idxs=None) -> list:
+        if batch_idxs is None:
+            batch_idxs, _ = self.sample_indices(batch_size)
+        batch_idxs = self.last_sampled = np.asarray(batch_idxs)
+        return [
+            Experience(
+                state0=[self.observations[i]],
+                action=int(self.actions[i]),
+                reward=float(self.rewards[i]),
+                state1=[self.next_observations[i]],
+                terminal1=bool(self.dones[i]),
+            )
+            for i in batch_idxs
+        ]
+
+    def get_config(self) -> dict:
+        return {'window_length': self.window_length, 'limit': self.limit, 'prioritized': self.prioritized}
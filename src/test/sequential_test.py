@@ -0,0 +1,121 @@
+'''
+    Sequential testing of win rates, to stop an evaluation as soon as its result is clear.
+
+    The outcomes of the battles are fed one by one to a Wald SPRT that compares the
+    win rate of the player against the win rate of an incumbent. The battles are
+    launched in rounds, and no new round is launched once the test has decided, so
+    a clearly better or clearly worse player only pays for a fraction of the battles.
+'''
+import math
+import time
+from statistics import NormalDist
+
+BETTER : str = 'better'
+WORSE : str = 'worse'
+
+
+def wilson_interval(wins : int, n : int, confidence : float = 0.95) -> tuple:
+    '''
+        Wilson score interval of a win rate
+    '''
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = wins / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+class SPRT:
+    '''
+        Wald's sequential probability ratio test on Bernoulli outcomes:
+        H0 win rate = incumbent - delta against H1 win rate = incumbent + delta
+    '''
+
+    def __init__(self, incumbent : float, delta : float = 0.05, alpha : float = 0.05, beta : float = 0.05):
+        self.p0 = min(max(incumbent - delta, 1e-3), 1 - 1e-3)
+        self.p1 = min(max(incumbent + delta, 1e-3), 1 - 1e-3)
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.llr : float = 0.0
+        self.decision = None
+
+    def update(self, won : bool):
+        '''
+            Adds one outcome and returns the decision (BETTER, WORSE or None while undecided)
+        '''
+        return self.update_counts(1, 0) if won else self.update_counts(0, 1)
+
+    def update_counts(self, n_won : int, n_lost : int):
+        '''
+            Adds the outcomes of a round at once: their order is unknown, so the boundaries
+            are only checked on the whole round. Returns the decision
+        '''
+        if self.decision is None:
+            self.llr += n_won * math.log(self.p1 / self.p0) + n_lost * math.log((1 - self.p1) / (1 - self.p0))
+
+            if self.llr >= self.upper:
+                self.decision = BETTER
+            elif self.llr <= self.lower:
+                self.decision = WORSE
+
+        return self.decision
+
+
+class SequentialResult:
+
+    def __init__(self, n_won_battles : int, n_finished_battles : int, decision, elapsed : float, confidence : float = 0.95):
+        self.n_won_battles = n_won_battles
+        self.n_finished_battles = n_finished_battles
+        self.decision = decision
+        self.elapsed = elapsed
+        self.confidence = confidence
+
+    @property
+    def win_rate(self) -> float:
+        return self.n_won_battles / self.n_finished_battles if self.n_finished_battles else 0.0
+
+    @property
+    def interval(self) -> tuple:
+        return wilson_interval(self.n_won_battles, self.n_finished_battles, self.confidence)
+
+    def __str__(self):
+        low, high = self.interval
+        return (
+            f"Won {self.n_won_battles} out of {self.n_finished_battles} played "
+            f"(win rate {self.win_rate:.3f}, {self.confidence:.0%} CI [{low:.3f}, {high:.3f}], "
+            f"decision: {self.decision or 'undecided'})"
+        )
+
+
+async def evaluate_sequential(player, opponent, test : SPRT, max_battles : int, round_size : int = None,
+                              arena=None) -> SequentialResult:
+    '''
+        Plays up to max_battles of player against opponent, feeding every outcome to test
+        after each round, and stops launching rounds once it decides.
+        round_size defaults to the number of battles the player runs concurrently.
+        With an arena (local_battle.LocalArena) the battles are played in process
+    '''
+    round_size = round_size or max(1, player._max_concurrent_battles)
+    # Counted from the counters of the player, its old battles may have been evicted
+    won_before, finished_before = player.n_won_battles, player.n_finished_battles
+    n_won_battles = n_finished_battles = 0
+    start_time = time.time()
+
+    while n_finished_battles < max_battles and test.decision is None:
+        n_battles = min(round_size, max_battles - n_finished_battles)
+        if arena is None:
+            await player.battle_against(opponent, n_battles=n_battles)
+        else:
+            await arena.battle_against(player, opponent, n_battles=n_battles)
+        round_won = player.n_won_battles - won_before - n_won_battles
+        round_finished = player.n_finished_battles - finished_before - n_finished_battles
+        test.update_counts(round_won, round_finished - round_won)
+        n_won_battles += round_won
+        n_finished_battles += round_finished
+
+        if round_finished == 0:
+            break # The round did not finish any battle, playing more would not either
+
+    return SequentialResult(n_won_battles, n_finished_battles, test.decision, time.time() - start_time)
@@ -0,0 +1,215 @@
+'''
+    Binary index of the gen 9 random battle sets, memory-mapped at startup.
+
+    The index is built once from the JSON of the random battle sets, either the
+    statistics format ({species: {level, moves: {move: probability}, items, abilities,
+    teraTypes}}) or the sets format ({species: {level, roles: {role: {moves: [...], ...}}}},
+    where every option of a role gets the same probability). The file holds:
+        - a header (magic, version, sizes),
+        - an open addressing hash table of the species, so a lookup reads one slot,
+        - the entries (kind, name, probability) of every species, contiguous,
+        - the names, deduplicated, as offsets into a UTF-8 blob.
+    Every process maps the same file read-only, so the pages are shared by the OS and
+    nothing is parsed at startup.
+
+        python set_index.py sets.json gen9randombattle_sets.idx
+'''
+import json
+import os
+import sys
+from collections import namedtuple
+import numpy as np
+from poke_env.data.normalize import to_id_str
+from poke_env.environment.move import Move
+
+MAGIC : bytes = b'PVGCSETS'
+VERSION : int = 1
+SET_INDEX_FILE : str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gen9randombattle_sets.idx')
+
+# Kinds of entries
+MOVE : int = 0
+ITEM : int = 1
+ABILITY : int = 2
+TERA_TYPE : int = 3
+_KINDS : dict = {'moves': MOVE, 'items': ITEM, 'abilities': ABILITY, 'teraTypes': TERA_TYPE}
+MOVES_PER_SET : int = 4
+
+_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('n_slots', '<u4'), ('n_entries', '<u4'), ('n_names', '<u4'), ('blob_size', '<u4')])
+_SLOT = np.dtype([('hash', '<u8'), ('start', '<u4'), ('count', '<u2'), ('level', '<u1'), ('used', '<u1')])
+_ENTRY = np.dtype([('kind', '<u1'), ('name', '<u4'), ('probability', '<f4')])
+
+SpeciesSets = namedtuple('SpeciesSets', 'level, moves, items, abilities, tera_types')
+
+_FNV_OFFSET : int = 0xcbf29ce484222325
+_FNV_PRIME : int = 0x100000001b3
+_MASK : int = (1 << 64) - 1
+
+
+def species_hash(species : str) -> int:
+    '''
+        64 bit FNV-1a of the species id, stable between processes (unlike hash())
+    '''
+    value = _FNV_OFFSET
+    for byte in to_id_str(species).encode():
+        value = ((value ^ byte) * _FNV_PRIME) & _MASK
+    return value or 1 # 0 marks an empty slot
+
+
+def _probabilities(data : dict) -> dict:
+    '''
+        {kind: {name: probability}} of one species, from either JSON format
+    '''
+    options = {kind: {} for kind in _KINDS}
+    if 'roles' in data:
+        roles = list(data['roles'].values())
+        for role in roles:
+            for kind in _KINDS:
+                names = role.get(kind, data.get(kind, []))
+                # A set has 4 of the moves of its role, and one of the other options
+                share = min(1.0, MOVES_PER_SET / len(names)) if kind == 'moves' and names else 1 / max(len(names), 1)
+                for name in names:
+                    options[kind][name] = options[kind].get(name, 0.0) + share / len(roles)
+        return options
+
+    for kind in _KINDS:
+        values = data.get(kind, {})
+        if isinstance(values, list):
+            values = {name: 1 / len(values) for name in values}
+        options[kind] = dict(values)
+    return options
+
+
+def build_index(sets_path : str, index_path : str = SET_INDEX_FILE):
+    '''
+        Builds the binary index from the JSON of the random battle sets
+    '''
+    with open(sets_path) as file:
+        sets = json.load(file)
+
+    names = {}
+    entries = []
+    species_records = []
+    for species, data in sets.items():
+        start = len(entries)
+        for kind, options in _probabilities(data).items():
+            for name, probability in sorted(options.items(), key=lambda option: -option[1]):
+                name = to_id_str(name) if kind != 'teraTypes' else name
+                entries.append((_KINDS[kind], names.setdefault(name, len(names)), probability))
+        species_records.append((species_hash(species), start, len(entries) - start, int(data.get('level', 0))))
+
+    n_slots = 1 << max(1, (2 * len(species_records) - 1).bit_length())
+    slots = np.zeros(n_slots, dtype=_SLOT)
+    for hash_, start, count, level in species_records:
+        slot = hash_ & (n_slots - 1)
+        while slots[slot]['used']:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = (hash_, start, count, level, 1)
+
+    encoded = [name.encode() for name in names]
+    name_offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    name_offsets[1:] = np.cumsum([len(name) for name in encoded])
+    blob = b''.join(encoded)
+
+    header = np.array([(MAGIC, VERSION, n_slots, len(entries), len(encoded), len(blob))], dtype=_HEADER)
+    temporary = index_path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(header.tobytes())
+        file.write(slots.tobytes())
+        file.write(np.array(entries, dtype=_ENTRY).tobytes())
+        file.write(name_offsets.tobytes())
+        file.write(blob)
+    os.replace(temporary, index_path)
+
+
+class SetIndex:
+    '''
+        Read-only view of an index built by build_index
+    '''
+
+    def __init__(self, path : str = SET_INDEX_FILE):
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')
+        header = self._data[:_HEADER.itemsize].view(_HEADER)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f'{path} is not a set index of version {VERSION}')
+
+        offset = _HEADER.itemsize
+        self._n_slots = int(header['n_slots'])
+        self._slots = self._data[offset:offset + self._n_slots * _SLOT.itemsize].view(_SLOT)
+        offset += self._n_slots * _SLOT.itemsize
+        self._entries = self._data[offset:offset + int(header['n_entries']) * _ENTRY.itemsize].view(_ENTRY)
+        offset += int(header['n_entries']) * _ENTRY.itemsize
+        self._name_offsets = self._data[offset:offset + (int(header['n_names']) + 1) * 4].view('<u4')
+        offset += (int(header['n_names']) + 1) * 4
+        self._blob = self._data[offset:offset + int(header['blob_size'])]
+
+        self._names : dict = {} # Names decoded so far, by id
+        self._cache : dict = {} # SpeciesSets decoded so far, by species
+        self._moves : dict = {} # Move objects of the likely moves, by species
+
+    def _slot(self, species : str):
+        hash_ = species_hash(species)
+        slot = hash_ & (self._n_slots - 1)
+        while self._slots[slot]['used']:
+            if self._slots[slot]['hash'] == hash_:
+                return self._slots[slot]
+            slot = (slot + 1) & (self._n_slots - 1)
+        return None
+
+    def __contains__(self, species : str) -> bool:
+        return self._slot(species) is not None
+
+    def _name(self, name_id : int) -> str:
+        name = self._names.get(name_id)
+        if name is None:
+            start, end = self._name_offsets[name_id], self._name_offsets[name_id + 1]
+            name = self._names[name_id] = self._blob[start:end].tobytes().decode()
+        return name
+
+    def lookup(self, species : str) -> SpeciesSets:
+        '''
+            Options of the species with their probabilities (most likely first), None if unknown
+        '''
+        species = to_id_str(species)
+        sets = self._cache.get(species)
+        if sets is None:
+            slot = self._slot(species)
+            if slot is None:
+                return None
+            options = ({}, {}, {}, {})
+            start = int(slot['start'])
+            for kind, name_id, probability in self._entries[start:start + int(slot['count'])].tolist():
+                options[kind][self._name(name_id)] = probability
+            sets = self._cache[species] = SpeciesSets(int(slot['level']), *options)
+        return sets
+
+    def likely_moves(self, species : str, n : int = 4, min_probability : float = 0.0) -> list:
+        '''
+            Move ids of the n most likely moves of the species
+        '''
+        sets = self.lookup(species)
+        if sets is None:
+            return []
+        return [move for move, probability in sets.moves.items() if probability >= min_probability][:n]
+
+    def weighted_moves(self, species : str) -> list:
+        '''
+            (Move, probability) of every move the species can have
+        '''
+        species = to_id_str(species)
+        moves = self._moves.get(species)
+        if moves is None:
+            sets = self.lookup(species)
+            moves = [] if sets is None else [(Move(move, gen=9), probability) for move, probability in sets.moves.items()]
+            self._moves[species] = moves
+        return moves
+
+
+def load_set_index(path : str = SET_INDEX_FILE) -> SetIndex:
+    '''
+        The index at path, None when it has not been built
+    '''
+    return SetIndex(path) if os.path.exists(path) else None
+
+
+if __name__ == '__main__':
+    build_index(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else SET_INDEX_FILE)
@@ -1,98 +1,189 @@
 import numpy as np
 from gymnasium.spaces import Space, Box
-from poke_env.data import GenData
 from poke_env.player import Gen9EnvSinglePlayer
 from poke_env.environment.abstract_battle import AbstractBattle
 from poke_env.player.battle_order import BattleOrder
+from batch_scoring import move_features
+from type_effectiveness import DUAL_MATRIX, type_index
+
+
+def action_to_order(player, action: int, battle: AbstractBattle) -> BattleOrder:
+    '''
+        Maps an action of the action space of SimpleRLPlayer to an order of player
+    '''
+    if (
+        action < 4
+        and action < len(battle.available_moves)
+        and not battle.force_switch
+    ):
+        return player.create_order(battle.available_moves[action])
+    elif (
+        not battle.force_switch
+        and battle.can_z_move
+        and battle.active_pokemon
+        and 0 <= action - 4 < len(battle.active_pokemon.available_z_moves)
+    ):
+        return player.create_order(
+            battle.active_pokemon.available_z_moves[action - 4], z_move=True
+        )
+    elif (
+        battle.can_mega_evolve
+        and 0 <= action - 8 < len(battle.available_moves)
+        and not battle.force_switch
+    ):
+        return player.create_order(
+            battle.available_moves[action - 8], mega=True
+        )
+    elif (
+        battle.can_dynamax
+        and 0 <= action - 12 < len(battle.available_moves)
+        and not battle.force_switch
+    ):
+        return player.create_order(
+            battle.available_moves[action - 12], dynamax=True
+        )
+    elif (
+        battle.can_tera
+        and 0 <= action - 16 < len(battle.available_moves)
+        and not battle.force_switch
+    ):
+        return player.create_order(
+            battle.available_moves[action - 16], terastallize=True
+        )
+    elif 0 <= action - 20 < len(battle.available_switches):
+        return player.create_order(battle.available_switches[action - 20])
+    else:
+        return player.choose_random_move(battle)
+
+
+def order_to_action(order : BattleOrder, battle : AbstractBattle) -> int:
+    '''
+        Action of the action space of SimpleRLPlayer that gives the order, -1 when there is none
+    '''
+    target = getattr(order, 'order', None)
+    if target is None:
+        return -1
+    if not battle.force_switch:
+        for i, move in enumerate(battle.available_moves[:4]):
+            if move is target or move.id == getattr(target, 'id', None):
+                return i + 16 if order.terastallize else i
+    for i, mon in enumerate(battle.available_switches):
+        if mon is target:
+            return i + 20
+    return -1
+
+
+# Blocks of the observation as (name, size, low, high), in order. embed_battle_into
+# and describe_embedding are both built from it
+EMBEDDING_LAYOUT : tuple = (
+    ('moves_base_power', 4, -1, 3), # -1 when the move is not available
+    ('moves_dmg_multiplier', 4, 0, 4),
+    ('fainted_mon_team', 1, 0, 1),
+    ('fainted_mon_opponent', 1, 0, 1),
+)
+EMBEDDING_SIZE : int = sum(size for _, size, _, _ in EMBEDDING_LAYOUT)
+EMBEDDING_LOW : np.ndarray = np.concatenate([np.full(size, low, dtype=np.float32) for _, size, low, _ in EMBEDDING_LAYOUT])
+EMBEDDING_HIGH : np.ndarray = np.concatenate([np.full(size, high, dtype=np.float32) for _, size, _, high in EMBEDDING_LAYOUT])
+
+
+def _layout_offsets() -> dict:
+    offsets = {}
+    start = 0
+    for name, size, _, _ in EMBEDDING_LAYOUT:
+        offsets[name] = start
+        start += size
+    return offsets
+
+
+EMBEDDING_OFFSETS : dict = _layout_offsets()
+_MOVES_BASE_POWER = EMBEDDING_OFFSETS['moves_base_power']
+_MOVES_DMG_MULTIPLIER = EMBEDDING_OFFSETS['moves_dmg_multiplier']
+_FAINTED_MON_TEAM = EMBEDDING_OFFSETS['fainted_mon_team']
+_FAINTED_MON_OPPONENT = EMBEDDING_OFFSETS['fainted_mon_opponent']
+
+
+def embed_battle_into(battle : AbstractBattle, out : np.ndarray) -> np.ndarray:
+    '''
+        Writes the observation of the battle in out (EMBEDDING_SIZE floats) and returns it
+    '''
+    # -1 indicates that the move does not have a base power
+    # or is not available
+    out[_MOVES_BASE_POWER:_MOVES_BASE_POWER + 4] = -1
+    out[_MOVES_DMG_MULTIPLIER:_MOVES_DMG_MULTIPLIER + 4] = 1
+
+    opp_mon = battle.opponent_active_pokemon
+    if battle.available_moves:
+        type_1 = type_index(opp_mon.type_1)
+        type_2 = type_index(opp_mon.type_2)
+        for i, move in enumerate(battle.available_moves):
+            if i == 4:
+                break
+            base_power, move_type = move_features(move)
+            out[_MOVES_BASE_POWER + i] = base_power / 100 # Simple rescaling to facilitate learning
+            out[_MOVES_DMG_MULTIPLIER + i] = DUAL_MATRIX[move_type, type_1, type_2]
+
+    # We count how many pokemons have fainted in each team
+    out[_FAINTED_MON_TEAM] = sum(mon.fainted for mon in battle.team.values()) / 6
+    out[_FAINTED_MON_OPPONENT] = sum(mon.fainted for mon in battle.opponent_team.values()) / 6
+
+    return out
+
+
+def embed_battles(battles : list, out : np.ndarray) -> np.ndarray:
+    '''
+        Fills the rows of a caller-provided (len(battles), EMBEDDING_SIZE) array
+    '''
+    for row, battle in zip(out, battles):
+        embed_battle_into(battle, row)
+    return out
+
+
+def embed_battle(battle : AbstractBattle) -> np.ndarray:
+    '''
+        Observation of SimpleRLPlayer for the battle, usable outside of the environment
+    '''
+    return embed_battle_into(battle, np.empty(EMBEDDING_SIZE, dtype=np.float32))
+
+
+class BattleEmbedder:
+    '''
+        Per-battle observation buffers reused across steps. Every battle alternates between
+        two buffers, so the observation returned for a step stays valid while the next one
+        is written (keras-rl keeps the previous observation until the next step)
+    '''
+
+    def __init__(self):
+        self._buffers : dict = {}
+
+    def __call__(self, battle : AbstractBattle) -> np.ndarray:
+        buffers = self._buffers.get(battle.battle_tag)
+        if buffers is None:
+            buffers = self._buffers[battle.battle_tag] = [np.empty((2, EMBEDDING_SIZE), dtype=np.float32), 0]
+        array, turn = buffers
+        buffers[1] = 1 - turn
+        out = embed_battle_into(battle, array[turn])
+
+        # The last observation of a battle is the last use of its buffers
+        if battle.finished:
+            del self._buffers[battle.battle_tag]
+        return out
+
 
 class SimpleRLPlayer(Gen9EnvSinglePlayer):
+    def __init__(self, *args, **kwargs):
+        self._embedder = BattleEmbedder()
+        super().__init__(*args, **kwargs)
+
     def calc_reward(self, last_battle, current_battle) -> float:
         return self.reward_computing_helper(
             current_battle, fainted_value=2.0, hp_value=1.0, victory_value=30.0
         )
 
     def action_to_move(self, action: int, battle: AbstractBattle) -> BattleOrder:
-        if (
-            action < 4
-            and action < len(battle.available_moves)
-            and not battle.force_switch
-        ):
-            return self.agent.create_order(battle.available_moves[action])
-        elif (
-            not battle.force_switch
-            and battle.can_z_move
-            and battle.active_pokemon
-            and 0 <= action - 4 < len(battle.active_pokemon.available_z_moves)
-        ):
-            return self.agent.create_order(
-                battle.active_pokemon.available_z_moves[action - 4], z_move=True
-            )
-        elif (
-            battle.can_mega_evolve
-            and 0 <= action - 8 < len(battle.available_moves)
-            and not battle.force_switch
-        ):
-            return self.agent.create_order(
-                battle.available_moves[action - 8], mega=True
-            )
-        elif (
-            battle.can_dynamax
-            and 0 <= action - 12 < len(battle.available_moves)
-            and not battle.force_switch
-        ):
-            return self.agent.create_order(
-                battle.available_moves[action - 12], dynamax=True
-            )
-        elif (
-            battle.can_tera
-            and 0 <= action - 16 < len(battle.available_moves)
-            and not battle.force_switch
-        ):
-            return self.agent.create_order(
-                battle.available_moves[action - 16], terastallize=True
-            )
-        elif 0 <= action - 20 < len(battle.available_switches):
-            return self.agent.create_order(battle.available_switches[action - 20])
-        else:
-            return self.agent.choose_random_move(battle)
+        return action_to_order(self.agent, action, battle)
 
     def embed_battle(self, battle : AbstractBattle):
-        # -1 indicates that the move does not have a base power
-        # or is not available
-        moves_base_power = -np.ones(4)
-        moves_dmg_multiplier = np.ones(4)
-        for i, move in enumerate(battle.available_moves):
-            moves_base_power[i] = (
-                move.base_power / 100
-            )  # Simple rescaling to facilitate learning
-            if move.type:
-                moves_dmg_multiplier[i] = move.type.damage_multiplier(
-                    battle.opponent_active_pokemon.type_1,
-                    battle.opponent_active_pokemon.type_2,
-                    type_chart=GenData.from_gen(8).type_chart
-                )
-
-        # We count how many pokemons have fainted in each team
-        fainted_mon_team = len([mon for mon in battle.team.values() if mon.fainted]) / 6
-        fainted_mon_opponent = (
-            len([mon for mon in battle.opponent_team.values() if mon.fainted]) / 6
-        )
-
-        # Final vector with 10 components
-        final_vector = np.concatenate(
-            [
-                moves_base_power,
-                moves_dmg_multiplier,
-                [fainted_mon_team, fainted_mon_opponent],
-            ]
-        )
-        return np.float32(final_vector)
+        return self._embedder(battle)
 
     def describe_embedding(self) -> Space:
-        low = [-1, -1, -1, -1, 0, 0, 0, 0, 0, 0]
-        high = [3, 3, 3, 3, 4, 4, 4, 4, 1, 1]
-        return Box(
-            np.array(low, dtype=np.float32),
-            np.array(high, dtype=np.float32),
-            dtype=np.float32,
-        )
\ No newline at end of file
+        return Box(EMBEDDING_LOW, EMBEDDING_HIGH, dtype=np.float32)
\ No newline at end of file
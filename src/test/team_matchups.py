@@ -0,0 +1,77 @@
+'''
+    Matrix of the switch scores of our team against the known team of the opponent.
+
+    Every cell is the score best_switch_action gives to one of our pokemons against
+    one opponent (typing advantage + moves advantage). The matrix lives in the
+    context of a battle and is only recomputed where something changed: a row when
+    one of our pokemons reveals a move or terastallizes, a column when an opponent is
+    revealed or terastallizes. Choosing a switch is then a lookup in a column.
+'''
+import numpy as np
+from batch_scoring import SwitchBatch
+from matchup_cache import mon_key
+
+TEAM_SIZE : int = 6
+
+
+class TeamMatchups:
+
+    def __init__(self):
+        self.rows : dict = {} # our pokemon -> row
+        self.columns : dict = {} # opponent pokemon -> column
+        self._row_keys : list = []
+        self._column_keys : list = []
+        self.scores : np.ndarray = np.zeros((TEAM_SIZE, TEAM_SIZE))
+        self.n_updated_cells : int = 0
+
+    def _grow(self, n_rows : int, n_columns : int):
+        # Illusion and forme changes can reveal more than TEAM_SIZE pokemons
+        rows, columns = self.scores.shape
+        if n_rows > rows or n_columns > columns:
+            scores = np.zeros((max(rows, n_rows), max(columns, n_columns)))
+            scores[:rows, :columns] = self.scores
+            self.scores = scores
+
+    @staticmethod
+    def _refresh(index : dict, keys : list, mons, with_moves : bool) -> list:
+        '''
+            Registers the new pokemons and returns the indices whose key changed
+        '''
+        changed = []
+        for mon in mons:
+            key = mon_key(mon, with_moves)
+            i = index.get(mon)
+            if i is None:
+                index[mon] = i = len(keys)
+                keys.append(key)
+                changed.append(i)
+            elif keys[i] != key:
+                keys[i] = key
+                changed.append(i)
+        return changed
+
+    def update(self, battle):
+        '''
+            Recomputes the rows and columns of the pokemons that changed since the last update
+        '''
+        changed_rows = self._refresh(self.rows, self._row_keys, battle.team.values(), True)
+        changed_columns = self._refresh(self.columns, self._column_keys, battle.opponent_team.values(), False)
+        if not changed_rows and not changed_columns:
+            return
+        self._grow(len(self.rows), len(self.columns))
+
+        my_mons = list(self.rows)
+        for opp_mon, column in self.columns.items():
+            # A changed column needs every row, the others only the changed rows
+            rows = range(len(my_mons)) if column in changed_columns else changed_rows
+            if rows:
+                self.scores[list(rows), column] = SwitchBatch([my_mons[row] for row in rows]).scores(opp_mon)
+                self.n_updated_cells += len(rows)
+
+    def switch_scores(self, battle, candidates : list, opp_mon) -> np.ndarray:
+        '''
+            Scores of the candidates against opp_mon, read from the matrix
+        '''
+        self.update(battle)
+        column = self.columns[opp_mon]
+        return self.scores[[self.rows[mon] for mon in candidates], column]
@@ -0,0 +1,217 @@
+'''
+    Tournament runner that shards the battles of a matchup across worker processes.
+
+    Every worker process owns one local Showdown server (one port) and keeps its own
+    pair of players, so the battles of a long run use as many cores as servers are
+    running. The battles are split in chunks that are handed to the workers one at a
+    time, so a chunk that fails (a crashed worker or a server hiccup) is retried or
+    reported without losing the chunks that already finished.
+'''
+import asyncio
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from poke_env import ServerConfiguration
+
+
+AUTHENTICATION_URL : str = "https://play.pokemonshowdown.com/action.php?"
+
+# State of each worker process
+_worker_port = None
+_worker_players : dict = {}
+
+
+def local_server_configuration(port : int) -> ServerConfiguration:
+    return ServerConfiguration(f"ws://localhost:{port}/showdown/websocket", AUTHENTICATION_URL)
+
+
+def split_battles(n_battles : int, n_chunks : int) -> list:
+    '''
+        Splits n_battles in n_chunks sizes as even as possible (empty chunks are dropped)
+    '''
+    sizes = [n_battles // n_chunks + (1 if i < n_battles % n_chunks else 0) for i in range(n_chunks)]
+    return [size for size in sizes if size > 0]
+
+
+def _worker_loop(port : int, connection):
+    '''
+        Main loop of a worker process, plays the chunks received through connection
+    '''
+    global _worker_port
+    _worker_port = port
+
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        try:
+            connection.send(('done', run_chunk(*task)))
+        except Exception as e:
+            connection.send(('error', repr(e)))
+
+
+def _worker_pair(player_spec : tuple, opponent_spec : tuple) -> tuple:
+    '''
+        Players of this worker for the matchup, created once and reused by every chunk
+    '''
+    key = (repr(player_spec), repr(opponent_spec))
+    if key not in _worker_players:
+        server_configuration = local_server_configuration(_worker_port)
+        player_class, player_kwargs = player_spec
+        opponent_class, opponent_kwargs = opponent_spec
+        _worker_players[key] = (
+            player_class(server_configuration=server_configuration, **player_kwargs),
+            opponent_class(server_configuration=server_configuration, **opponent_kwargs),
+        )
+    return _worker_players[key]
+
+
+def run_chunk(player_spec : tuple, opponent_spec : tuple, n_battles : int) -> dict:
+    '''
+        Plays n_battles of the matchup in this worker and returns its counters
+    '''
+    player, opponent = _worker_pair(player_spec, opponent_spec)
+    won_before = player.n_won_battles
+    finished_before = player.n_finished_battles
+
+    start_time = time.time()
+    asyncio.run(player.battle_against(opponent, n_battles=n_battles))
+
+    return {
+        'port': _worker_port,
+        'n_battles': n_battles,
+        'n_won_battles': player.n_won_battles - won_before,
+        'n_finished_battles': player.n_finished_battles - finished_before,
+        'elapsed': time.time() - start_time,
+    }
+
+
+class TournamentResult:
+    '''
+        Counters of a sharded run, aggregated over every chunk that finished
+    '''
+
+    def __init__(self, n_battles : int):
+        self.n_battles = n_battles
+        self.n_won_battles : int = 0
+        self.n_finished_battles : int = 0
+        self.chunks : list = []
+        self.failed_chunks : list = []
+        self.elapsed : float = 0.0
+
+    def add_chunk(self, chunk : dict):
+        self.chunks.append(chunk)
+        self.n_won_battles += chunk['n_won_battles']
+        self.n_finished_battles += chunk['n_finished_battles']
+
+    @property
+    def n_lost_battles(self) -> int:
+        return self.n_finished_battles - self.n_won_battles
+
+    @property
+    def win_rate(self) -> float:
+        return self.n_won_battles / self.n_finished_battles if self.n_finished_battles else 0.0
+
+    @property
+    def battles_per_second(self) -> float:
+        return self.n_finished_battles / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"Won {self.n_won_battles} out of {self.n_finished_battles} played "
+            f"({len(self.failed_chunks)} failed chunks of {self.n_battles} requested battles)\n"
+            f"Time elapsed: {self.elapsed} ({self.battles_per_second} battles/s)"
+        )
+
+
+class _Worker:
+    '''
+        Worker process bound to one port, and the chunk it is playing
+    '''
+
+    def __init__(self, context, port : int):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(port, child_connection), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.chunk = None
+
+    def submit(self, chunk : tuple, player_spec : tuple, opponent_spec : tuple):
+        self.chunk = chunk
+        try:
+            self.connection.send((player_spec, opponent_spec, chunk[0]))
+        except (BrokenPipeError, OSError):
+            pass # The worker is dead, the main loop charges the chunk as failed
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def run_tournament(player_spec : tuple, opponent_spec : tuple, n_battles : int, ports : list,
+                   chunk_size : int = 50, retries : int = 1) -> TournamentResult:
+    '''
+        Plays n_battles of player against opponent split across one worker per port.
+
+        player_spec and opponent_spec are (player class, kwargs) tuples, the players are
+        created inside the workers pointing to their own server. Chunks that fail or whose
+        worker crashes are retried up to `retries` times, then they are recorded as failed
+    '''
+    result = TournamentResult(n_battles)
+    n_chunks = max(len(ports), -(-n_battles // chunk_size))
+    pending = deque((size, 0) for size in split_battles(n_battles, n_chunks))
+    context = multiprocessing.get_context('spawn') # poke_env runs its own loop thread, forking it is unsafe
+    workers = {port: _Worker(context, port) for port in ports}
+    start_time = time.time()
+
+    def chunk_failed(chunk : tuple, error : str):
+        size, attempt = chunk
+        if attempt < retries:
+            pending.append((size, attempt + 1))
+        else:
+            result.failed_chunks.append({'n_battles': size, 'error': error})
+
+    try:
+        while True:
+            for worker in workers.values():
+                if worker.chunk is None and pending:
+                    worker.submit(pending.popleft(), player_spec, opponent_spec)
+
+            busy = [worker for worker in workers.values() if worker.chunk is not None]
+            if not busy:
+                break
+            wait([worker.connection for worker in busy] + [worker.process.sentinel for worker in busy])
+
+            for port, worker in workers.items():
+                if worker.chunk is None:
+                    continue
+                if worker.connection.poll():
+                    chunk = worker.chunk
+                    worker.chunk = None
+                    try:
+                        status, payload = worker.connection.recv()
+                    except EOFError:
+                        status, payload = 'error', 'worker crashed'
+                    if status == 'done':
+                        result.add_chunk(payload)
+                    else:
+                        chunk_failed(chunk, payload)
+                elif not worker.process.is_alive():
+                    chunk_failed(worker.chunk, f'worker crashed with exit code {worker.process.exitcode}')
+                    worker.chunk = None
+
+                # A crashed worker is replaced so its server keeps being used
+                if not worker.process.is_alive():
+                    workers[port] = _Worker(context, port)
+    finally:
+        for worker in workers.values():
+            worker.close()
+
+    result.elapsed = time.time() - start_time
+    return result
@@ -0,0 +1,273 @@
+'''
+    Streaming log of the trajectories of the players, for offline analysis and training.
+
+    Every decision is a row of:
+        - battle: index of the battle in the battle_tags and players columns of the shard
+          (both players of a battle share its tag),
+        - turn,
+        - embedding: observation of SimpleRLPlayer (EMBEDDING_SIZE floats),
+        - action: action of the action space of SimpleRLPlayer that gives the order, -1 if none,
+        - components: weighted terms of the contextual score of HeuristicPlayer
+          (SCORE_COMPONENTS), NaN for the decisions taken without it,
+        - reward: the reward of the environment for SimpleRLPlayer, the outcome of the
+          battle on its last row (1 won, -1 lost, 0 tied) for the other players.
+    The rows of a battle stay in memory until it finishes, then go to a background thread
+    that groups them in shards of rows_per_shard rows. A shard is a directory with one
+    .npy file per column, memory-mapped by TrajectoryReader; with compress=True it is a
+    compressed .npz, several times smaller but read into memory.
+    The environments log the observation they already computed. For the players choosing
+    their moves, the decision side only writes the embedding in a row of a preallocated
+    block and keeps the score components as they are; the arrays of the shard are built by
+    the writer. The embedding is most of the cost, measured by the
+    'HeuristicPlayer.choose_move (trajectories)' entry of benchmark_decisions.
+    campo_combate logs the players (with --trajectories) before instrumenting them, so this
+    cost is part of the choose_move latencies of instrumentation.
+
+        logger = TrajectoryLogger('trajectories')
+        log_trajectories(player, logger)
+        ...
+        logger.close()
+'''
+import os
+import queue
+import threading
+from typing import Awaitable
+import numpy as np
+from heuristic_bot import SCORE_COMPONENTS
+from simpleRL_bot import EMBEDDING_SIZE, embed_battle_into, order_to_action
+
+COLUMNS : tuple = ('battle', 'turn', 'embedding', 'action', 'components', 'reward', 'battle_tags', 'players')
+SHARD_PREFIX : str = 'shard_'
+ROWS_PER_BLOCK : int = 1024 # Embeddings allocated at once by the logger
+_NO_COMPONENTS : np.ndarray = np.full(len(SCORE_COMPONENTS), np.nan, dtype=np.float32)
+
+
+def outcome_reward(battle) -> float:
+    if battle.won:
+        return 1.0
+    return -1.0 if battle.lost else 0.0
+
+
+def _shard_number(name : str) -> int:
+    return int(name[len(SHARD_PREFIX):].split('.')[0])
+
+
+def _shard_names(directory : str) -> list:
+    return sorted((name for name in os.listdir(directory) if name.startswith(SHARD_PREFIX) and not name.endswith('.tmp')),
+                  key=_shard_number)
+
+
+class TrajectoryLogger:
+    '''
+        Collects the rows of the battles on the decision side and writes the shards in a
+        background thread. New shards follow the ones already in directory
+    '''
+
+    def __init__(self, directory : str, rows_per_shard : int = 50_000, compress : bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.rows_per_shard = rows_per_shard
+        self.compress = compress
+        self._pending : dict = {} # battle -> rows [turn, embedding, action, components, reward]
+        self._block : np.ndarray = np.empty((0, EMBEDDING_SIZE), dtype=np.float32) # Embedding rows, filled in order
+        self._block_row : int = 0
+        self._queue : queue.Queue = queue.Queue()
+        shards = _shard_names(directory)
+        self._next_shard : int = _shard_number(shards[-1]) + 1 if shards else 0
+        self.n_rows : int = 0
+        self.n_battles : int = 0
+        self.n_shards_written : int = 0
+        self._thread = threading.Thread(target=self._write_loop, name='trajectory-writer', daemon=True)
+        self._thread.start()
+
+    def log_turn(self, battle, action : int, components=None, reward : float = 0.0, embedding=None):
+        '''
+            Adds the row of a decision taken in battle. embedding is the observation of the
+            battle when the caller already has it, it is copied. components are kept as given
+        '''
+        if self._block_row == len(self._block):
+            # The rows still pending keep the previous block alive until they are written
+            self._block = np.empty((ROWS_PER_BLOCK, EMBEDDING_SIZE), dtype=np.float32)
+            self._block_row = 0
+        row = self._block[self._block_row]
+        self._block_row += 1
+        if embedding is None:
+            embed_battle_into(battle, row)
+        else:
+            row[:] = embedding
+        self._pending.setdefault(battle, []).append([battle.turn, row, action, components, reward])
+
+    def add_reward(self, battle, reward : float):
+        '''
+            Adds reward to the last row of the battle
+        '''
+        rows = self._pending.get(battle)
+        if rows:
+            rows[-1][4] += reward
+
+    def end_battle(self, battle, reward : float = 0.0):
+        '''
+            Adds reward to the last row of the battle and hands its rows to the writer
+        '''
+        rows = self._pending.pop(battle, None)
+        if rows:
+            rows[-1][4] += reward
+            self.n_rows += len(rows)
+            self.n_battles += 1
+            self._queue.put((battle.battle_tag, battle.player_username, rows))
+
+    def close(self):
+        '''
+            Writes the battles still running as they are, then the last shard, and waits for the writer
+        '''
+        for battle, rows in self._pending.items():
+            self.n_rows += len(rows)
+            self.n_battles += 1
+            self._queue.put((battle.battle_tag, battle.player_username, rows))
+        self._pending.clear()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        battles = []
+        n_rows = 0
+        while True:
+            battle = self._queue.get()
+            if battle is None:
+                break
+            battles.append(battle)
+            n_rows += len(battle[2])
+            if n_rows >= self.rows_per_shard:
+                self._write_shard(battles)
+                battles = []
+                n_rows = 0
+        if battles:
+            self._write_shard(battles)
+
+    def _write_shard(self, battles : list):
+        rows = [row for _, _, battle_rows in battles for row in battle_rows]
+        columns = {
+            'battle': np.repeat(np.arange(len(battles), dtype=np.int32), [len(battle_rows) for _, _, battle_rows in battles]),
+            'turn': np.array([row[0] for row in rows], dtype=np.int16),
+            'embedding': np.array([row[1] for row in rows], dtype=np.float32).reshape(len(rows), EMBEDDING_SIZE),
+            'action': np.array([row[2] for row in rows], dtype=np.int16),
+            'components': np.array([_NO_COMPONENTS if row[3] is None else row[3] for row in rows],
+                                   dtype=np.float32).reshape(len(rows), len(SCORE_COMPONENTS)),
+            'reward': np.array([row[4] for row in rows], dtype=np.float32),
+            'battle_tags': np.array([tag for tag, _, _ in battles]),
+            'players': np.array([player for _, player, _ in battles]),
+        }
+
+        # Written under a temporary name and renamed, so a reader never finds half a shard
+        name = os.path.join(self.directory, f'{SHARD_PREFIX}{self._next_shard:05d}')
+        if self.compress:
+            with open(name + '.npz.tmp', 'wb') as file:
+                np.savez_compressed(file, **columns)
+            os.replace(name + '.npz.tmp', name + '.npz')
+        else:
+            os.makedirs(name + '.tmp', exist_ok=True)
+            for column, values in columns.items():
+                np.save(os.path.join(name + '.tmp', column + '.npy'), values)
+            os.replace(name + '.tmp', name)
+        self._next_shard += 1
+        self.n_shards_written += 1
+
+
+class TrajectoryReader:
+    '''
+        Shards of a directory written by TrajectoryLogger, oldest first
+    '''
+
+    def __init__(self, directory : str):
+        self.directory = directory
+        self.shards : list = [os.path.join(directory, name) for name in _shard_names(directory)]
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def shard(self, index : int) -> dict:
+        '''
+            Columns of a shard, memory-mapped when it is not compressed
+        '''
+        path = self.shards[index]
+        if path.endswith('.npz'):
+            with np.load(path) as shard:
+                return {column: shard[column] for column in COLUMNS}
+        return {column: np.load(os.path.join(path, column + '.npy'), mmap_mode='r') for column in COLUMNS}
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.shard(index)
+
+    def column(self, name : str) -> np.ndarray:
+        '''
+            A row column of every shard, concatenated in memory
+        '''
+        return np.concatenate([shard[name] for shard in self])
+
+
+def log_trajectories(player, logger : TrajectoryLogger):
+    '''
+        Logs every decision of player in logger. Works with the players choosing their moves
+        (HeuristicPlayer, MaxDamagePlayer) and with the environments (SimpleRLPlayer).
+        A player already logged only switches to the new logger
+    '''
+    already_logged = hasattr(player, '_trajectory_logger')
+    player._trajectory_logger = logger
+    if already_logged:
+        return player
+
+    if hasattr(player, 'action_to_move'):
+        action_to_move = player.action_to_move
+        calc_reward = player.calc_reward
+        embed = player.embed_battle
+        observations = {} # battle -> last observation, the one the action is chosen on
+
+        def logged_embed_battle(battle):
+            observations[battle] = observation = embed(battle)
+            return observation
+
+        def logged_action_to_move(action, battle):
+            order = action_to_move(action, battle)
+            player._trajectory_logger.log_turn(battle, int(action), embedding=observations.get(battle))
+            return order
+
+        def logged_calc_reward(last_battle, current_battle):
+            reward = calc_reward(last_battle, current_battle)
+            if current_battle.finished:
+                player._trajectory_logger.end_battle(current_battle, reward)
+                observations.pop(current_battle, None)
+            else:
+                player._trajectory_logger.add_reward(current_battle, reward)
+            return reward
+
+        player.embed_battle = logged_embed_battle
+        player.action_to_move = logged_action_to_move
+        player.calc_reward = logged_calc_reward
+        return player
+
+    choose_move = player.choose_move
+    battle_finished_callback = player._battle_finished_callback
+    score_components = getattr(player, 'score_components', None)
+
+    def log(battle, order):
+        components = score_components(battle) if score_components is not None else None
+        player._trajectory_logger.log_turn(battle, order_to_action(order, battle), components)
+        return order
+
+    async def log_async(battle, order):
+        return log(battle, await order)
+
+    def logged_choose_move(battle):
+        order = choose_move(battle)
+        if isinstance(order, Awaitable):
+            return log_async(battle, order)
+        return log(battle, order)
+
+    def logged_battle_finished_callback(battle):
+        player._trajectory_logger.end_battle(battle, outcome_reward(battle))
+        return battle_finished_callback(battle)
+
+    player.choose_move = logged_choose_move
+    player._battle_finished_callback = logged_battle_finished_callback
+    return player
@@ -0,0 +1,83 @@
+'''
+    Type effectiveness engine built once per process.
+
+    TYPE_MATRIX[attacker, defender] holds the damage multiplier of one attacking type
+    on one defending type, indexed by the PokemonType enum ordinals (value - 1). The
+    18 regular types come from the gen 8 chart the bots have always used, plus the
+    ??? and Stellar types (always neutral) and an extra NO_TYPE slot used for the
+    missing second type of mono-typed pokemon.
+
+    DUAL_MATRIX[attacker, type_1, type_2] holds the final multiplier against a dual
+    type, so a lookup for a whole pokemon is a single indexing operation.
+'''
+import numpy as np
+from poke_env.data import GenData
+from poke_env.environment.pokemon_type import PokemonType
+
+
+N_TYPES : int = len(PokemonType)
+NO_TYPE : int = N_TYPES # Index used when the pokemon does not have a second type
+_NEUTRAL_TYPES = (PokemonType.THREE_QUESTION_MARKS, PokemonType.STELLAR)
+
+
+def type_index(type_) -> int:
+    '''
+        Returns the ordinal of the type in the matrices (NO_TYPE for None)
+    '''
+    if type_ is None:
+        return NO_TYPE
+    return type_.value - 1
+
+
+def _build_type_matrix(type_chart : dict) -> np.ndarray:
+    matrix = np.ones((N_TYPES + 1, N_TYPES + 1), dtype=np.float64)
+    for attacker in PokemonType:
+        if attacker in _NEUTRAL_TYPES:
+            continue
+        for defender in PokemonType:
+            if defender.name in type_chart:
+                matrix[type_index(attacker), type_index(defender)] = type_chart[defender.name][attacker.name]
+
+    return matrix
+
+
+def _build_dual_matrix(matrix : np.ndarray) -> np.ndarray:
+    dual = matrix[:, :, None] * matrix[:, None, :]
+    # Same rule as PokemonType.damage_multiplier: a neutral first type makes the hit neutral
+    for type_ in _NEUTRAL_TYPES:
+        dual[:, type_index(type_), :] = 1.0
+    dual.setflags(write=False)
+
+    return dual
+
+
+TYPE_MATRIX : np.ndarray = _build_type_matrix(GenData.from_gen(8).type_chart)
+TYPE_MATRIX.setflags(write=False)
+DUAL_MATRIX : np.ndarray = _build_dual_matrix(TYPE_MATRIX)
+
+
+def damage_multiplier(attack_type, type_1, type_2=None) -> float:
+    '''
+        Equivalent to attack_type.damage_multiplier(type_1, type_2) with the gen 8 chart
+    '''
+    return float(DUAL_MATRIX[type_index(attack_type), type_index(type_1), type_index(type_2)])
+
+
+def multiplier_against(attack_type, mon) -> float:
+    '''
+        Multiplier of attack_type against the current types of mon (tera type included)
+    '''
+    type_1, type_2 = mon.types
+    return float(DUAL_MATRIX[type_index(attack_type), type_index(type_1), type_index(type_2)])
+
+
+def best_multiplier(attacker_types, defender_types) -> float:
+    '''
+        Best multiplier that any of attacker_types achieves against defender_types.
+        Returns -inf when the attacker has no known types
+    '''
+    rows = [type_index(type_) for type_ in attacker_types if type_]
+    if not rows:
+        return -np.inf
+    type_1, type_2 = defender_types
+    return float(DUAL_MATRIX[rows, type_index(type_1), type_index(type_2)].max())
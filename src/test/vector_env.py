@@ -0,0 +1,109 @@
+'''
+    Vectorized environment running N SimpleRLPlayer battles at the same time.
+
+    Every sub environment is a SimpleRLPlayer with its own opponent. A step sends the
+    N actions at once and waits for the N battles in a thread pool, so the time spent
+    waiting on the server overlaps instead of adding up. The observations of
+    embed_battle are stacked in a (N, 10) array, the rewards of calc_reward in a (N,)
+    array, and a finished battle is reset in the same step: its last observation is
+    returned in infos['final_obs'] and the stacked row holds the first observation of
+    the next battle.
+'''
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+from simpleRL_bot import SimpleRLPlayer
+
+try:
+    from gymnasium.vector import AutoresetMode
+except ImportError: # gymnasium < 1.0 only has the same step autoreset of this wrapper
+    AutoresetMode = None
+
+
+class SimpleRLVectorEnv(VectorEnv):
+
+    def __init__(self, n_envs : int, opponent_factory, env_class=SimpleRLPlayer, **env_kwargs):
+        '''
+            opponent_factory is called once per sub environment to create its opponent,
+            env_kwargs are given to every SimpleRLPlayer
+        '''
+        env_kwargs.setdefault('start_challenging', True)
+        self.envs = [env_class(opponent=opponent_factory(), **env_kwargs) for _ in range(n_envs)]
+        self.num_envs = n_envs
+        self.single_observation_space = self.envs[0].observation_space
+        self.single_action_space = self.envs[0].action_space
+        self.observation_space = batch_space(self.single_observation_space, n_envs)
+        self.action_space = batch_space(self.single_action_space, n_envs)
+        self.metadata = {'autoreset_mode': AutoresetMode.SAME_STEP} if AutoresetMode else {}
+        self.closed = False
+
+        self._executor = ThreadPoolExecutor(max_workers=n_envs)
+        self._observations = np.zeros((n_envs,) + self.single_observation_space.shape, dtype=self.single_observation_space.dtype)
+        self._rewards = np.zeros(n_envs, dtype=np.float64)
+        self._terminations = np.zeros(n_envs, dtype=np.bool_)
+        self._truncations = np.zeros(n_envs, dtype=np.bool_)
+
+        self.n_steps : int = 0
+        self.n_episodes : int = 0
+        self.step_time : float = 0.0
+
+    @property
+    def steps_per_second(self) -> float:
+        '''
+            Environment steps (one per sub environment) per second of step time
+        '''
+        return self.n_steps / self.step_time if self.step_time else 0.0
+
+    def reset(self, *, seed=None, options=None):
+        seeds = [None if seed is None else seed + i for i in range(self.num_envs)]
+        results = list(self._executor.map(lambda i: self.envs[i].reset(seed=seeds[i], options=options), range(self.num_envs)))
+
+        infos = {}
+        for i, (observation, info) in enumerate(results):
+            self._observations[i] = observation
+            infos = self._add_info(infos, info, i)
+
+        return self._observations.copy(), infos
+
+    def _step_env(self, i : int, action) -> tuple:
+        env = self.envs[i]
+        observation, reward, terminated, truncated, info = env.step(action)
+        final = None
+        if terminated or truncated:
+            final = (observation, info)
+            observation, info = env.reset()
+        return observation, reward, terminated, truncated, info, final
+
+    def step(self, actions):
+        start_time = time.time()
+        results = list(self._executor.map(self._step_env, range(self.num_envs), actions))
+
+        infos = {}
+        for i, (observation, reward, terminated, truncated, info, final) in enumerate(results):
+            self._observations[i] = observation
+            self._rewards[i] = reward
+            self._terminations[i] = terminated
+            self._truncations[i] = truncated
+            infos = self._add_info(infos, info, i)
+            if final is not None:
+                final_observation, final_info = final
+                infos = self._add_info(infos, {'final_obs': final_observation, 'final_info': final_info}, i)
+                self.n_episodes += 1
+
+        self.n_steps += self.num_envs
+        self.step_time += time.time() - start_time
+
+        return (
+            self._observations.copy(),
+            self._rewards.copy(),
+            self._terminations.copy(),
+            self._truncations.copy(),
+            infos,
+        )
+
+    def close_extras(self, **kwargs):
+        for env in self.envs:
+            env.close(**kwargs)
+        self._executor.shutdown()